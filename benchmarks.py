@@ -0,0 +1,478 @@
+"""文本处理的微基准测试，以及基于模拟 Ollama 服务的端到端基准测试。
+
+用法：
+    python benchmarks.py            # 运行全部基准
+    python benchmarks.py words      # 只运行字数统计基准
+    python benchmarks.py think_fuzz # 在每个切分位置上校验 <think> 标签解析
+    python benchmarks.py e2e        # 端到端：写作、大纲并行、评估、修改流程的客户端开销
+    python benchmarks.py replay     # 回放磁带（环境变量 NOVEL_CASSETTE 指定，未指定时先从模拟服务录制一盘）
+    python benchmarks.py dedup      # 写作要求去重：LSH 查询 vs 逐条比较，以及改写后的写作要求的检出率
+    python benchmarks.py library    # 小说库：十万篇时的列表、筛选和全文检索延迟
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import platform
+import tempfile
+import subprocess
+
+from novel_engine import count_words, NovelEngine, save_novel
+from text_stream import WordCounter, ThinkTagParser
+from metrics_exporter import EVAL_TOKENS
+from generation_metrics import StreamTimer
+from cassette import CassetteRecorder, ReplayClient
+from requirement_dedup import RequirementDeduplicator
+from novel_library import NovelLibrary
+
+try:
+    import resource  # 仅Unix
+except ImportError:
+    resource = None
+
+RESULTS_FILE = "benchmark_results.jsonl"
+
+SAMPLE_PARAGRAPH = "她站在雨夜的站台上，望着远去的列车。Goodbye, my love. 心里默念着那句没有说出口的话。\n"
+
+
+# 生成指定长度的样例文本，按模型输出的粒度（每块1-6个字符）切分为流式文本块
+def make_stream(total_chars, seed=0):
+    text = (SAMPLE_PARAGRAPH * (total_chars // len(SAMPLE_PARAGRAPH) + 1))[:total_chars]
+    rng = random.Random(seed)
+    chunks = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 6)
+        chunks.append(text[i:i + size])
+        i += size
+    return text, chunks
+
+
+def _timeit(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# 字数统计：全文正则扫描 vs 增量统计
+def bench_word_counter(sizes=(100_000, 1_000_000)):
+    print("== 字数统计 ==")
+    print(f"{'字符数':>10} {'全文扫描/次':>14} {'增量查询/次':>14} {'增量累计喂入':>14} {'每秒2次查询的开销比':>20}")
+    for size in sizes:
+        text, chunks = make_stream(size)
+
+        full_scan = _timeit(lambda: count_words(text))
+
+        counter = WordCounter()
+        for chunk in chunks:
+            counter.feed(chunk)
+        assert counter.total == count_words(text)
+        query = _timeit(lambda: counter.total, repeat=1000)
+
+        def feed_all():
+            c = WordCounter()
+            for chunk in chunks:
+                c.feed(chunk)
+        feed_total = _timeit(feed_all, repeat=3)
+
+        # 以60 tokens/s生成size个字符所需的时间内，状态栏每500毫秒查询一次的总开销
+        seconds = len(chunks) / 60
+        # 旧方式：每秒2次全文扫描，文本从0增长到size，平均每次扫描一半长度
+        old_cost = 2 * seconds * full_scan / 2
+        new_cost = feed_total + query * seconds * 2
+        print(f"{size:>10} {full_scan * 1000:>12.2f}ms {query * 1e6:>12.3f}us {feed_total * 1000:>12.1f}ms "
+              f"{old_cost / new_cost:>19.1f}x")
+
+
+# 原先的 process_text_chunk（去掉界面更新部分），仅用于对比
+def legacy_process_text_chunk(text_chunk, state):
+    text_chunk = text_chunk.replace("</thind>", "</think>")
+    original_chunk = text_chunk
+    story_content = ""
+    while "<think>" in text_chunk:
+        think_start = text_chunk.find("<think>")
+        story_content += text_chunk[:think_start]
+        text_chunk = text_chunk[think_start:]
+        think_end = text_chunk.find("</think>")
+        if think_end != -1:
+            think_end += 8
+            state["thinking_content"] += text_chunk[:think_end]
+            text_chunk = text_chunk[think_end:]
+        else:
+            state["thinking_content"] += text_chunk
+            text_chunk = ""
+            break
+    story_content += text_chunk
+    thinking_content = state["thinking_content"]
+    if ("<think>" in thinking_content and "</think>" not in thinking_content) or \
+       (thinking_content.rfind("<think>") > thinking_content.rfind("</think>")):
+        if original_chunk != story_content:
+            return story_content
+        state["thinking_content"] += original_chunk
+        return ""
+    return story_content
+
+
+# 对整段文本一次性分离思维推理内容，作为增量解析的参照结果
+def reference_split(text):
+    story_parts = []
+    think_parts = []
+    pos = 0
+    for match in re.finditer(r'<think>(.*?)(?:</think>|</thind>|\Z)', text, flags=re.DOTALL):
+        story_parts.append(text[pos:match.start()])
+        closed = match.group(0).endswith(("</think>", "</thind>"))
+        think_parts.append("<think>" + match.group(1) + ("</think>" if closed else ""))
+        pos = match.end()
+    story_parts.append(text[pos:])
+    return "".join(story_parts), "".join(think_parts)
+
+
+def parse_chunks(chunks):
+    parser = ThinkTagParser()
+    story_parts = []
+    think_parts = []
+    for chunk in chunks:
+        story, think = parser.feed(chunk)
+        story_parts.append(story)
+        think_parts.append(think)
+    story, think = parser.flush()
+    return "".join(story_parts) + story, "".join(think_parts) + think
+
+
+THINK_TRANSCRIPTS = [
+    "<think>我需要先确定故事的主角和背景。</think>天色渐暗，雨滴敲打在窗户上。",
+    "开头<think>第一段思考</think>中间<think>第二段思考</thind>结尾",
+    "<think>思考没有结束就断开了",
+    "没有任何标签的正文，包含 < 和 > 符号，以及 </think 这样不完整的标签。",
+    "<think>a<b</think><<think>>x</think>y<",
+    "正文</think>多余的结束标签<think>t</think>",
+]
+
+
+# 在每个切分位置（以及随机的多段切分）上校验增量解析结果与整段解析一致
+def fuzz_think_parser(random_rounds=2000, seed=0):
+    print("== <think> 标签解析模糊测试 ==")
+    rng = random.Random(seed)
+    checked = 0
+    for text in THINK_TRANSCRIPTS:
+        expected = reference_split(text)
+        for i in range(len(text) + 1):
+            for j in range(i, len(text) + 1):
+                assert parse_chunks([text[:i], text[i:j], text[j:]]) == expected, (text, i, j)
+                checked += 1
+        for _ in range(random_rounds):
+            cuts = sorted(rng.sample(range(len(text) + 1), rng.randint(1, min(8, len(text)))))
+            chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+            assert parse_chunks(chunks) == expected, (text, cuts)
+            checked += 1
+    print(f"通过 {checked} 种切分方式")
+
+
+# 思维推理很长时，原先每个文本块都对全部思维内容做 rfind，整体是二次复杂度
+def bench_think_parser(think_chars=(20_000, 200_000)):
+    print("== <think> 标签解析 ==")
+    print(f"{'思维字符数':>10} {'原实现':>12} {'增量解析':>12} {'加速比':>8}")
+    for size in think_chars:
+        _, think_chunks = make_stream(size, seed=1)
+        _, story_chunks = make_stream(size // 4, seed=2)
+        chunks = ["<think>"] + think_chunks + ["</think>"] + story_chunks
+
+        def run_legacy():
+            state = {"thinking_content": ""}
+            for chunk in chunks:
+                legacy_process_text_chunk(chunk, state)
+
+        def run_parser():
+            parser = ThinkTagParser()
+            for chunk in chunks:
+                parser.feed(chunk)
+            parser.flush()
+
+        legacy = _timeit(run_legacy, repeat=1)
+        incremental = _timeit(run_parser, repeat=3)
+        print(f"{size:>10} {legacy * 1000:>10.1f}ms {incremental * 1000:>10.1f}ms {legacy / incremental:>7.1f}x")
+
+
+# 写作要求去重：历史为 sizes 条随机的写作要求，检查改写过几个字的历史要求（应判为重复）和全新的要求
+def bench_requirement_dedup(sizes=(10_000, 100_000), queries=500, edits=4):
+    print("== 写作要求去重 ==")
+    print(f"{'历史条数':>10} {'建索引':>10} {'LSH查询/次':>12} {'逐条比较/次':>12} {'改写检出率':>10} {'新要求误判率':>12}")
+    rng = random.Random(0)
+
+    def random_requirement(length=120):
+        return "".join(chr(0x4e00 + rng.randrange(3000)) for _ in range(length))
+
+    for size in sizes:
+        texts = [random_requirement() for _ in range(size)]
+        dedup = RequirementDeduplicator(None)
+        start = time.perf_counter()
+        for text in texts:
+            dedup.index.add(dedup.index.signature(text))
+        build = time.perf_counter() - start
+
+        edited = []
+        for text in rng.sample(texts, queries):
+            chars = list(text)
+            for _ in range(edits):
+                chars[rng.randrange(len(chars))] = chr(0x4e00 + rng.randrange(3000))
+            edited.append("".join(chars))
+        fresh = [random_requirement() for _ in range(queries)]
+
+        start = time.perf_counter()
+        detected = sum(dedup.check(text)[0] for text in edited)
+        false_positives = sum(dedup.check(text)[0] for text in fresh)
+        lsh = (time.perf_counter() - start) / (2 * queries)
+
+        signatures = dedup.index._signatures
+        signature = dedup.index.signature(fresh[0])
+        scan = _timeit(lambda: max(sum(1 for x, y in zip(signature, other) if x == y) for other in signatures),
+                       repeat=1)
+        print(f"{size:>10} {build:>9.1f}s {lsh * 1000:>10.3f}ms {scan * 1000:>10.1f}ms "
+              f"{detected / queries:>10.1%} {false_positives / queries:>12.1%}")
+
+
+# 小说库：写入 size 篇（每篇 body_chars 字的随机正文）后，测量常用查询的延迟
+def bench_library(size=100_000, body_chars=1000):
+    print("== 小说库 ==")
+    rng = random.Random(0)
+    words = ["".join(chr(0x4e00 + rng.randrange(500)) for _ in range(4)) for _ in range(5000)]
+    with tempfile.TemporaryDirectory() as directory:
+        library = NovelLibrary(os.path.join(directory, "library.db"))
+        now = time.time()
+        start = time.perf_counter()
+        for batch_start in range(0, size, 1000):
+            entries = []
+            for i in range(batch_start, min(size, batch_start + 1000)):
+                body = "".join(rng.choice(words) for _ in range(body_chars // 4))
+                entries.append((os.path.join(directory, f"{i}.txt"), body,
+                                {"word_count": rng.randrange(1000, 30000), "user_prompt": rng.choice(words)},
+                                now - rng.random() * 365 * 86400))
+            library.add_many(entries)
+            for _, body, _, _ in entries[::3]:
+                library.record_evaluation(body, rng.randrange(1, 11), "")
+        print(f"写入{size}篇：{time.perf_counter() - start:.1f}s，数据库{os.path.getsize(library.path) / 1e6:.0f}MB")
+
+        keyword = words[0]
+        queries = {
+            "最新100篇": lambda: library.search(limit=100),
+            "评分≥8 按评分排序": lambda: library.search(min_score=8, order_by="score", limit=100),
+            "1万~2万字 最近30天": lambda: library.search(min_words=10000, max_words=20000, since=now - 30 * 86400),
+            "全文检索（4字）": lambda: library.search(text=keyword, limit=100),
+            "全文检索+评分≥8": lambda: library.search(text=keyword, min_score=8, limit=100),
+            "全文检索计数": lambda: library.count(text=keyword),
+            "总数": lambda: library.count(),
+        }
+        for name, query in queries.items():
+            print(f"  {name:<16} {_timeit(query, repeat=5) * 1000:>8.2f}ms")
+        library.close()
+
+
+# 在子进程中启动模拟服务，这样测得的CPU时间只属于客户端
+def start_mock_process(**settings):
+    args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_ollama.py"), "--port", "0"]
+    for key, value in settings.items():
+        args += [f"--{key.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# 运行一个场景，返回耗时、客户端CPU时间、收到的token数（所有请求的eval_count之和）和每token的客户端CPU开销
+def _run_scenario(func):
+    tokens_before = EVAL_TOKENS.total()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    func()
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    token_count = EVAL_TOKENS.total() - tokens_before
+    return {
+        "wall_seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        "tokens": token_count,
+        "cpu_us_per_token": round(cpu / token_count * 1e6, 2) if token_count else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+# 与上一次保存的结果对比，并追加保存本次结果
+def store_results(name, results, path=RESULTS_FILE):
+    previous = None
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("benchmark") == name:
+                    previous = record
+    record = {
+        "benchmark": name,
+        "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if previous:
+        print(f"与 {previous['time']}（{previous.get('commit')}）对比每token的客户端CPU开销：")
+        for scenario, result in results.items():
+            before = previous["results"].get(scenario, {}).get("cpu_us_per_token")
+            after = result["cpu_us_per_token"]
+            if before and after:
+                print(f"  {scenario:<10} {before:>8.2f}us -> {after:>8.2f}us ({(after - before) / before * 100:+.1f}%)")
+    print(f"结果已追加保存至 {path}")
+
+
+# 端到端：模拟服务不限速时，总耗时基本都是客户端自身的开销
+def bench_e2e(target_words=20000, response_chars=2000):
+    print("== 端到端（模拟Ollama服务） ==")
+    process, url = start_mock_process(rate=0, chunk_chars=2, response_chars=response_chars, think_chars=200)
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            config = {
+                "ollama_base_urls": [url],
+                "model_name": "mock-writer:latest",
+                "writing_model_name": "mock-writer:latest",
+                "evaluation_model_name": "mock-evaluator:latest",
+                "output_dir": os.path.join(workdir, "novels"),
+                "checkpoint_dir": os.path.join(workdir, "checkpoints"),
+                "metrics_file": os.path.join(workdir, "metrics.jsonl"),
+                "response_cache_dir": None,  # 每次都真正请求，评估场景才有可比性
+                "library_db": None,
+                "round_interval_seconds": 0,
+                "outline_chapter_words": response_chars,
+                "outline_parallel_slots": 4,
+            }
+            engine = NovelEngine(config)
+            outline_engine = NovelEngine(dict(config, generation_mode="outline"))
+            state = {}
+
+            def write():
+                job = state["job"] = engine.new_job("模拟的写作要求", target_words)
+                engine.write_novel(job, on_story=lambda s: None, on_thinking=lambda t: None)
+                engine.save_job(job)
+
+            def outline():
+                job = outline_engine.new_job("模拟的写作要求", target_words)
+                outline_engine.write_novel(job, on_story=lambda s: None, on_thinking=lambda t: None)
+                outline_engine.save_job(job)
+
+            def evaluate():
+                content = state["job"].generated_content
+                evaluation = engine.evaluate_novel("模拟的写作要求", content)
+                state["suggestions"] = engine.revision_suggestions("模拟的写作要求", content, evaluation)
+
+            def revise():
+                engine.revise_novel(state["job"], state["suggestions"], on_story=lambda s: None, on_thinking=lambda t: None)
+
+            results = {}
+            print(f"{'场景':<10} {'总耗时':>10} {'客户端CPU':>10} {'tokens':>8} {'CPU/token':>10} {'峰值内存':>10}")
+            for name, func in (("write", write), ("outline", outline), ("evaluate", evaluate), ("revise", revise)):
+                result = results[name] = _run_scenario(func)
+                per_token = f"{result['cpu_us_per_token']:.1f}us" if result['cpu_us_per_token'] else "-"
+                print(f"{name:<10} {result['wall_seconds'] * 1000:>8.0f}ms {result['cpu_seconds'] * 1000:>8.0f}ms "
+                      f"{result['tokens']:>8} {per_token:>10} {str(result['peak_rss_mb']) + 'MB':>10}")
+            engine.client.close()
+            outline_engine.client.close()
+    finally:
+        process.terminate()
+        process.wait()
+    store_results("e2e", results)
+
+
+# 把磁带中的每个流式响应不等待地交给引擎的流式处理（标签解析、字数统计、断点日志）并保存，
+# 测量处理真实数据时每条消息的客户端开销
+def bench_replay(cassette=None):
+    print("== 磁带回放 ==")
+    cassette = cassette or os.environ.get("NOVEL_CASSETTE")
+    with tempfile.TemporaryDirectory() as workdir:
+        config = {
+            "output_dir": os.path.join(workdir, "novels"),
+            "checkpoint_dir": os.path.join(workdir, "checkpoints"),
+            "metrics_file": None,
+            "response_cache_dir": None,
+            "library_db": None,
+            "round_interval_seconds": 0,
+        }
+        if not cassette:
+            cassette = os.path.join(workdir, "mock.jsonl.gz")
+            process, url = start_mock_process(rate=2000, chunk_chars=2, response_chars=2000, think_chars=200)
+            try:
+                engine = NovelEngine(dict(config, ollama_base_urls=[url], cassette_record=cassette))
+                engine.write_novel(engine.new_job("模拟的写作要求", 10000))
+                engine.client.close()
+            finally:
+                process.terminate()
+                process.wait()
+            CassetteRecorder.close_all()
+
+        client = ReplayClient(cassette, speed=0)
+        engine = NovelEngine(config, client=client)
+        streams = [i for i in client.interactions if (i["request"] or {}).get("stream")]
+        messages = sum(len(i["lines"]) for i in streams)
+        recorded_seconds = sum(i["duration"] for i in streams)
+
+        def replay():
+            for interaction in streams:
+                job = engine.new_job(interaction["request"].get("prompt", ""), 0)
+                job.journal = None
+                content, _ = engine._consume_stream(job, client.replay_lines(interaction), StreamTimer(),
+                                                    job.word_counter, on_story=lambda s: None,
+                                                    on_thinking=lambda t: None)
+                save_novel(content, config["output_dir"], job.word_counter.total)
+
+        wall_start = time.perf_counter()
+        start = time.process_time()
+        replay()
+        cpu = time.process_time() - start
+        wall = time.perf_counter() - wall_start
+        print(f"{len(streams)}个流式响应，{messages}条消息，录制时耗时{recorded_seconds:.1f}s")
+        print(f"回放处理CPU时间{cpu * 1000:.0f}ms，每条消息{cpu / messages * 1e6:.1f}us" if messages else "磁带中没有流式响应")
+        if messages:
+            store_results("replay", {os.path.basename(cassette): {
+                "wall_seconds": round(wall, 4), "cpu_seconds": round(cpu, 4), "tokens": messages,
+                "cpu_us_per_token": round(cpu / messages * 1e6, 2), "peak_rss_mb": _peak_rss_mb()}})
+
+
+BENCHMARKS = {
+    "words": bench_word_counter,
+    "think_fuzz": fuzz_think_parser,
+    "think": bench_think_parser,
+    "e2e": bench_e2e,
+    "replay": bench_replay,
+    "dedup": bench_requirement_dedup,
+    "library": bench_library,
+}
+
+
+def main(argv=None):
+    names = (argv if argv is not None else sys.argv[1:]) or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""录制和回放 Ollama 的原始响应（“磁带”），用于在没有模型的机器上重现线上的性能问题。
+
+录制：OllamaClient 把每次请求的参数和收到的每一行原始 NDJSON 连同相对时间写入 gzip 压缩的磁带文件。
+回放：ReplayClient 与 OllamaClient 接口相同，按原始速度（或加速）把录制的响应交给引擎，
+这样解析、字数统计、界面刷新和保存都在真实的数据上运行。
+
+磁带为 gzip 压缩的 JSON Lines，每行是以下之一：
+    {"type": "request", "id": ..., "method": ..., "path": ..., "request": {...}}
+    {"type": "line", "id": ..., "t": 距请求开始的秒数, "data": 原始的一行响应}
+    {"type": "end", "id": ..., "t": ..., "error": 出错时的异常信息}
+多个请求（并发生成时）的行可以交错出现；多次录制追加到同一个文件中。
+"""
+import gzip
+import json
+import time
+import uuid
+import queue
+import hashlib
+import logging
+import threading
+from collections import deque, OrderedDict
+
+import requests
+
+logger = logging.getLogger("NovelApp")
+
+_CLOSE = object()
+
+
+# 请求参数的指纹，用于回放时找到对应的录制内容
+def request_fingerprint(method, path, request_data):
+    payload = json.dumps([method, path, request_data], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class CassetteRecorder:
+    """把响应写入磁带。所有方法都可以在任意线程中调用，只做一次入队；压缩和写盘在后台线程中进行。"""
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self._prefix = uuid.uuid4().hex[:8]  # 区分追加到同一文件中的多次录制
+        self._counter = 0
+        self._counter_lock = threading.Lock()
+        self._starts = {}
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name="cassette-recorder", daemon=True)
+        self._thread.start()
+        logger.info(f"正在录制Ollama响应到：{path}")
+
+    # 同一进程中的多个客户端（如调度器中每个服务地址一个引擎）共用同一个录制器
+    @classmethod
+    def shared(cls, path):
+        with cls._shared_lock:
+            recorder = cls._shared.get(path)
+            if recorder is None:
+                recorder = cls._shared[path] = cls(path)
+            return recorder
+
+    def begin(self, method, path, request_data):
+        with self._counter_lock:
+            self._counter += 1
+            interaction_id = f"{self._prefix}-{self._counter}"
+        self._starts[interaction_id] = time.perf_counter()
+        self.queue.put({"type": "request", "id": interaction_id, "method": method, "path": path,
+                        "request": request_data, "time": time.time()})
+        return interaction_id
+
+    def line(self, interaction_id, data):
+        self.queue.put({"type": "line", "id": interaction_id,
+                        "t": round(time.perf_counter() - self._starts[interaction_id], 6), "data": data})
+
+    def end(self, interaction_id, error=None):
+        record = {"type": "end", "id": interaction_id,
+                  "t": round(time.perf_counter() - self._starts.pop(interaction_id), 6)}
+        if error:
+            record["error"] = error
+        self.queue.put(record)
+
+    def _run(self):
+        closing = False
+        while not closing:
+            item = self.queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            lines = []
+            while True:
+                if item is _CLOSE:
+                    closing = True
+                    break
+                lines.append(json.dumps(item, ensure_ascii=False) + "\n")
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            try:
+                self._file.write("".join(lines))
+                self._file.flush()  # 同步压缩流，进程崩溃时已写入的部分仍可读取
+            except OSError as e:
+                logger.error(f"写入磁带失败: {str(e)}")
+        self._file.close()
+
+    def close(self):
+        if self._thread.is_alive():
+            self.queue.put(_CLOSE)
+            self._thread.join()
+        with self._shared_lock:
+            if self._shared.get(self.path) is self:
+                del self._shared[self.path]
+
+    # 程序退出前写完所有录制器中剩余的内容
+    @classmethod
+    def close_all(cls):
+        with cls._shared_lock:
+            recorders = list(cls._shared.values())
+        for recorder in recorders:
+            recorder.close()
+
+
+# 读取磁带，返回按请求开始顺序排列的录制内容
+def load_cassette(path):
+    interactions = OrderedDict()
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for raw in f:
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    continue  # 录制中断时最后一行可能不完整
+                if record["type"] == "request":
+                    interactions[record["id"]] = dict(record, lines=[], duration=None, error=None)
+                elif record["id"] in interactions:
+                    interaction = interactions[record["id"]]
+                    if record["type"] == "line":
+                        interaction["lines"].append((record["t"], record["data"]))
+                    else:
+                        interaction["duration"] = record["t"]
+                        interaction["error"] = record.get("error")
+        except EOFError:
+            pass  # 录制进程崩溃时压缩流没有正常结束
+    return list(interactions.values())
+
+
+class ReplayClient:
+    """回放磁带，接口与 OllamaClient 相同。
+
+    优先回放请求参数完全相同的录制内容；找不到时按录制顺序回放同一接口的下一条，
+    因此即使提示词略有不同（如自动生成的写作要求），整个流程也能照常进行。
+    speed 为回放速度倍数，0 表示不等待，尽可能快地回放。
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.interactions = [i for i in load_cassette(path) if i["duration"] is not None]
+        self._by_fingerprint = {}
+        self._by_path = {}
+        for interaction in self.interactions:
+            stream = interaction["request"].get("stream", False) if interaction["request"] else False
+            key = (interaction["path"], stream)
+            fingerprint = request_fingerprint(interaction["method"], interaction["path"], interaction["request"])
+            self._by_fingerprint.setdefault(fingerprint, deque()).append(interaction)
+            self._by_path.setdefault(key, deque()).append(interaction)
+        self._used = set()
+        self._lock = threading.Lock()
+        self.base_urls = [f"replay://{path}"]
+        self.request_count = 0
+        self.retry_count = 0
+        self.error_count = 0
+        self.exact_matches = 0
+        logger.info(f"回放磁带：{path}，共{len(self.interactions)}次请求，速度{speed or '不限'}")
+
+    def _take(self, method, path, request_data):
+        fingerprint = request_fingerprint(method, path, request_data)
+        stream = request_data.get("stream", False) if request_data else False
+        with self._lock:
+            self.request_count += 1
+            for candidates, exact in ((self._by_fingerprint.get(fingerprint), True),
+                                      (self._by_path.get((path, stream)), False)):
+                while candidates:
+                    interaction = candidates.popleft()
+                    if id(interaction) not in self._used:
+                        self._used.add(id(interaction))
+                        self.exact_matches += exact
+                        return interaction
+        raise requests.exceptions.ConnectionError(f"磁带中没有可回放的 {path} 响应")
+
+    def _wait_until(self, started, offset):
+        if self.speed:
+            delay = started + offset / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def _raise_if_failed(self, interaction):
+        if interaction["error"]:
+            with self._lock:
+                self.error_count += 1
+            raise requests.exceptions.ConnectionError(f"（回放）{interaction['error']}")
+
+    def _call(self, method, path, request_data):
+        started = time.perf_counter()
+        interaction = self._take(method, path, request_data)
+        self._raise_if_failed(interaction)
+        self._wait_until(started, interaction["duration"])
+        return json.loads(interaction["lines"][0][1]) if interaction["lines"] else {}
+
+    def _stream(self, path, request_data):
+        started = time.perf_counter()
+        interaction = self._take('POST', path, request_data)
+        if interaction["error"] and not interaction["lines"]:
+            self._raise_if_failed(interaction)
+        return self.replay_lines(interaction, started)
+
+    # 按录制时的时间间隔逐条输出一次请求的响应
+    def replay_lines(self, interaction, started=None):
+        started = time.perf_counter() if started is None else started
+        for offset, data in interaction["lines"]:
+            self._wait_until(started, offset)
+            yield json.loads(data)
+        if interaction["error"]:
+            self._raise_if_failed(interaction)
+
+    def generate(self, request_data, timeout=30):
+        return self._call('POST', '/api/generate', dict(request_data, stream=False))
+
+    def stream_generate(self, request_data, timeout=30):
+        return self._stream('/api/generate', dict(request_data, stream=True))
+
+    def chat(self, request_data, timeout=30):
+        return self._call('POST', '/api/chat', dict(request_data, stream=False))
+
+    def stream_chat(self, request_data, timeout=30):
+        return self._stream('/api/chat', dict(request_data, stream=True))
+
+    def tags(self, timeout=5):
+        return self._call('GET', '/api/tags', None)
+
+    def close(self):
+        pass
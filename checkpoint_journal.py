@@ -0,0 +1,246 @@
+"""写作过程的断点日志：流式输出的正文和思维推理内容以追加方式写入每篇小说各自的日志文件。
+
+流式处理线程只把文本块放入队列（不做任何磁盘操作）；后台线程按固定间隔批量写入并 fsync。
+进程崩溃、Ollama重启或机器重启后，可以从日志中恢复未完成的小说并继续写作。
+
+日志为每行一个JSON对象：第一行是会话信息，之后是 {"s": 正文}、{"t": 思维推理内容}
+或 {"r": 字符数}（删除正文末尾的字符，如模型陷入循环时去掉重复的内容，或被停止、出错而丢弃的一轮）。
+崩溃时最后一行可能只写了一半，读取时忽略无法解析的行。
+"""
+import os
+import json
+import time
+import queue
+import socket
+import logging
+import threading
+import uuid
+
+logger = logging.getLogger("NovelApp")
+
+JOURNAL_SUFFIX = ".journal"
+STORY = "s"
+THINKING = "t"
+RETRACT = "r"
+_CLOSE = object()
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+ERROR_ACCESS_DENIED = 5
+STILL_ACTIVE = 259
+
+
+# Windows：OpenProcess 打开进程句柄后查询退出码（os.kill(pid, 0) 在 Windows 上会结束目标进程）
+def _windows_process_alive(pid):
+    import ctypes
+    from ctypes import wintypes
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        # 进程存在但属于其他用户时拒绝访问
+        return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+    try:
+        exit_code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+            return True  # 无法确定时按仍在运行处理，不接管其日志
+        return exit_code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+# 判断进程是否仍在运行，用于跳过其他实例正在写入的日志
+def _process_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        return _windows_process_alive(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class CheckpointJournal:
+    """一篇小说的断点日志。record() 可在任意线程中调用，开销只有一次入队。"""
+
+    def __init__(self, path, header, flush_interval=1.0, append=False):
+        self.path = path
+        self.header = header
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.batches = 0  # fsync 次数
+        self.records = 0  # 写入的文本块数
+        self.story_chars = 0  # 已写入日志的正文字数（扣除删除的字符）
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8')
+        self._write_lines([header])
+        self._sync()
+        self._thread = threading.Thread(target=self._run, name=f"journal-{header['session_id']}", daemon=True)
+        self._thread.start()
+
+    # 新建一篇小说的日志
+    @classmethod
+    def create(cls, directory, user_prompt, target_word_count, flush_interval=1.0):
+        os.makedirs(directory, exist_ok=True)
+        session_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        header = {
+            "type": "session",
+            "session_id": session_id,
+            "pid": os.getpid(),
+            "host": socket.gethostname(),
+            "user_prompt": user_prompt,
+            "target_word_count": target_word_count,
+            "created": time.time(),
+        }
+        return cls(os.path.join(directory, session_id + JOURNAL_SUFFIX), header, flush_interval)
+
+    # 接管一个未完成的会话：先把文件改名为本进程的新会话，多个实例同时恢复时只有一个能成功
+    @classmethod
+    def resume(cls, session, flush_interval=1.0):
+        header = dict(session["header"], pid=os.getpid(), host=socket.gethostname(), resumed=time.time())
+        header["session_id"] = f"{session['header']['session_id'].split('.')[0]}.{uuid.uuid4().hex[:6]}"
+        path = os.path.join(os.path.dirname(session["path"]), header["session_id"] + JOURNAL_SUFFIX)
+        # 文件已被其他实例接管时抛出 FileNotFoundError；Windows 上其他进程仍打开着日志时抛出 PermissionError
+        os.rename(session["path"], path)
+        journal = cls(path, header, flush_interval, append=True)
+        journal.story_chars = len(session["content"])
+        return journal
+
+    def record(self, kind, text):
+        if text:
+            if kind == STORY:
+                self.story_chars += len(text)
+            elif kind == RETRACT:
+                self.story_chars = max(0, self.story_chars - text)
+            self.queue.put((kind, text))
+
+    # 引擎丢弃了已写入日志的正文（被停止或出错的一轮）：删除超出 length 的部分，恢复时不再重放
+    def truncate(self, length):
+        if self.story_chars > length:
+            self.record(RETRACT, self.story_chars - length)
+
+    # 包装回调：把文本块写入日志后再交给原回调
+    def tee(self, kind, callback):
+        def wrapper(text):
+            self.record(kind, text)
+            if callback:
+                callback(text)
+        return wrapper
+
+    def _write_lines(self, records):
+        self._file.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.batches += 1
+
+    # 后台线程：等待第一个文本块，再攒一个间隔内到达的全部文本块，一次写入并 fsync
+    def _run(self):
+        closing = False
+        while not closing:
+            item = self.queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            pending = []
+            while True:
+                if item is _CLOSE:
+                    closing = True
+                    break
+                kind, text = item
+                if pending and kind in pending[-1]:
+                    pending[-1][kind] += text  # 同类相邻的文本块合并为一行
+                else:
+                    pending.append({kind: text})
+                self.records += 1
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            if pending:
+                try:
+                    self._write_lines(pending)
+                    self._sync()
+                except OSError as e:
+                    logger.error(f"写入断点日志失败: {str(e)}")
+        self._file.close()
+
+    # 写入剩余内容并停止后台线程；日志文件保留，直到小说保存后调用 discard()
+    def close(self):
+        if self._thread.is_alive():
+            self.queue.put(_CLOSE)
+            self._thread.join()
+
+    # 小说已经保存，不再需要恢复
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+# 读取一个日志文件，返回会话信息、正文和思维推理内容
+def read_journal(path):
+    header = None
+    story_parts = []
+    think_parts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 崩溃时写了一半的行
+            if record.get("type") == "session":
+                header = header or record
+            elif STORY in record:
+                story_parts.append(record[STORY])
+            elif THINKING in record:
+                think_parts.append(record[THINKING])
+            elif RETRACT in record:
+                story = "".join(story_parts)
+                story_parts = [story[:max(0, len(story) - record[RETRACT])]]
+    if header is None:
+        return None
+    return {
+        "path": path,
+        "header": header,
+        "user_prompt": header["user_prompt"],
+        "target_word_count": header["target_word_count"],
+        "content": "".join(story_parts),
+        "thinking": "".join(think_parts),
+    }
+
+
+# 查找可以恢复的未完成会话（跳过本机上其他仍在运行的实例正在写入的日志），按创建时间排序
+def find_unfinished_sessions(directory):
+    if not directory or not os.path.isdir(directory):
+        return []
+    sessions = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(JOURNAL_SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            session = read_journal(path)
+        except OSError as e:
+            logger.warning(f"读取断点日志失败 {name}: {str(e)}")
+            continue
+        if session is None:
+            continue
+        header = session["header"]
+        if header.get("host") == socket.gethostname() and _process_alive(header.get("pid", -1)):
+            continue
+        if not session["content"].strip():
+            try:
+                os.remove(path)  # 还没有写出任何正文，不值得恢复
+            except OSError as e:
+                # Windows 上其他进程仍打开着日志时无法删除
+                logger.warning(f"删除空的断点日志失败 {name}: {str(e)}")
+            continue
+        sessions.append(session)
+    sessions.sort(key=lambda s: s["header"].get("created", 0))
+    return sessions
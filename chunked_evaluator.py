@@ -0,0 +1,188 @@
+"""分段并行的质量评估：把整篇小说按章节和段落切成若干段，并发评估各段，再把各段的评分和点评合并成一份报告。
+
+原来的评估只发送前2000字，长篇小说的大部分内容没有被评估。分段后每段都在 num_ctx 以内，
+各段同时请求（并发数不超过后端能并行处理的请求数），总耗时取决于最慢的一段而不是小说的长度。
+合并时各项评分按段落字数加权平均，点评和改进建议按段落顺序汇总，不再额外请求模型，
+输出的报告格式与单次评估相同（parse_overall_score 和界面都可以直接解析）。
+每段的结果单独缓存，小说只修改了一部分时，未变化的段落直接使用缓存。
+"""
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from text_stream import SENTENCE_END_PATTERN
+from metrics_exporter import ERRORS
+
+logger = logging.getLogger("NovelApp")
+
+# 报告中的各项评分，顺序与单次评估的报告相同
+SCORE_NAMES = ("总体评分", "情节评分", "人物评分", "语言评分", "创意评分", "需求符合度")
+# 章节标题行，例如大纲模式输出的“第3章 重逢”
+CHAPTER_HEADING_PATTERN = re.compile(r'^\s*[#*]*\s*第[0-9零一二三四五六七八九十百千]+[章节回]')
+MAX_SUGGESTIONS = 5
+
+
+# 把小说切成不超过 chunk_chars 字符的段：尽量在章节标题处断开，其次在段落处，超长的段落在句末断开
+def split_for_evaluation(content, chunk_chars):
+    chunks = []
+    current = ""
+    for paragraph in content.splitlines(keepends=True):
+        heading = CHAPTER_HEADING_PATTERN.match(paragraph)
+        # 新章节开始且当前段已超过一半长度时断开，避免切出很短的段
+        if current.strip() and ((heading and len(current) >= chunk_chars // 2)
+                                or len(current) + len(paragraph) > chunk_chars):
+            chunks.append(current)
+            current = ""
+        current += paragraph
+        while len(current) > chunk_chars:
+            cut = 0
+            for match in SENTENCE_END_PATTERN.finditer(current, 0, chunk_chars):
+                cut = match.end()
+            cut = cut or chunk_chars
+            chunks.append(current[:cut])
+            current = current[cut:]
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+# 评估其中一段的提示词
+def build_chunk_evaluation_prompt(user_prompt, chunk, index, total):
+    position = "开头" if index == 0 else ("结尾" if index == total - 1 else "中间")
+    return f'''
+        以下是一篇小说的第{index + 1}/{total}部分（{position}部分），请只针对这一部分进行专业的质量评估，基于以下几个方面:
+        1. 情节连贯性和合理性
+        2. 人物刻画和发展
+        3. 写作风格和语言表达
+        4. 创意性和独特性
+        5. 与用户写作要求的符合度
+
+        ## 用户的写作要求:
+        {user_prompt}
+
+        ## 小说内容（第{index + 1}/{total}部分）:
+        {chunk}
+
+        评分标准为1-10分，请在每个方面打分，并给出这一部分的总体评分。
+        格式要求:
+        - 总体评分: X/10
+        - 情节评分: X/10
+        - 人物评分: X/10
+        - 语言评分: X/10
+        - 创意评分: X/10
+        - 需求符合度: X/10
+
+        ## 点评:
+        [用2-3句话说明这一部分的优点和不足]
+
+        ## 改进建议:
+        [列出1-2条针对这一部分的具体改进建议]
+        '''
+
+
+# 从评估结果中解析各项评分，返回 {评分名称: 分数}
+def parse_scores(evaluation_result):
+    scores = {}
+    for name in SCORE_NAMES:
+        match = re.search(name + r'\**\s*[:：]\s*\**\s*(\d+(?:\.\d+)?)\s*\**\s*/\s*10', evaluation_result)
+        if match:
+            scores[name] = float(match.group(1))
+    return scores
+
+
+# 取出报告中某个标题（## 标题）下的内容，直到下一个标题
+def _section(text, title):
+    match = re.search(r'#+\s*' + title + r'[^\n]*\n(.*?)(?=\n\s*#+\s|\Z)', text, re.DOTALL)
+    return match.group(1).strip() if match else ""
+
+
+def _suggestion_lines(text):
+    lines = [re.sub(r'^\s*(?:[-*•]|\d+[.、)）])\s*', '', line).strip() for line in text.splitlines()]
+    return [line for line in lines if line and not line.startswith('[')]
+
+
+# 合并各段的评估结果，生成与单次评估相同格式的报告；results 中评估失败的段为 None
+def reduce_evaluations(chunks, results):
+    lengths = [len(chunk) for chunk in chunks]
+    parsed = [parse_scores(result) if result is not None else {} for result in results]
+    lines = []
+    for name in SCORE_NAMES:
+        weighted = [(scores[name], length) for scores, length in zip(parsed, lengths) if name in scores]
+        if weighted:
+            score = sum(score * length for score, length in weighted) / sum(length for _, length in weighted)
+            lines.append(f"- {name}: {score:.1f}/10")
+
+    total_chars = sum(lengths)
+    notes = [f"全文共{total_chars}字符，分{len(chunks)}部分评估，评分为各部分按字数加权的平均值。"]
+    per_chunk = []  # 每段的改进建议，去掉与前面各段重复的
+    seen = set()
+    start = 0
+    for index, (result, length, scores) in enumerate(zip(results, lengths, parsed)):
+        label = f"第{index + 1}部分（第{start + 1}-{start + length}字符）"
+        start += length
+        if result is None:
+            notes.append(f"{label}：评估失败")
+            continue
+        score = f"{scores['总体评分']:g}/10" if "总体评分" in scores else "未评分"
+        notes.append(f"{label}，{score}：{_section(result, '点评') or result.strip()[:200]}")
+        suggestions = [s for s in _suggestion_lines(_section(result, '改进建议')) if s not in seen]
+        seen.update(suggestions)
+        per_chunk.append([f"{suggestion}（第{index + 1}部分）" for suggestion in suggestions])
+
+    # 各段的建议按段落顺序轮流选取，避免只来自开头几段
+    selected = []
+    while len(selected) < MAX_SUGGESTIONS and any(per_chunk):
+        for items in per_chunk:
+            if items and len(selected) < MAX_SUGGESTIONS:
+                selected.append(items.pop(0))
+
+    report = "\n".join(lines)
+    report += "\n\n## 详细点评:\n" + "\n\n".join(notes)
+    report += "\n\n## 具体改进建议:\n" + "\n".join(f"{i + 1}. {s}" for i, s in enumerate(selected))
+    return report
+
+
+class ChunkedEvaluator:
+    """分段并行评估。engine 提供 generate（耗时记录和结果缓存）和 config。"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def _evaluate_chunk(self, user_prompt, chunks, index, bypass_cache, on_status):
+        config = self.engine.config
+        request_data = {
+            "model": config["evaluation_model_name"],
+            "prompt": build_chunk_evaluation_prompt(user_prompt, chunks[index], index, len(chunks)),
+            "temperature": 0.3,
+            "stream": False,
+            "options": {"num_ctx": config["evaluation_num_ctx"]}
+        }
+        result = self.engine.generate("evaluation_chunk", request_data, timeout=600, cache=True,
+                                      bypass_cache=bypass_cache, on_status=on_status)
+        return result.get('response', '').strip()
+
+    # 评估整篇小说，返回合并后的报告；所有段都失败时抛出最后一个异常
+    def evaluate(self, user_prompt, content, bypass_cache=False, on_status=None):
+        config = self.engine.config
+        chunks = split_for_evaluation(content, config["evaluation_chunk_chars"])
+        slots = max(1, min(config["evaluation_parallel_slots"], len(chunks)))
+        logger.info(f"分段评估：全文{len(content)}字符，分为{len(chunks)}段，并发数{slots}")
+        if on_status:
+            on_status(f"正在分{len(chunks)}段评估（并发数{slots}）...")
+
+        results = [None] * len(chunks)
+        errors = []
+
+        def run(index):
+            try:
+                results[index] = self._evaluate_chunk(user_prompt, chunks, index, bypass_cache, on_status)
+            except Exception as e:
+                logger.warning(f"第{index + 1}/{len(chunks)}段评估失败: {str(e)}")
+                ERRORS.inc(stage="evaluation_chunk", type=type(e).__name__)
+                errors.append(e)
+
+        with ThreadPoolExecutor(max_workers=slots, thread_name_prefix="evaluation") as executor:
+            list(executor.map(run, range(len(chunks))))
+        if len(errors) == len(chunks):
+            raise errors[-1]
+        return reduce_evaluations(chunks, results)
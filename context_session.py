@@ -0,0 +1,84 @@
+import hashlib
+import logging
+
+from continuation_memory import estimate_tokens
+
+logger = logging.getLogger("NovelApp")
+
+
+# 计算文本的指纹，用于判断模型上下文是否对应当前的小说内容
+def content_fingerprint(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ContextSession:
+    """保存 Ollama /api/generate 最后一条流式消息返回的 context（模型状态），在后续轮次中复用。
+
+    只有当模型相同、context 对应的正是当前的小说内容、且长度未超过上限时才会复用；
+    否则（模型切换、请求失败、服务重启导致 context 失效等）调用方应回退到完整提示词。
+    """
+
+    def __init__(self, max_tokens=16000):
+        self.max_tokens = max_tokens
+        self.total_saved = 0  # 累计节省的预填充token数
+        self.round_saved = []  # 每轮节省的预填充token数
+        self.reset()
+
+    def reset(self):
+        self.model = None
+        self.context = None
+        self.fingerprint = None
+        self.covers_full_text = False  # context 是否包含全文（而不是摘要+最近的原文）
+
+    def invalidate(self, reason):
+        if self.context is not None:
+            logger.warning(f"模型上下文已失效（{reason}），回退到完整提示词")
+        self.reset()
+
+    # 判断是否可以基于已保存的上下文继续（续写或修改同一篇内容）
+    def can_continue(self, model, content):
+        if not self.context:
+            return False
+        if model != self.model:
+            self.invalidate(f"模型已从 {self.model} 切换为 {model}")
+            return False
+        if len(self.context) > self.max_tokens:
+            self.invalidate(f"上下文长度{len(self.context)}超过上限{self.max_tokens}")
+            return False
+        if content_fingerprint(content) != self.fingerprint:
+            self.invalidate("小说内容已变化")
+            return False
+        return True
+
+    # 判断是否可以基于已保存的上下文修改全文：context 必须包含全文，只包含摘要时修改会丢失较早的内容
+    def can_revise(self, model, content):
+        return self.covers_full_text and self.can_continue(model, content)
+
+    # 为请求附加上下文字段；返回本次发送的上下文token数
+    def attach(self, request_data):
+        request_data["context"] = self.context
+        return len(self.context)
+
+    # 根据最后一条流式消息更新上下文，并统计本轮节省的预填充token数；
+    # covers_full_text 表示本轮的提示词（加上附加的上下文）是否包含了 content 的全文
+    def update(self, model, done_data, content, sent_context_tokens=0, prompt="", covers_full_text=True):
+        context = done_data.get('context')
+        if not context:
+            self.invalidate("响应中没有返回context")
+            return 0
+
+        saved = 0
+        if sent_context_tokens:
+            # 若不复用上下文，需要预填充的token数约为 已有上下文 + 新指令；实际预填充的数量由 prompt_eval_count 给出
+            would_prefill = sent_context_tokens + estimate_tokens(prompt)
+            evaluated = done_data.get('prompt_eval_count', would_prefill)
+            saved = max(0, would_prefill - evaluated)
+        self.round_saved.append(saved)
+        self.total_saved += saved
+        logger.info(f"本轮复用上下文节省预填充约{saved} tokens，累计节省{self.total_saved} tokens")
+
+        self.model = model
+        self.context = context
+        self.fingerprint = content_fingerprint(content)
+        self.covers_full_text = covers_full_text
+        return saved
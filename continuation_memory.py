@@ -0,0 +1,140 @@
+import re
+import logging
+
+logger = logging.getLogger("NovelApp")
+
+# 章节标题的匹配规则，例如“第三章”“第12章 重逢”
+CHAPTER_HEADING_PATTERN = re.compile(r'^\s*第[0-9零一二三四五六七八九十百千]+[章节回].*$', re.MULTILINE)
+
+
+# 粗略估算文本的token数量
+def estimate_tokens(text):
+    """中文字符按每字约1个token计算，其余非空白字符按每4个字符约1个token计算"""
+    if not text:
+        return 0
+    cjk_count = len(re.findall(r'[\u4e00-\u9fff]', text))
+    other_count = len(re.sub(r'\s', '', text)) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+class ContinuationMemory:
+    """续写记忆：较早的章节以分层摘要保存，最近的内容原文保留，使续写提示词的长度保持在预算之内。
+
+    - 每当未摘要的内容超过 chapter_chars（或出现新的章节标题）时，关闭一个章节并生成一级摘要；
+    - 当摘要总量超过预算的一半时，将最早的 merge_fanout 条同级摘要合并为更高一级的摘要；
+    - 最近 tail_chars 个字符始终原文保留，保证衔接自然。
+
+    summarize_fn(text, max_chars) 负责调用模型生成摘要，返回摘要文本。
+    """
+
+    def __init__(self, summarize_fn, token_budget=6000, tail_chars=1500,
+                 chapter_chars=3000, summary_chars=300, merge_fanout=4):
+        self.summarize_fn = summarize_fn
+        self.token_budget = token_budget
+        self.tail_chars = tail_chars
+        self.chapter_chars = chapter_chars
+        self.summary_chars = summary_chars
+        self.merge_fanout = merge_fanout
+        self.reset()
+
+    def reset(self):
+        self.text = ""
+        self.closed_upto = 0  # text[:closed_upto] 已经被摘要覆盖
+        self.summaries = []  # [(level, summary_text)]，按时间顺序排列
+        self.prompt_sizes = []  # 每轮续写提示词的大小 (字符数, 估算token数)
+
+    # 追加新生成的内容，并在需要时增量关闭章节、刷新摘要
+    def append(self, new_text):
+        self.text += new_text
+        while True:
+            cut = self._next_chapter_cut()
+            if cut is None:
+                break
+            chapter = self.text[self.closed_upto:cut]
+            self.closed_upto = cut
+            if chapter.strip():
+                self.summaries.append((0, self._summarize(chapter, self.summary_chars)))
+                logger.info(f"续写记忆：已关闭一个章节（{len(chapter)}字符），当前摘要条数：{len(self.summaries)}")
+        self._compact()
+
+    # 找到下一个章节的切分位置，若未摘要的内容还不足以关闭一个章节则返回None
+    def _next_chapter_cut(self):
+        limit = len(self.text) - self.tail_chars
+        if limit <= self.closed_upto:
+            return None
+
+        # 优先在章节标题处切分
+        for match in CHAPTER_HEADING_PATTERN.finditer(self.text, self.closed_upto + 1, limit):
+            if match.start() - self.closed_upto >= self.chapter_chars // 3:
+                return match.start()
+
+        if limit - self.closed_upto < self.chapter_chars:
+            return None
+
+        # 否则在章节长度附近的最后一个段落边界处切分
+        end = self.closed_upto + self.chapter_chars
+        paragraph_end = self.text.rfind("\n", self.closed_upto + self.chapter_chars // 2, end)
+        return paragraph_end + 1 if paragraph_end != -1 else end
+
+    def _summarize(self, text, max_chars):
+        try:
+            summary = (self.summarize_fn(text, max_chars) or "").strip()
+            if summary:
+                return summary
+        except Exception as e:
+            logger.warning(f"续写记忆：生成摘要失败，改用原文开头代替: {str(e)}")
+        return text.strip()[:max_chars]
+
+    # 当摘要总量超过预算的一半时，逐级合并最早的同级摘要
+    def _compact(self):
+        summary_budget = self.token_budget // 2
+        while self._summary_tokens() > summary_budget:
+            level, start = self._oldest_mergeable_run()
+            if start is None:
+                # 已经无法继续合并，丢弃最早的摘要；只剩一条时截断它
+                if len(self.summaries) > 1:
+                    self.summaries.pop(0)
+                    continue
+                level, oldest = self.summaries[0]
+                self.summaries[0] = (level, oldest[-self.summary_chars * 2:])
+                break
+            run = self.summaries[start:start + self.merge_fanout]
+            merged_text = "\n".join(summary for _, summary in run)
+            merged = self._summarize(merged_text, self.summary_chars * 2)
+            self.summaries[start:start + self.merge_fanout] = [(level + 1, merged)]
+            logger.info(f"续写记忆：已将{len(run)}条{level}级摘要合并为{level + 1}级摘要")
+
+    # 找到最早的一段可以合并的同级摘要（至少merge_fanout条连续同级）
+    def _oldest_mergeable_run(self):
+        start = 0
+        while start < len(self.summaries):
+            level = self.summaries[start][0]
+            end = start
+            while end < len(self.summaries) and self.summaries[end][0] == level:
+                end += 1
+            if end - start >= self.merge_fanout:
+                return level, start
+            start = end
+        return None, None
+
+    def _summary_tokens(self):
+        return sum(estimate_tokens(summary) for _, summary in self.summaries)
+
+    # 前文摘要文本
+    def summary_text(self):
+        return "\n".join(summary for _, summary in self.summaries)
+
+    # 最近写作的原文（尚未被摘要覆盖的部分），超出预算时只保留结尾
+    def recent_text(self):
+        recent = self.text[self.closed_upto:]
+        recent_budget = self.token_budget - self._summary_tokens()
+        while len(recent) > self.tail_chars and estimate_tokens(recent) > recent_budget:
+            recent = recent[-max(self.tail_chars, len(recent) * 3 // 4):]
+        return recent
+
+    # 记录一轮续写的提示词大小，便于观察提示词是否保持平稳
+    def record_prompt(self, prompt):
+        size = (len(prompt), estimate_tokens(prompt))
+        self.prompt_sizes.append(size)
+        logger.info(f"续写第{len(self.prompt_sizes)}轮：提示词{size[0]}字符，约{size[1]} tokens")
+        return size
@@ -0,0 +1,166 @@
+"""每轮生成的吞吐和延迟统计。
+
+Ollama 在最后一条消息（非流式请求的响应）中返回 prompt_eval_count/prompt_eval_duration、
+eval_count/eval_duration、load_duration 和 total_duration（单位为纳秒）；客户端再记录首个token的延迟、
+总耗时以及处理流式文本所用的时间。据此可以区分变慢的原因是模型本身、提示词变长，还是客户端代码。
+"""
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+from metrics_exporter import ROUNDS, PROMPT_TOKENS, EVAL_TOKENS, REQUEST_SECONDS, FIRST_TOKEN_SECONDS, DECODE_TPS
+
+logger = logging.getLogger("NovelApp")
+
+
+def _seconds(nanoseconds):
+    return (nanoseconds or 0) / 1e9
+
+
+def _rate(count, nanoseconds):
+    return count / _seconds(nanoseconds) if count and nanoseconds else 0.0
+
+
+class StreamTimer:
+    """一次请求的客户端计时。在发送请求之前创建，每收到一条流式消息调用一次 mark()。"""
+
+    def __init__(self, window_seconds=3.0):
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.finished = None
+        self.messages = 0
+        self.handler_seconds = 0.0  # 客户端处理流式文本（解析标签、统计字数、回调）所用的时间
+        self.window_seconds = window_seconds
+        self._recent = deque()  # 最近 window_seconds 内收到消息的时间
+
+    def mark(self):
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        self.messages += 1
+        self._recent.append(now)
+        while self._recent[0] < now - self.window_seconds:
+            self._recent.popleft()
+
+    def finish(self):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+    # 实时速度：最近几秒内每秒收到的token数（流式响应每条消息约为一个token）
+    @property
+    def tokens_per_second(self):
+        if self.finished is not None or len(self._recent) < 2:
+            return 0.0
+        span = max(time.perf_counter() - self._recent[0], self._recent[-1] - self._recent[0])
+        return len(self._recent) / span if span > 0 else 0.0
+
+
+# 根据最后一条消息和客户端计时生成一条统计记录
+def build_sample(kind, model, done_data, timer):
+    done_data = done_data or {}
+    timer.finish()
+    wall_seconds = timer.finished - timer.started
+    server_seconds = _seconds(done_data.get("total_duration"))
+    return {
+        "time": time.time(),
+        "kind": kind,
+        "model": model,
+        "completed": bool(done_data),
+        "prompt_tokens": done_data.get("prompt_eval_count", 0),
+        "eval_tokens": done_data.get("eval_count", 0),
+        "ttft": round(timer.first_token - timer.started, 4) if timer.first_token else None,
+        "prefill_tps": round(_rate(done_data.get("prompt_eval_count"), done_data.get("prompt_eval_duration")), 2),
+        "decode_tps": round(_rate(done_data.get("eval_count"), done_data.get("eval_duration")), 2),
+        "load_seconds": round(_seconds(done_data.get("load_duration")), 4),
+        "server_seconds": round(server_seconds, 4),
+        "wall_seconds": round(wall_seconds, 4),
+        # 总耗时中不属于服务端的部分：网络传输、排队以及客户端处理
+        "client_overhead_seconds": round(max(0.0, wall_seconds - server_seconds), 4) if server_seconds else None,
+        "handler_seconds": round(timer.handler_seconds, 4),
+    }
+
+
+class MetricsRecorder:
+    """收集每轮和每篇小说的统计，追加写入JSON Lines文件（path 为 None 时只记录日志）。"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.listeners = []  # 每条统计记录生成后调用的函数，如检查冷加载
+        self._lock = threading.Lock()
+
+    # 更新Prometheus指标，并通知监听者
+    def _export(self, sample):
+        for listener in self.listeners:
+            listener(sample)
+        kind = sample["kind"]
+        PROMPT_TOKENS.inc(sample["prompt_tokens"], kind=kind)
+        EVAL_TOKENS.inc(sample["eval_tokens"], kind=kind)
+        REQUEST_SECONDS.observe(sample["wall_seconds"], kind=kind)
+        if sample["decode_tps"]:
+            DECODE_TPS.set(sample["decode_tps"], kind=kind)
+
+    def _write(self, record):
+        if not self.path:
+            return
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            logger.error(f"写入统计文件失败: {str(e)}")
+
+    # 一次流式请求（写作的一轮、修改、大纲模式的一章）
+    def record_round(self, job, kind, model, timer, done_data, **extra):
+        sample = build_sample(kind, model, done_data, timer)
+        sample.update(type="round", job_id=job.job_id, round=len(job.round_metrics) + 1, **extra)
+        job.round_metrics.append(sample)
+        self._export(sample)
+        ROUNDS.inc(kind=kind)
+        if sample["ttft"] is not None:
+            FIRST_TOKEN_SECONDS.observe(sample["ttft"], kind=kind)
+        self._write(sample)
+        logger.info(f"[{kind}] 首token {sample['ttft']}s，预填充{sample['prompt_tokens']} tokens "
+                    f"@ {sample['prefill_tps']} tokens/s，生成{sample['eval_tokens']} tokens "
+                    f"@ {sample['decode_tps']} tokens/s，模型加载{sample['load_seconds']}s，"
+                    f"客户端额外耗时{sample['client_overhead_seconds']}s（处理流式文本{sample['handler_seconds']}s）")
+        return sample
+
+    # 一次非流式请求（写作要求、摘要、评估等）
+    def record_call(self, kind, model, result, timer):
+        sample = build_sample(kind, model, result, timer)
+        sample["type"] = "call"
+        self._export(sample)
+        self._write(sample)
+        logger.debug(f"[{kind}] 耗时{sample['wall_seconds']}s，生成{sample['eval_tokens']} tokens "
+                     f"@ {sample['decode_tps']} tokens/s")
+        return sample
+
+    # 一篇小说的汇总
+    def record_novel(self, job):
+        rounds = job.round_metrics
+        if not rounds:
+            return None
+        eval_tokens = sum(r["eval_tokens"] for r in rounds)
+        decode_seconds = sum(r["eval_tokens"] / r["decode_tps"] for r in rounds if r["decode_tps"])
+        ttfts = [r["ttft"] for r in rounds if r["ttft"] is not None]
+        summary = {
+            "type": "novel",
+            "time": time.time(),
+            "job_id": job.job_id,
+            "rounds": len(rounds),
+            "words": job.word_counter.total,
+            "prompt_tokens": sum(r["prompt_tokens"] for r in rounds),
+            "eval_tokens": eval_tokens,
+            "decode_tps": round(eval_tokens / decode_seconds, 2) if decode_seconds else 0.0,
+            "avg_ttft": round(sum(ttfts) / len(ttfts), 4) if ttfts else None,
+            "load_seconds": round(sum(r["load_seconds"] for r in rounds), 4),
+            "wall_seconds": round(sum(r["wall_seconds"] for r in rounds), 4),
+            "handler_seconds": round(sum(r["handler_seconds"] for r in rounds), 4),
+        }
+        self._write(summary)
+        logger.info(f"本篇统计：{summary['rounds']}轮，{summary['words']}字，"
+                    f"平均生成速度{summary['decode_tps']} tokens/s，平均首token {summary['avg_ttft']}s，"
+                    f"模型加载共{summary['load_seconds']}s")
+        return summary
@@ -0,0 +1,229 @@
+"""Prometheus 格式的指标和内置的 HTTP 服务端点，用于无人值守的长时间自动创作。
+
+指标只在每轮、每次请求或每篇小说结束时更新（不是每个token），每次更新只是加锁后修改一个数字；
+抓取时才生成文本，因此可以一直开启并每隔几秒抓取一次。本模块只使用标准库。
+"""
+import math
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger("NovelApp")
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value, quote=False):
+    value = str(value).replace('\\', '\\\\').replace('\n', '\\n')
+    return value.replace('"', '\\"') if quote else value
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value, quote=True)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.metric_type}"]
+        for name, key, extra, value in self._samples():
+            lines.append(f"{name}{_format_labels(self.label_names, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    # 所有标签组合的总和
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def __init__(self, name, documentation, label_names=()):
+        super().__init__(name, documentation, label_names)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    # 抓取时才调用 func 取值，func 返回数值或 {标签值元组: 数值}
+    def set_function(self, func):
+        self._function = func
+
+    def _samples(self):
+        if self._function is None:
+            return super()._samples()
+        try:
+            result = self._function()
+        except Exception as e:
+            logger.warning(f"读取指标 {self.name} 失败: {str(e)}")
+            return []
+        if not isinstance(result, dict):
+            result = {(): result}
+        return [(self.name, key if isinstance(key, tuple) else (key,), (), value) for key, value in result.items()]
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((self.name + "_bucket", key, (("le", _format_value(bound)),), cumulative))
+                samples.append((self.name + "_sum", key, (), total))
+                samples.append((self.name + "_count", key, (), count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=()):
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# 进程内共用的指标，所有引擎、调度器和图形界面都写入这里
+REGISTRY = Registry()
+
+NOVELS_COMPLETED = REGISTRY.counter("novel_novels_completed_total", "完成的小说篇数（每篇只计一次，修改后另存不重复计数）")
+NOVELS_FAILED = REGISTRY.counter("novel_novels_failed_total", "生成出错的小说篇数")
+WORDS_GENERATED = REGISTRY.counter("novel_words_generated_total", "已生成的字数（中文字符数+英文单词数）")
+ROUNDS = REGISTRY.counter("novel_rounds_total", "流式生成请求数（写作的一轮、一章或一次修改）", ["kind"])
+PROMPT_TOKENS = REGISTRY.counter("novel_prompt_tokens_total", "预填充的token数", ["kind"])
+EVAL_TOKENS = REGISTRY.counter("novel_eval_tokens_total", "生成的token数", ["kind"])
+REQUEST_SECONDS = REGISTRY.histogram("novel_request_duration_seconds", "模型请求的总耗时（秒）", ["kind"])
+FIRST_TOKEN_SECONDS = REGISTRY.histogram("novel_time_to_first_token_seconds", "流式请求的首token延迟（秒）", ["kind"])
+DECODE_TPS = REGISTRY.gauge("novel_decode_tokens_per_second", "最近一次请求的生成速度", ["kind"])
+REQUEST_ERRORS = REGISTRY.counter("novel_ollama_request_errors_total", "最终失败的Ollama请求数", ["type"])
+REQUEST_RETRIES = REGISTRY.counter("novel_ollama_request_retries_total", "Ollama请求的重试次数")
+ERRORS = REGISTRY.counter("novel_errors_total", "生成、评估等流程中出现的错误数", ["stage", "type"])
+EVALUATION_SCORE = REGISTRY.histogram("novel_evaluation_score", "质量评估的总体评分", buckets=range(1, 11))
+COLD_LOADS = REGISTRY.counter("novel_model_cold_loads_total", "请求时模型需要重新加载的次数", ["model", "kind"])
+MODEL_LOAD_SECONDS = REGISTRY.histogram("novel_model_load_seconds", "模型加载耗时（秒）", ["model"])
+MODEL_SWAPS = REGISTRY.counter("novel_model_swaps_total", "分批调度中相邻两步使用不同模型的次数")
+MODEL_SWAPS_AVOIDED = REGISTRY.gauge("novel_model_swaps_avoided", "与逐篇执行相比，分批调度减少的模型切换次数")
+REPETITION_ABORTS = REGISTRY.counter("novel_repetition_aborts_total", "因模型陷入循环而提前中止的轮数")
+REPETITION_TRIMMED_CHARS = REGISTRY.counter("novel_repetition_trimmed_chars_total", "从循环的轮次中删除的重复字符数")
+REPETITION_TOKENS_SAVED = REGISTRY.counter("novel_repetition_tokens_saved_total", "提前中止循环估计节省的token数")
+OVERLAP_TRIMMED_CHARS = REGISTRY.counter("novel_overlap_trimmed_chars_total", "续写开头复述上文而被删除的字符数")
+CACHE_REQUESTS = REGISTRY.counter("novel_response_cache_requests_total", "可缓存的模型调用次数（result为hit/miss/bypass）",
+                                  ["kind", "result"])
+REQUIREMENT_POOL_TAKES = REGISTRY.counter("novel_requirement_pool_takes_total",
+                                          "取用写作要求的次数（result为hit从池中取出/miss当场生成）", ["result"])
+REQUIREMENT_POOL_SECONDS_SAVED = REGISTRY.counter("novel_requirement_pool_seconds_saved_total",
+                                                  "从写作要求池取用而省去的等待秒数（估计值）")
+REQUIREMENT_POOL_READY = REGISTRY.gauge("novel_requirement_pool_ready", "写作要求池中已准备好的条数")
+REQUIREMENT_DUPLICATES = REGISTRY.counter("novel_requirement_duplicates_total", "因与历史写作要求过于相似而重新生成的次数")
+QUEUE_DEPTH = REGISTRY.gauge("novel_queue_depth", "调度器中排队的小说数")
+ACTIVE_JOBS = REGISTRY.gauge("novel_active_jobs", "正在生成的小说数")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 不把每次抓取写入日志
+
+
+# 在后台线程中启动指标服务，返回服务对象（调用 shutdown() 停止）
+def start_metrics_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"指标服务已启动：http://{host}:{server.server_address[1]}/metrics")
+    return server
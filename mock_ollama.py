@@ -0,0 +1,237 @@
+"""本地模拟的 Ollama 服务，用于在没有模型的情况下测量本程序自身的开销。
+
+支持 /api/generate、/api/chat（流式和非流式）和 /api/tags。输出的文本是确定的（相同的提示词得到相同的输出），
+可以配置生成速度、每条消息的字符数、首token延迟、是否包含 <think> 思维推理内容，以及是否模拟模型陷入循环；
+流式输出时会故意把标签拆在两条消息之间。最后一条消息包含与 Ollama 相同的统计字段和 context。
+
+用法：
+    python mock_ollama.py --port 11435 --rate 50 --chunk-chars 2
+    OLLAMA_HOST=http://127.0.0.1:11435 python novel_cli.py --count 1
+"""
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+STORY_SENTENCES = [
+    "雨夜的站台上，她撑着一把旧伞，望着列车驶来的方向。",
+    "他从人群中走出来，衣角还带着远方城市的尘土。",
+    "Goodbye, my love. 她在心里默念着那句没有说出口的话。",
+    "咖啡馆的灯光很暖，窗外的梧桐叶一片片落下。",
+    "多年以后，他们终于明白，错过也是一种成全。",
+    "她笑了笑，把那封泛黄的信放回了抽屉。",
+]
+THINK_SENTENCES = [
+    "这一段需要先交代人物的心理变化，",
+    "然后用环境描写烘托气氛，",
+    "最后为下一章埋下伏笔。",
+]
+
+DEFAULT_SETTINGS = {
+    "rate": 0,  # 每秒输出的消息数（约等于 tokens/s），0 表示不限速
+    "chunk_chars": 2,  # 每条消息的字符数
+    "first_token_latency": 0.0,  # 首条消息之前的延迟（秒），模拟预填充
+    "response_chars": 600,  # 每次生成的正文字符数
+    "think_chars": 60,  # 每次生成的思维推理字符数，0 表示不输出 <think>
+    "loop_after_chars": 0,  # 正文超过该字符数后反复输出同一句话（模拟模型陷入循环），0 表示不模拟
+    "models": ["mock-writer:latest", "mock-evaluator:latest"],
+}
+
+
+# 根据提示词生成确定的输出文本；要求生成章节大纲时按“第X章 标题：梗概”逐行输出，
+# 质量评估时按评估报告的格式输出各项评分；正文每句前加上递增的天数，避免出现大段重复而被当作循环
+def build_response(prompt, response_chars, think_chars, loop_after_chars=0):
+    rng = random.Random(hashlib.sha1(prompt.encode('utf-8')).hexdigest())
+    outline = re.search(r'设计一个共(\d+)章的小说大纲', prompt)
+    if outline:
+        return "\n".join(f"第{i + 1}章 第{i + 1}个转折：{rng.choice(STORY_SENTENCES)}"
+                         for i in range(int(outline.group(1))))
+    if "- 总体评分: X/10" in prompt:
+        scores = "\n".join(f"- {name}: {rng.randint(5, 9)}/10"
+                           for name in ("总体评分", "情节评分", "人物评分", "语言评分", "创意评分", "需求符合度"))
+        return (f"{scores}\n\n## 点评:\n{rng.choice(STORY_SENTENCES)}\n\n"
+                f"## 改进建议:\n1. 加强{rng.choice(('人物动机', '情节转折', '环境描写', '对话节奏'))}的刻画")
+    story = []
+    length = 0
+    while length < response_chars:
+        if loop_after_chars and length >= loop_after_chars:
+            sentence = STORY_SENTENCES[0]
+        else:
+            sentence = f"第{len(story) + 1}天，{rng.choice(STORY_SENTENCES)}"
+        story.append(sentence)
+        length += len(sentence)
+    story_text = "".join(story)[:response_chars]
+    if not think_chars:
+        return story_text
+    think_text = ("".join(THINK_SENTENCES) * (think_chars // 30 + 1))[:think_chars]
+    return f"<think>{think_text}</think>{story_text}"
+
+
+# 切分为流式消息；标签总是被拆开（如 "<thi" + "nk>"），以覆盖客户端的跨消息解析
+def split_chunks(text, chunk_chars):
+    chunks = []
+    i = 0
+    while i < len(text):
+        size = chunk_chars
+        for tag in ("<think>", "</think>"):
+            index = text.find(tag, i, i + size + len(tag))
+            if index != -1 and i <= index < i + size:
+                size = max(1, index - i + 3)  # 在标签中间切开
+                break
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = DEFAULT_SETTINGS
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, payload):
+        line = (json.dumps(payload, ensure_ascii=False) + "\n").encode('utf-8')
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({"models": [{"name": name, "model": name} for name in self.settings["models"]]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.path == '/api/generate':
+            prompt = request.get('prompt', '')
+            self._respond(request, prompt, chat=False)
+        elif self.path == '/api/chat':
+            prompt = "\n".join(m.get('content', '') for m in request.get('messages', []))
+            self._respond(request, prompt, chat=True)
+        else:
+            self.send_error(404)
+
+    def _respond(self, request, prompt, chat):
+        settings = self.settings
+        started = time.perf_counter()
+        text = build_response(prompt + json.dumps(request.get('context', [])[-8:]),
+                              settings["response_chars"], settings["think_chars"], settings["loop_after_chars"])
+        chunks = split_chunks(text, settings["chunk_chars"])
+        prompt_tokens = len(prompt) + len(request.get('context') or [])
+        model = request.get('model', settings["models"][0])
+
+        def message(content, done):
+            payload = {"model": model, "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ'), "done": done}
+            if chat:
+                payload["message"] = {"role": "assistant", "content": content}
+            else:
+                payload["response"] = content
+            return payload
+
+        def final_message():
+            eval_seconds = len(chunks) / settings["rate"] if settings["rate"] else 0.001
+            prefill_seconds = max(settings["first_token_latency"], 0.001)
+            payload = message("", True)
+            payload.update({
+                "done_reason": "stop",
+                "total_duration": int((time.perf_counter() - started) * 1e9),
+                "load_duration": 0,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prefill_seconds * 1e9),
+                "eval_count": len(chunks),
+                "eval_duration": int(eval_seconds * 1e9),
+            })
+            if not chat:
+                payload["context"] = list(range(prompt_tokens + len(chunks)))[-4096:]
+            return payload
+
+        if settings["first_token_latency"]:
+            time.sleep(settings["first_token_latency"])
+
+        if not request.get('stream', True):
+            if settings["rate"]:
+                time.sleep(len(chunks) / settings["rate"])
+            payload = final_message()
+            if chat:
+                payload["message"]["content"] = text
+            else:
+                payload["response"] = text
+            self._send_json(payload)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        interval = 1 / settings["rate"] if settings["rate"] else 0
+        next_at = time.perf_counter()
+        try:
+            for chunk in chunks:
+                if interval:
+                    next_at += interval
+                    delay = next_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                self._write_chunk(message(chunk, False))
+            self._write_chunk(final_message())
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端提前断开（如停止生成）
+
+
+class MockOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return  # 客户端关闭了空闲的keep-alive连接
+        super().handle_error(request, client_address)
+
+
+# 启动模拟服务，返回 (服务对象, 服务地址)；port=0 时自动选择空闲端口
+def start_mock_server(port=0, host="127.0.0.1", **settings):
+    handler = type("ConfiguredMockOllamaHandler", (MockOllamaHandler,),
+                   {"settings": dict(DEFAULT_SETTINGS, **settings)})
+    server = MockOllamaServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="mock-ollama", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模拟的 Ollama 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435, help="端口，0 表示自动选择")
+    parser.add_argument("--rate", type=float, default=DEFAULT_SETTINGS["rate"], help="每秒输出的消息数，0 表示不限速")
+    parser.add_argument("--chunk-chars", type=int, default=DEFAULT_SETTINGS["chunk_chars"])
+    parser.add_argument("--first-token-latency", type=float, default=DEFAULT_SETTINGS["first_token_latency"])
+    parser.add_argument("--response-chars", type=int, default=DEFAULT_SETTINGS["response_chars"])
+    parser.add_argument("--think-chars", type=int, default=DEFAULT_SETTINGS["think_chars"])
+    parser.add_argument("--loop-after-chars", type=int, default=DEFAULT_SETTINGS["loop_after_chars"])
+    args = parser.parse_args(argv)
+    server, url = start_mock_server(args.port, args.host, rate=args.rate, chunk_chars=args.chunk_chars,
+                                    first_token_latency=args.first_token_latency,
+                                    response_chars=args.response_chars, think_chars=args.think_chars,
+                                    loop_after_chars=args.loop_after_chars)
+    print(url, flush=True)  # 基准测试从标准输出读取服务地址
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""按模型分批安排 写作 → 评估 → 修改 的流程，减少写作模型和评估模型之间的切换。
+
+写作模型和评估模型不同、内存又放不下两个模型时，逐篇执行“写作→评估→修改”每一步都要卸载并重新加载模型。
+本调度器先用写作模型连续写几篇，再用评估模型把它们一起评估，然后切回写作模型修改这些小说并写下一批，
+这样每批只来回切换一次模型。队列中的任务等待超过最长延迟时，即使当前批次未写满也会切换过去。
+
+每篇小说写完后立即保存；评分低于阈值的小说修改后另存为一个新文件。
+"""
+import time
+import logging
+from collections import deque
+
+from novel_engine import NovelEngine, parse_overall_score
+from checkpoint_journal import find_unfinished_sessions
+from stage_profiler import RunProfile
+from metrics_exporter import NOVELS_COMPLETED, NOVELS_FAILED, ERRORS, MODEL_SWAPS, MODEL_SWAPS_AVOIDED
+
+logger = logging.getLogger("NovelApp")
+
+# 同一模型上可以执行多个阶段时的优先顺序：先完成已开始的小说，再写新的
+STAGE_PRIORITY = ("revise", "evaluate", "write")
+
+
+# 按顺序执行的模型序列中切换模型的次数
+def count_swaps(models):
+    return sum(1 for previous, current in zip(models, models[1:]) if previous != current)
+
+
+class ModelBatchScheduler:
+    def __init__(self, engine=None, config=None):
+        self.engine = engine or NovelEngine(config)
+        config = self.engine.config
+        self.batch_size = max(1, int(config["model_batch_size"]))
+        self.max_delay = config["model_batch_max_delay_seconds"]
+        self.revise_below_score = config["revise_below_score"]
+        self.queues = {"evaluate": deque(), "revise": deque()}  # 元素为 (入队时间, 任务)
+        self.executed_models = []  # 实际执行顺序中每个请求使用的模型
+        self.per_job_models = []  # 逐篇执行时每个请求使用的模型，用于计算避免的切换次数
+        self._novel_models = {}  # job_id -> 该篇各阶段使用的模型
+        self.current_model = None  # 当前批次使用的模型
+        self.completed = 0
+        self.revised = 0
+        self.failed = 0
+        self.words = 0
+        self.started_at = None
+
+    def stop(self):
+        self.engine.stop()
+
+    # 各阶段使用的模型；写作阶段未指定写作要求时还会用 model_name 生成写作要求
+    def _stage_models(self, stage, generate_requirement=False):
+        config = self.engine.config
+        if stage == "evaluate":
+            return [config["evaluation_model_name"]]
+        if stage == "write" and generate_requirement:
+            return [config["model_name"], config["writing_model_name"]]
+        return [config["writing_model_name"]]
+
+    def _stage_model(self, stage):
+        return self._stage_models(stage)[-1]
+
+    # 写作要求池只在当前批次使用 model_name 时补充，否则补充会引起模型切换（且不计入切换统计）
+    def _pool_paused(self):
+        return self.current_model != self.engine.config["model_name"]
+
+    # 选择下一个阶段：其他模型的任务等待太久时切换；否则留在当前模型上，
+    # 直到排队的任务做完并且本批已写满 batch_size 篇
+    def _next_stage(self, current_model, batch_written, can_write):
+        ready = [stage for stage in STAGE_PRIORITY
+                 if (stage == "write" and can_write) or (stage != "write" and self.queues[stage])]
+        if not ready:
+            return None
+        now = time.monotonic()
+        overdue = [stage for stage in ready if stage != "write" and self._stage_model(stage) != current_model
+                   and now - self.queues[stage][0][0] >= self.max_delay]
+        if overdue:
+            return min(overdue, key=lambda stage: self.queues[stage][0][0])
+        same = [stage for stage in ready if self._stage_model(stage) == current_model
+                and (stage != "write" or batch_written < self.batch_size)]
+        if same:
+            return same[0]
+        others = [stage for stage in ready if self._stage_model(stage) != current_model]
+        return (others or ready)[0]
+
+    def _record(self, job, models):
+        self.executed_models.extend(models)
+        self._novel_models.setdefault(job.job_id, []).extend(models)
+        MODEL_SWAPS.inc(count_swaps(self.executed_models[-len(models) - 1:]))
+
+    # 一篇小说的流程结束，把它按逐篇执行的顺序计入对比基准
+    def _finish(self, job):
+        self.per_job_models.extend(self._novel_models.pop(job.job_id, []))
+        self.completed += 1
+        NOVELS_COMPLETED.inc()
+        self.words += job.word_counter.total
+        MODEL_SWAPS_AVOIDED.set(self.swaps_avoided())
+
+    def swaps_avoided(self):
+        return count_swaps(self.per_job_models) - count_swaps(self.executed_models)
+
+    # 写一篇新的（或从断点日志恢复的）小说并保存，然后排入评估队列
+    def _write(self, on_status, session=None):
+        engine = self.engine
+        if session:
+            job = engine.resume_job(session)
+            if job is None:
+                return
+            self._record(job, self._stage_models("write"))
+        else:
+            user_prompt = engine.next_requirement()
+            logger.info(f"新的写作要求: {user_prompt}")
+            job = engine.new_job(user_prompt)
+            self._record(job, self._stage_models("write", generate_requirement=True))
+        with RunProfile(engine.config["cprofile_enabled"]) as profile:
+            engine.write_novel(job, on_status=on_status, resume=bool(session))
+        if not job.generated_content.strip():
+            job.discard_checkpoint()
+            self._novel_models.pop(job.job_id, None)
+            return
+        filepath = engine.save_job(job)
+        logger.info(f"内容已保存至：{filepath}")
+        profile.dump_next_to(filepath)
+        self.queues["evaluate"].append((time.monotonic(), job))
+
+    # 评估一篇小说；评分低于阈值时生成修改建议并排入修改队列
+    def _evaluate(self, job):
+        self._record(job, self._stage_models("evaluate"))
+        evaluation_result = self.engine.evaluate_novel(job.user_prompt, job.generated_content)
+        score = parse_overall_score(evaluation_result)
+        logger.info(f"[{job.job_id}] 评估完成，总体评分：{score}")
+        if score is not None and score >= self.revise_below_score:
+            self._finish(job)
+            return
+        suggestions = self.engine.revision_suggestions(job.user_prompt, job.generated_content, evaluation_result)
+        self.queues["revise"].append((time.monotonic(), (job, suggestions)))
+
+    # 按修改建议重写，另存为新文件
+    def _revise(self, job, suggestions):
+        self._record(job, self._stage_models("revise"))
+        if self.engine.revise_novel(job, suggestions) is None:
+            self._finish(job)  # 修改被停止，原来的内容已经保存
+            return
+        logger.info(f"修改后的内容已保存至：{self.engine.save_job(job)}")
+        self.revised += 1
+        self._finish(job)
+
+    # 当前的吞吐和模型切换统计
+    def stats(self):
+        elapsed_hours = (time.time() - self.started_at) / 3600 if self.started_at else 0
+        return {
+            "completed": self.completed,
+            "revised": self.revised,
+            "failed": self.failed,
+            "pending_evaluate": len(self.queues["evaluate"]),
+            "pending_revise": len(self.queues["revise"]),
+            "model_swaps": count_swaps(self.executed_models),
+            "swaps_avoided": self.swaps_avoided(),
+            "novels_per_hour": round(self.completed / elapsed_hours, 2) if elapsed_hours else 0.0,
+            "words_per_hour": round(self.words / elapsed_hours) if elapsed_hours else 0,
+        }
+
+    # 连续自动生成 count 篇（None 表示直到调用 stop()），每篇都经过评估，必要时修改；返回完成的篇数
+    # 开始前先继续写上次崩溃时未完成的小说（这些小说不计入篇数）
+    def run_auto(self, count=None, on_status=None):
+        engine = self.engine
+        self.started_at = time.time()
+        engine.start_requirement_pool(paused=self._pool_paused)
+        sessions = deque(find_unfinished_sessions(engine.config["checkpoint_dir"]))
+        written = 0
+        self.current_model = None
+        batch_steps = 0
+        batch_written = 0
+        while not engine.stop_event.is_set():
+            can_write = bool(sessions) or count is None or written < count
+            stage = self._next_stage(self.current_model, batch_written, can_write)
+            if stage is None:
+                break
+            model = self._stage_model(stage)
+            if model != self.current_model:
+                if self.current_model is not None:
+                    logger.info(f"切换模型：{self.current_model} → {model}（上一批执行了{batch_steps}步）")
+                self.current_model = model
+                batch_steps = 0
+                batch_written = 0
+                engine.residency.ping_models = [model]  # 只保活当前批次的模型，避免保活请求引起切换
+            elif stage == "write" and batch_written >= self.batch_size:
+                batch_written = 0  # 另一个模型没有任务，在当前模型上开始新的一批
+            batch_steps += 1
+            batch_written += stage == "write"
+            job = None
+            try:
+                if stage == "write":
+                    if sessions:
+                        self._write(on_status, sessions.popleft())
+                    else:
+                        written += 1
+                        self._write(on_status)
+                        engine.stop_event.wait(engine.config["auto_interval_seconds"])
+                elif stage == "evaluate":
+                    job = self.queues["evaluate"].popleft()[1]
+                    self._evaluate(job)
+                else:
+                    job, suggestions = self.queues["revise"].popleft()[1]
+                    self._revise(job, suggestions)
+            except Exception as e:
+                logger.exception(f"[{stage}] 自动生成出错: {str(e)}")
+                ERRORS.inc(stage=stage, type=type(e).__name__)
+                if stage == "write":
+                    NOVELS_FAILED.inc()
+                    self.failed += 1
+                elif job is not None:
+                    self._finish(job)  # 已保存的小说评估或修改失败时不再重试
+        logger.info(f"分批调度已结束: {self.stats()}")
+        return self.completed
@@ -0,0 +1,117 @@
+"""模型常驻管理：启动时预加载模型，每次请求带上 keep_alive，空闲时定期保活，并记录冷加载。
+
+Ollama 在模型空闲超过 keep_alive（默认5分钟）后会卸载模型，下一次请求需要重新加载，
+在CPU节点上 load_duration 可达数十秒。预加载和保活都是在后台线程中发送空提示词的请求
+（Ollama 对空提示词只加载模型、不生成），不会阻塞界面或生成流程。
+"""
+import time
+import logging
+import threading
+
+from metrics_exporter import COLD_LOADS, MODEL_LOAD_SECONDS
+
+logger = logging.getLogger("NovelApp")
+
+
+class ModelResidencyManager:
+    def __init__(self, client, models, keep_alive="30m", ping_interval=0, cold_load_threshold=1.0):
+        self.client = client
+        self.models = list(dict.fromkeys(m for m in models if m))  # 去重并保持顺序
+        self.keep_alive = keep_alive  # 字符串（如"30m"）、秒数、-1（常驻）或 {模型: 值}；None 表示使用Ollama的默认值
+        self.ping_interval = ping_interval  # 空闲超过该秒数时发送保活请求，0 表示不保活
+        self.cold_load_threshold = cold_load_threshold  # load_duration 超过该秒数视为冷加载
+        self.ping_models = None  # 需要保活的模型，None 表示全部；内存只放得下一个模型时由分批调度器设为当前模型
+        self.last_used = {}
+        self.cold_loads = {}  # 模型 -> [次数, 累计加载秒数]
+        self.warmed_up = threading.Event()
+        self._stop_event = threading.Event()
+        self._ping_thread = None
+        self._lock = threading.Lock()
+
+    def _keep_alive_for(self, model):
+        if isinstance(self.keep_alive, dict):
+            return self.keep_alive.get(model)
+        return self.keep_alive
+
+    # 按策略给请求加上 keep_alive（请求中已指定时不覆盖），并记录模型最近一次使用的时间
+    def apply(self, request_data):
+        model = request_data.get("model")
+        keep_alive = self._keep_alive_for(model)
+        if keep_alive is not None:
+            request_data.setdefault("keep_alive", keep_alive)
+        self.last_used[model] = time.time()
+        return request_data
+
+    # 根据请求的统计记录检查是否发生了冷加载
+    def observe(self, sample):
+        load_seconds = sample.get("load_seconds") or 0.0
+        model = sample.get("model")
+        self.last_used[model] = time.time()
+        if load_seconds < self.cold_load_threshold:
+            return
+        with self._lock:
+            stats = self.cold_loads.setdefault(model, [0, 0.0])
+            stats[0] += 1
+            stats[1] += load_seconds
+        COLD_LOADS.inc(model=model, kind=sample.get("kind", ""))
+        MODEL_LOAD_SECONDS.observe(load_seconds, model=model)
+        logger.warning(f"模型冷加载：{model} 在 {sample.get('kind')} 请求中加载耗时{load_seconds:.1f}s"
+                       f"（累计{self.cold_loads[model][0]}次）")
+
+    # 发送一次只加载模型的请求，返回加载耗时（秒）
+    def _load(self, model, reason):
+        request_data = self.apply({"model": model, "prompt": "", "stream": False})
+        start = time.perf_counter()
+        result = self.client.generate(request_data, timeout=600)
+        load_seconds = (result.get("load_duration") or 0) / 1e9
+        if load_seconds >= self.cold_load_threshold:
+            MODEL_LOAD_SECONDS.observe(load_seconds, model=model)
+        log = logger.info if reason == "预加载" else logger.debug  # 保活请求很频繁，只在调试日志中记录
+        log(f"{reason}模型 {model}：加载{load_seconds:.1f}s，总耗时{time.perf_counter() - start:.1f}s")
+        return load_seconds
+
+    # 在后台线程中预加载模型（默认全部），立即返回；完成后 warmed_up 被设置
+    def warm_up_async(self, on_done=None, models=None):
+        def run():
+            for model in models or self.models:
+                if self._stop_event.is_set():
+                    break
+                try:
+                    self._load(model, "预加载")
+                except Exception as e:
+                    logger.warning(f"预加载模型 {model} 失败: {str(e)}")
+            self.warmed_up.set()
+            if on_done:
+                on_done()
+        threading.Thread(target=run, name="model-warmup", daemon=True).start()
+        self.start_pinging()
+
+    # 空闲时定期保活：模型距上次使用超过 ping_interval 时重新发送加载请求，刷新 keep_alive 计时
+    def start_pinging(self):
+        if not self.ping_interval or self._ping_thread:
+            return
+
+        def run():
+            while not self._stop_event.wait(self.ping_interval / 2):
+                now = time.time()
+                for model in self.ping_models or self.models:
+                    if now - self.last_used.get(model, 0) < self.ping_interval:
+                        continue
+                    try:
+                        if self._load(model, "保活") >= self.cold_load_threshold:
+                            logger.warning(f"保活时发现模型 {model} 已被卸载，请调大 keep_alive")
+                    except Exception as e:
+                        logger.warning(f"保活请求失败 {model}: {str(e)}")
+
+        self._ping_thread = threading.Thread(target=run, name="model-keepalive", daemon=True)
+        self._ping_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def report(self):
+        with self._lock:
+            if not self.cold_loads:
+                return "模型冷加载：无"
+            return "模型冷加载：" + "，".join(f"{model} {count}次/共{seconds:.1f}s"
+                                            for model, (count, seconds) in self.cold_loads.items())
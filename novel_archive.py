@@ -0,0 +1,206 @@
+"""小说归档存储：每天一个压缩包文件，每篇小说（正文+思维推理内容）单独压缩后追加到包末尾。
+
+目录结构为 archive_dir/年/月/年-月-日.pack，旁边的 .idx 文件每行记录一篇的偏移和长度。
+读取单篇时只需定位到偏移处解压这一条记录，不需要解压整个包。
+文件数按天增长而不是按篇增长，目录列表和备份的耗时不再随篇数增加。
+
+每条记录为：MAGIC(4字节) + 压缩方式(1字节) + 压缩后长度(4字节，大端) + 压缩后的JSON。
+记录是自描述的，.idx 缺失或落后于包文件（写包后、写索引前崩溃）时会扫描包文件补全。
+小说的位置（locator）为 "包文件路径#偏移"，可以代替文件路径保存在小说库中。
+"""
+import os
+import json
+import lzma
+import zlib
+import time
+import struct
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# 多个进程写同一个包文件时加锁：Unix 使用 fcntl，Windows 使用 msvcrt
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger("NovelApp")
+
+MAGIC = b"NVPK"
+HEADER = struct.Struct(">4sBI")
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+LOCK_SUFFIX = ".lock"
+LOCATOR_SEPARATOR = "#"
+CODECS = {
+    "lzma": (1, lambda data: lzma.compress(data, preset=6), lzma.decompress),
+    "zlib": (2, lambda data: zlib.compress(data, 9), zlib.decompress),
+}
+_DECOMPRESSORS = {code: decompress for code, _, decompress in CODECS.values()}
+
+
+def is_archive_locator(path):
+    pack_path, separator, offset = str(path).rpartition(LOCATOR_SEPARATOR)
+    return bool(separator) and pack_path.endswith(PACK_SUFFIX) and offset.isdigit()
+
+
+# 独占地写一个包文件及其索引。Windows 的文件锁是强制锁，锁住包文件会使其他进程无法读取，
+# 因此锁的是包文件旁边的 .lock 文件
+@contextmanager
+def _locked(pack_file, pack_path):
+    if fcntl:
+        fcntl.flock(pack_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(pack_file.fileno(), fcntl.LOCK_UN)
+        return
+    with open(pack_path[:-len(PACK_SUFFIX)] + LOCK_SUFFIX, 'a+b') as lock_file:
+        lock_file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue  # LK_LOCK 重试约10秒仍未获得锁时抛出，继续等待
+        try:
+            yield
+        finally:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# 读取一篇归档的小说，返回 {"content", "thinking", "meta"}；只读取并解压这一条记录
+def read_archived(locator):
+    pack_path, _, offset = str(locator).rpartition(LOCATOR_SEPARATOR)
+    with open(pack_path, 'rb') as f:
+        f.seek(int(offset))
+        magic, code, length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"归档位置无效：{locator}")
+        data = f.read(length)
+    return json.loads(_DECOMPRESSORS[code](data).decode('utf-8'))
+
+
+class NovelArchive:
+    def __init__(self, directory, compression="lzma"):
+        if compression not in CODECS:
+            raise ValueError(f"不支持的压缩方式：{compression}，可选 {', '.join(CODECS)}")
+        self.directory = directory
+        self.compression = compression
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _pack_path(self, created_at):
+        day = datetime.fromtimestamp(created_at)
+        return os.path.join(self.directory, day.strftime('%Y'), day.strftime('%m'),
+                            day.strftime('%Y-%m-%d') + PACK_SUFFIX)
+
+    # 保存一篇小说，返回它的位置（包文件路径#偏移）
+    def store(self, content, thinking="", metadata=None, created_at=None):
+        created_at = created_at or time.time()
+        meta = dict(metadata or {}, created_at=created_at)
+        raw = json.dumps({"content": content, "thinking": thinking, "meta": meta}, ensure_ascii=False).encode('utf-8')
+        code, compress, _ = CODECS[self.compression]
+        payload = compress(raw)
+        record = HEADER.pack(MAGIC, code, len(payload)) + payload
+
+        pack_path = self._pack_path(created_at)
+        os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+        entry = {"word_count": meta.get("word_count"), "created_at": created_at, "length": len(record),
+                 "raw_bytes": len(raw)}
+        with self._lock, open(pack_path, 'ab') as f, _locked(f, pack_path):
+            entry["offset"] = f.seek(0, os.SEEK_END)
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+            with open(pack_path[:-len(PACK_SUFFIX)] + INDEX_SUFFIX, 'a', encoding='utf-8') as index_file:
+                index_file.write(json.dumps(entry) + "\n")
+        return f"{pack_path}{LOCATOR_SEPARATOR}{entry['offset']}"
+
+    def read(self, locator):
+        return read_archived(locator)
+
+    # 扫描包文件中从 start 开始的记录头，返回索引条目（不解压）
+    def _scan(self, pack_path, start=0):
+        entries = []
+        with open(pack_path, 'rb') as f:
+            f.seek(start)
+            while True:
+                offset = f.tell()
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                magic, _, length = HEADER.unpack(header)
+                if magic != MAGIC or len(f.read(length)) < length:
+                    logger.warning(f"归档包末尾有不完整的记录，已忽略：{pack_path}@{offset}")
+                    break
+                entries.append({"offset": offset, "length": HEADER.size + length})
+        return entries
+
+    # 一个包文件的索引条目；索引落后于包文件时扫描补全
+    def _pack_entries(self, pack_path):
+        entries = []
+        index_path = pack_path[:-len(PACK_SUFFIX)] + INDEX_SUFFIX
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        end = entries[-1]["offset"] + entries[-1]["length"] if entries else 0
+        if os.path.getsize(pack_path) > end:
+            entries.extend(self._scan(pack_path, end))
+        return entries
+
+    def packs(self):
+        result = []
+        for current, _, names in os.walk(self.directory):
+            result.extend(os.path.join(current, name) for name in names if name.endswith(PACK_SUFFIX))
+        return sorted(result)
+
+    # 依次返回 (位置, 索引条目)，按日期和保存顺序排列
+    def entries(self):
+        for pack_path in self.packs():
+            for entry in self._pack_entries(pack_path):
+                yield f"{pack_path}{LOCATOR_SEPARATOR}{entry['offset']}", entry
+
+    # 导出为与 save_novel 相同命名的纯文本文件，返回文件路径
+    def export(self, locator, output_dir):
+        record = self.read(locator)
+        meta = record["meta"]
+        timestamp = datetime.fromtimestamp(meta["created_at"]).strftime('%Y%m%d_%H%M%S')
+        word_count = meta.get("word_count")
+        name = f"{word_count}字_{timestamp}" if word_count is not None else timestamp
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, name + ".txt")
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(output_dir, f"{name}_{suffix}.txt")
+            suffix += 1
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(record["content"])
+        return path
+
+    def export_all(self, output_dir):
+        count = 0
+        for locator, _ in self.entries():
+            self.export(locator, output_dir)
+            count += 1
+        logger.info(f"已从归档导出{count}篇小说至：{output_dir}")
+        return count
+
+    def stats(self):
+        packs = self.packs()
+        novels = stored = raw = 0
+        for pack_path in packs:
+            for entry in self._pack_entries(pack_path):
+                novels += 1
+                raw += entry.get("raw_bytes") or 0
+            stored += os.path.getsize(pack_path)
+        return {"packs": len(packs), "novels": novels, "stored_bytes": stored, "raw_bytes": raw,
+                "ratio": round(raw / stored, 2) if stored and raw else None}
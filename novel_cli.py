@@ -0,0 +1,202 @@
+"""无界面的命令行入口，用于在服务器上24小时不间断自动创作。
+
+用法：
+    python novel_cli.py --config novel_config.json
+    python novel_cli.py --config novel_config.json --count 10
+    python novel_cli.py --prompt "写作要求..." --target 5000
+    python novel_cli.py --config novel_config.json --concurrency 3
+    python novel_cli.py --config novel_config.json --batch-by-model
+
+本模块不导入 tkinter / tkhtmlview / markdown / docx。
+"""
+import argparse
+import json
+import logging
+import signal
+import sys
+
+from novel_engine import NovelEngine
+from novel_scheduler import NovelScheduler
+from model_batch_scheduler import ModelBatchScheduler
+from metrics_exporter import start_metrics_server
+from cassette import CassetteRecorder
+from stage_profiler import PROFILER
+from novel_archive import NovelArchive
+
+logger = logging.getLogger("NovelApp")
+
+FORCE_EXIT_JOIN_SECONDS = 5  # 第二次收到停止信号时等待工作线程的秒数
+
+
+# 去掉JSON中的 // 注释（字符串中的 // 保留，如地址中的 http://）
+def strip_json_comments(text):
+    result = []
+    in_string = escaped = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif text.startswith('//', i):
+            end = text.find('\n', i)
+            i = len(text) if end < 0 else end
+            continue
+        result.append(char)
+        i += 1
+    return "".join(result)
+
+
+# 读取JSON配置文件（可以包含 // 注释），未指定时使用默认配置
+def load_config(path):
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.loads(strip_json_comments(f.read()))
+
+
+def setup_logging(log_file, verbose=False):
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI 长篇小说写作助手（无界面模式）")
+    parser.add_argument("--config", help="JSON配置文件路径，键名与 novel_engine.DEFAULT_CONFIG 一致")
+    parser.add_argument("--count", type=int, default=None, help="生成的篇数，默认不限（直到收到停止信号）")
+    parser.add_argument("--prompt", help="指定写作要求并只生成一篇；不指定时自动生成写作要求")
+    parser.add_argument("--target", type=int, default=None, help="目标字数，覆盖配置文件中的 target_word_count")
+    parser.add_argument("--output-dir", default=None, help="输出目录，覆盖配置文件中的 output_dir")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="每个Ollama服务地址同时生成的小说数，覆盖配置文件中的 concurrency_per_endpoint")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="启动Prometheus指标服务（http://127.0.0.1:端口/metrics），覆盖配置文件中的 metrics_port")
+    parser.add_argument("--record", default=None, help="把Ollama的原始响应录制到磁带文件（.jsonl.gz）")
+    parser.add_argument("--replay", default=None, help="回放磁带文件代替Ollama服务")
+    parser.add_argument("--replay-speed", type=float, default=None, help="回放速度倍数，0 表示不等待，默认按原始速度")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="用cProfile分析每篇小说的写作过程，结果保存为小说旁边的.prof文件")
+    parser.add_argument("--batch-by-model", action="store_true",
+                        help="自动模式下每篇都评估并按需修改，按模型分批执行以减少写作和评估模型之间的切换")
+    parser.add_argument("--import-library", action="store_true",
+                        help="把输出目录中尚未索引的小说导入小说库后退出")
+    parser.add_argument("--export-archive", metavar="DIR",
+                        help="把归档（storage_backend 为 archive）中的小说全部导出为txt文件后退出")
+    parser.add_argument("--log-file", default="novel_app.log", help="日志文件路径")
+    parser.add_argument("--verbose", action="store_true", help="输出调试日志")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(args.log_file, args.verbose)
+
+    config = load_config(args.config)
+    if args.target:
+        config["target_word_count"] = args.target
+    if args.output_dir:
+        config["output_dir"] = args.output_dir
+    if args.concurrency:
+        config["concurrency_per_endpoint"] = args.concurrency
+    if args.metrics_port:
+        config["metrics_port"] = args.metrics_port
+    if args.record:
+        config["cassette_record"] = args.record
+    if args.replay:
+        config["cassette_replay"] = args.replay
+    if args.replay_speed is not None:
+        config["cassette_replay_speed"] = args.replay_speed
+    if args.cprofile:
+        config["cprofile_enabled"] = True
+    if args.batch_by_model:
+        config["model_batching"] = True
+    if config.get("metrics_port"):
+        start_metrics_server(config["metrics_port"], config.get("metrics_host", "127.0.0.1"))
+
+    # 单篇、导入和导出只需要一个引擎；自动模式下开启分批时使用按模型分批的调度器，
+    # 否则使用调度器，只有一个并发槽位时直接使用调度器为该地址创建的引擎
+    if args.prompt or args.import_library or args.export_archive:
+        runner = NovelEngine(config)
+    elif config.get("model_batching"):
+        runner = ModelBatchScheduler(config=config)
+    else:
+        runner = NovelScheduler(config)
+        if runner.total_slots == 1:
+            runner = runner.endpoints[0][1]
+    if args.import_library:
+        if runner.library is None:
+            logger.error("未启用小说库（library_db 为 None）")
+            return 1
+        runner.library.import_directory(runner.config["output_dir"])
+        logger.info(f"小说库：{runner.library.stats()}")
+        return 0
+    if args.export_archive:
+        NovelArchive(runner.config["archive_dir"]).export_all(args.export_archive)
+        return 0
+
+    # 收到 Ctrl+C 或 SIGTERM 时停止当前写作，等待已生成的内容保存后退出；
+    # 再次收到时最多再等 FORCE_EXIT_JOIN_SECONDS 秒就退出（尚未保存的内容保留在断点日志中）
+    stopping = []
+
+    def handle_signal(signum, frame):
+        if stopping:
+            logger.warning(f"再次收到停止信号({signum})，最多再等{FORCE_EXIT_JOIN_SECONDS}秒后退出")
+            if isinstance(runner, NovelScheduler):
+                runner.join(timeout=FORCE_EXIT_JOIN_SECONDS)
+            raise SystemExit(1)
+        stopping.append(signum)
+        logger.info(f"收到停止信号({signum})，正在停止并保存已生成的内容（再次按 Ctrl+C 强制退出）...")
+        runner.stop()
+    signal.signal(signal.SIGINT, handle_signal)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, handle_signal)
+    # kill -USR1 <pid> 时把各阶段的耗时统计写入日志
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: logger.info(PROFILER.report()))
+
+    if isinstance(runner, NovelEngine):
+        runner.warm_up()
+    elif isinstance(runner, ModelBatchScheduler):
+        # 每批只用一个模型，只预加载第一批要用的写作模型
+        runner.engine.warm_up(models=[runner.engine.config["writing_model_name"]])
+
+    try:
+        if args.prompt:
+            runner.run_one(args.prompt, on_status=logger.info)
+            return 0
+
+        if isinstance(runner, NovelScheduler):
+            completed = runner.run_auto(count=args.count)
+        else:
+            completed = runner.run_auto(count=args.count, on_status=logger.info)
+        logger.info(f"自动生成结束，共完成{completed}篇")
+        return 0
+    finally:
+        CassetteRecorder.close_all()  # 写完磁带中剩余的内容
+        logger.info(PROFILER.report())
+        if isinstance(runner, NovelScheduler):
+            engines = [engine for _, engine, _ in runner.endpoints]
+        else:
+            engines = [getattr(runner, "engine", runner)]
+        for engine in engines:
+            logger.info(engine.residency.report())
+        if engines[0].requirement_pool:
+            logger.info(engines[0].requirement_pool.report())
+        if engines[0].deduplicator:
+            logger.info(engines[0].deduplicator.report())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
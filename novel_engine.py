@@ -0,0 +1,999 @@
+"""无界面的小说生成引擎：写作要求生成、分轮续写、保存、评估和修改。
+
+图形界面（writing_novel.py）和命令行（novel_cli.py）共用这里的流程；本模块不导入任何GUI相关的库。
+"""
+import os
+import re
+import time
+import logging
+import threading
+import sqlite3
+import uuid
+from datetime import datetime
+
+import requests
+
+from continuation_memory import ContinuationMemory
+from context_session import ContextSession
+from generation_metrics import StreamTimer, MetricsRecorder
+from stage_profiler import PROFILER, RunProfile
+from metrics_exporter import (NOVELS_COMPLETED, NOVELS_FAILED, WORDS_GENERATED, ERRORS, EVALUATION_SCORE, ACTIVE_JOBS,
+                              REPETITION_ABORTS, REPETITION_TRIMMED_CHARS, REPETITION_TOKENS_SAVED,
+                              OVERLAP_TRIMMED_CHARS, CACHE_REQUESTS)
+from checkpoint_journal import CheckpointJournal, STORY, THINKING, RETRACT, find_unfinished_sessions
+from ollama_client import OllamaClient
+from model_residency import ModelResidencyManager
+from cassette import CassetteRecorder, ReplayClient
+from response_cache import ResponseCache, cache_key
+from requirement_pool import RequirementPool
+from requirement_dedup import RequirementDeduplicator
+from novel_library import NovelLibrary
+from novel_archive import NovelArchive, is_archive_locator, read_archived
+from chunked_evaluator import ChunkedEvaluator
+from outline_writer import OutlineWriter
+from text_stream import WordCounter, ThinkTagParser, RepetitionDetector, OverlapTrimmer
+
+logger = logging.getLogger("NovelApp")
+
+# 引擎的默认配置，命令行的配置文件和图形界面的全局变量都会覆盖其中的部分项
+DEFAULT_CONFIG = {
+    "ollama_base_urls": None,  # None 表示从环境变量 OLLAMA_HOSTS / OLLAMA_HOST 读取
+    "model_name": 'huihui_ai/qwen2.5-1m-abliterated:14b',  # 用于生成写作要求的模型
+    "writing_model_name": 'huihui_ai/qwen2.5-1m-abliterated:14b',  # 用于写作的模型
+    "evaluation_model_name": 'huihui_ai/qwen2.5-1m-abliterated:14b',  # 用于评估的模型
+    "target_word_count": 3000,
+    "output_dir": "generated_novels",
+    "memory_token_budget": 6000,
+    "memory_tail_chars": 1500,
+    "context_reuse_enabled": True,
+    "context_reuse_max_tokens": 16000,
+    "round_interval_seconds": 1,  # 两轮续写之间的间隔，避免过快请求
+    "auto_interval_seconds": 2,  # 自动模式下两篇小说之间的间隔
+    "concurrency_per_endpoint": 1,  # 每个Ollama服务地址同时进行的小说数，也可以是 {地址: 数量}
+    "generation_mode": "serial",  # serial：分轮续写；outline：先生成大纲，再并行生成各章
+    "outline_chapter_words": 2000,  # 大纲模式下每章的目标字数
+    "outline_parallel_slots": 2,  # 大纲模式下同时生成的章节数，建议与 OLLAMA_NUM_PARALLEL 一致
+    "checkpoint_dir": "checkpoints",  # 断点日志目录，None 表示不记录
+    "checkpoint_flush_interval": 1.0,  # 断点日志批量写入并 fsync 的间隔（秒）
+    "metrics_file": "novel_metrics.jsonl",  # 每轮吞吐和延迟统计的保存文件，None 表示只写日志
+    "metrics_port": None,  # Prometheus 指标服务端口（/metrics），None 表示不启动
+    "metrics_host": "127.0.0.1",
+    "cassette_record": None,  # 录制Ollama响应的磁带文件路径（.jsonl.gz），None 表示不录制
+    "cassette_replay": None,  # 回放的磁带文件路径，设置后不连接Ollama
+    "cassette_replay_speed": 1.0,  # 回放速度倍数，0 表示不等待
+    "cprofile_enabled": False,  # 用 cProfile 分析每篇小说的写作过程，结果保存为小说旁边的 .prof 文件
+    "model_warmup": True,  # 启动时在后台预加载写作和评估模型
+    "keep_alive": "30m",  # 每次请求后模型在Ollama中保留的时间，也可以是 {模型: 值}；None 表示使用Ollama的默认值（5分钟）
+    "keep_alive_ping_seconds": 0,  # 模型空闲超过该秒数时发送保活请求，0 表示不保活
+    "cold_load_threshold_seconds": 1.0,  # load_duration 超过该秒数时记录为冷加载
+    "model_batching": False,  # 自动模式下按模型分批执行 写作→评估→修改，减少写作和评估模型之间的切换
+    "model_batch_size": 4,  # 每批在同一个模型上连续执行的步数（如连续写4篇，再一起评估）
+    "model_batch_max_delay_seconds": 1800,  # 排队的评估或修改任务最多等待的秒数，超过后立即切换模型
+    "revise_below_score": 8,  # 分批模式下总体评分低于该值的小说会按修改建议重写
+    "repetition_detection": True,  # 续写时检测模型是否陷入循环，发现后中止本轮、删除重复内容并调整参数重试
+    "repetition_ngram_chars": 16,  # 检测时比较的片段长度（字符）
+    "repetition_min_chars": 80,  # 重复内容达到该长度（且至少重复一整个周期）时判定为循环
+    "repetition_window_chars": 4000,  # 只在最近这么多字符内查找重复
+    "repetition_max_retries": 3,  # 连续循环时逐级提高温度和重复惩罚的最大级数
+    "overlap_trimming": True,  # 续写时去掉新一轮开头复述上文末尾的内容
+    "overlap_tail_chars": 1000,  # 与上文末尾多少个字符比较
+    "overlap_min_chars": 10,  # 重复部分达到该长度才删除
+    "response_cache_dir": "response_cache",  # 评估、修改建议等非流式调用结果的缓存目录，None 表示不缓存
+    "response_cache_memory_entries": 64,  # 内存中保留的结果数
+    "response_cache_max_mb": 200,  # 磁盘缓存的大小上限，超过后删除最久未使用的结果
+    "requirement_seed": None,  # 生成写作要求时使用的随机种子；设置后结果是确定的，才会缓存
+    "requirement_pool_size": 3,  # 自动模式下预先生成并保存的写作要求条数，0 表示不使用写作要求池
+    "requirement_pool_file": "requirement_pool.json",  # 写作要求池的保存文件，重启后继续使用
+    "requirement_pool_refill": "idle",  # 补充策略："idle" 只在没有小说正在写作时补充，"always" 池不满时随时补充
+    "requirement_dedup": True,  # 自动生成的写作要求与用过的过于相似时重新生成
+    "requirement_history_file": "requirement_history.jsonl",  # 用过的写作要求（及其MinHash签名），启动时加载
+    "requirement_similarity_threshold": 0.6,  # 估计的相似度（3字片段的Jaccard）达到该值时视为重复
+    "requirement_dedup_retries": 3,  # 重复时最多重新生成的次数，用完后使用最后一次的结果
+    "library_db": "novel_library.db",  # 小说库索引（元数据、评分和全文检索），None 表示不建立索引
+    "evaluation_chunked": True,  # 长篇小说分段并行评估全文，而不是只评估前 evaluation_chunk_chars 个字符
+    "evaluation_chunk_chars": 2000,  # 每段的最大字符数（需要与 evaluation_num_ctx 匹配）
+    "evaluation_parallel_slots": 2,  # 同时评估的段数，建议与评估模型所在服务的 OLLAMA_NUM_PARALLEL 一致
+    "evaluation_num_ctx": 4096,  # 评估请求的上下文窗口大小
+    "storage_backend": "files",  # "files" 每篇保存为 output_dir 中的txt文件；"archive" 按天写入压缩包文件（含思维推理内容）
+    "archive_dir": "novel_archive",  # 压缩包文件的目录（按 年/月 分目录）
+    "archive_compression": "lzma",  # 每篇的压缩方式："lzma"（压缩率高）或 "zlib"（更快）
+}
+
+# 可缓存的调用在状态栏中显示的名称
+CACHE_KIND_NAMES = {"evaluation": "质量评估", "evaluation_chunk": "分段评估", "suggestions": "修改建议",
+                    "requirement": "写作要求"}
+
+# 生成写作要求的提示词
+REQUIREMENT_PROMPT = '''你是一个创意写作专家，请生成一个有趣的小说写作要求。要求：
+        1. 包含具体的故事背景、人物设定和情节方向
+        2. 要有创意，不要太过俗套
+        3. 字数在100-200之间
+        4. 只输出写作要求本身，不要包含任何其他说明
+        5. 每次生成的内容都要不一样，保持新颖性
+        6. 小说风格以言情类为主。
+        '''
+
+# 复用上下文时的续写指令
+CONTINUE_INSTRUCTION = '''请紧接着上文继续创作小说的后续内容。保持故事的连贯性和逻辑性，不要重复已经写过的内容，使用中文写作。
+你可以使用<think></think>标签来表示你的思考过程，这部分内容不会出现在最终故事中。'''
+
+
+# 计算字数：中文字符数 + 英文单词数
+def count_words(content):
+    # 计算中文字符数（每个中文字符算一个字）
+    chinese_chars = re.findall(r'[\u4e00-\u9fff]', content)
+    # 计算英文单词数（假设英文单词由空格分隔）
+    english_words = re.findall(r'\b[a-zA-Z]+\b', content)
+    return len(chinese_chars) + len(english_words)
+
+
+# 判断写作目标是否完成的方法
+def is_writing_complete(content, target_word_count):
+    return count_words(content) >= target_word_count
+
+
+# 去掉模型输出中的思维推理内容
+def strip_thinking(text):
+    return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL).strip()
+
+
+# 第一轮写作的提示词
+def build_first_prompt(user_prompt):
+    return f'''{user_prompt}
+
+你可以使用<think></think>标签来表示你的思考过程，这部分内容不会出现在最终故事中。例如：
+<think>我需要先确定故事的主角和背景，然后设计一个合理的情节发展。</think>
+正式的故事内容...'''
+
+
+# 续写的提示词（较早的内容使用摘要，最近的内容保留原文）
+def build_continuation_prompt(user_prompt, memory):
+    return f'''
+                你是一个小说作家，擅长写言情类小说，请根据以下用户写作要求和已经写作的内容，开始或者继续创作：
+                ## 用户的写作要求：
+                 {user_prompt}
+
+                ## 前文摘要：
+                {memory.summary_text() or "（无）"}
+
+                ## 最近写作的内容：
+                {memory.recent_text()}
+
+                ## 注意事项：
+                1. 请根据用户写作要求和已经写作的内容，继续创作。
+                2. 请保持故事的连贯性和逻辑性。
+                3. 请保持故事的节奏感，不要出现过于冗长或重复的描述。
+                4. 请保持故事的紧凑性，不要出现过于拖沓的情节。
+                5. 请保持故事的新鲜感，不要出现过于俗套的情节。
+                6. 请保持故事的合理性，不要出现过于夸张的情节。
+                7. 请保使用中文写作；
+                8. 你可以使用<think></think>标签来表示你的思考过程，这部分内容不会出现在最终故事中。
+                '''
+
+
+# 章节摘要的提示词
+def build_summary_prompt(text, max_chars):
+    return f'''请将以下小说片段概括为不超过{max_chars}字的摘要，保留主要人物、关键情节、人物关系变化和尚未解决的悬念。只输出摘要本身，不要包含任何其他说明。
+
+## 小说片段：
+{text}
+'''
+
+
+# 从评估报告中解析总体评分（1-10），解析不到时返回None
+def parse_overall_score(evaluation_result):
+    match = re.search(r'总体评分\**\s*[:：]\s*\**\s*(\d+(?:\.\d+)?)\s*\**\s*/\s*10', evaluation_result)
+    return float(match.group(1)) if match else None
+
+
+# 评估小说质量的提示词；内容超过 max_chars 时截断
+def build_evaluation_prompt(user_prompt, content, max_chars=2000):
+    if len(content) > max_chars:
+        content = content[:max_chars] + "...（内容较长，此处截断）"
+    return f'''
+        请对以下小说内容进行专业的质量评估，基于以下几个方面:
+        1. 情节连贯性和合理性
+        2. 人物刻画和发展
+        3. 写作风格和语言表达
+        4. 创意性和独特性
+        5. 与用户写作要求的符合度
+
+        ## 用户的写作要求:
+        {user_prompt}
+
+        ## 小说内容:
+        {content}
+
+        请给出详细评价，并提出具体的改进建议。评分标准为1-10分，请在每个方面打分，并给出总体评分。
+        格式要求:
+        - 总体评分: X/10
+        - 情节评分: X/10
+        - 人物评分: X/10
+        - 语言评分: X/10
+        - 创意评分: X/10
+        - 需求符合度: X/10
+
+        ## 详细点评:
+        [详细说明优点和不足]
+
+        ## 具体改进建议:
+        [列出3-5条具体的改进建议]
+        '''
+
+
+# 生成修改建议的提示词
+def build_suggestions_prompt(user_prompt, content, evaluation_result):
+    return f'''
+        你是一个专业的小说编辑，请基于以下评估报告，对小说内容提供具体的修改建议。
+
+        ## 小说评估报告：
+        {evaluation_result}
+
+        ## 原始写作要求：
+        {user_prompt}
+
+        ## 小说内容：
+        {content}
+
+        请针对评估报告中指出的问题，提供以下内容：
+        1. 对小说结构的修改建议
+        2. 对情节发展的改进方案
+        3. 对人物刻画的增强建议
+        4. 对语言表达的优化方案
+        5. 提供3个具体的修改示例，包括原文和修改后的对比
+
+        请确保你的建议是具体且可操作的，而不是笼统的指导。
+        '''
+
+
+# 应用修改的提示词（包含完整原文）
+def build_revision_prompt(user_prompt, content, suggestions):
+    return f'''
+        你是一个专业的小说编辑和作家，请基于以下修改建议，重写小说内容。
+
+        ## 原始写作要求：
+        {user_prompt}
+
+        ## 原始小说内容：
+        {content}
+
+        ## 修改建议：
+        {suggestions}
+
+        请根据以上修改建议，重写整个小说。保留原有的故事框架和主要情节，但根据修改建议进行优化和改进。
+        注意：
+        1. 请直接输出修改后的完整小说内容，不要包含任何解释或说明
+        2. 优化情节、人物和语言表达，但保持故事的连贯性和原意
+        3. 保持适当的篇幅，不要过度缩减或扩展内容
+        4. 使用流畅的中文写作
+        5. 你可以使用<think></think>标签来表示你的思考过程，这部分内容不会出现在最终故事中。
+        '''
+
+
+# 复用上下文时的修改提示词（原文已在上下文中）
+def build_context_revision_prompt(suggestions):
+    return f'''
+        请基于上文中的小说内容，根据以下修改建议重写整个小说。保留原有的故事框架和主要情节。
+
+        ## 修改建议：
+        {suggestions}
+
+        注意：
+        1. 请直接输出修改后的完整小说内容，不要包含任何解释或说明
+        2. 使用流畅的中文写作
+        3. 你可以使用<think></think>标签来表示你的思考过程，这部分内容不会出现在最终故事中。
+        '''
+
+
+# 保存小说内容到输出目录，文件名为 字数_时间戳.txt，返回文件路径；
+# 已有增量统计的字数时可通过 word_count 传入，避免重新扫描全文
+def save_novel(content, output_dir="generated_novels", word_count=None):
+    # 确保输出目录存在
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # 生成文件名：字数_时间戳.txt
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if word_count is None:
+        word_count = count_words(content)
+    filename = f"{word_count}字_{timestamp}.txt"
+    filepath = os.path.join(output_dir, filename)
+    # 多个实例同一秒保存相同字数的小说时，避免互相覆盖
+    suffix = 1
+    while os.path.exists(filepath):
+        filepath = os.path.join(output_dir, f"{word_count}字_{timestamp}_{suffix}.txt")
+        suffix += 1
+
+    with PROFILER.span("file_save"), open(filepath, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return filepath
+
+
+class NovelJob:
+    """一篇小说的生成状态：写作要求、已生成的内容、思维推理内容、续写记忆和模型上下文。"""
+
+    def __init__(self, user_prompt, target_word_count, memory, context_session):
+        self.user_prompt = user_prompt
+        self.target_word_count = target_word_count
+        self.memory = memory
+        self.context_session = context_session
+        self.generated_content = ""
+        self.thinking_content = ""
+        self.word_counter = WordCounter()  # 随流式文本增量更新的字数统计
+        self.think_parser = ThinkTagParser()  # 流式解析<think>标签
+        self.journal = None  # 断点日志，小说保存后删除
+        self.job_id = uuid.uuid4().hex[:8]
+        self.round_metrics = []  # 每轮的吞吐和延迟统计
+        self.stream_timer = None  # 当前流式请求的计时，用于显示实时速度
+        self.repetition_level = 0  # 上一轮陷入循环时提高温度和重复惩罚的级数，正常的一轮后归零
+        self.stopped = False
+
+    # 直接设置小说内容（例如修改一篇已有的小说），同时重建字数统计
+    def set_content(self, content):
+        self.generated_content = content
+        self.word_counter = WordCounter(content)
+
+    def stop(self):
+        self.stopped = True
+
+    # 小说已经保存，删除断点日志
+    def discard_checkpoint(self):
+        if self.journal:
+            self.journal.discard()
+            self.journal = None
+
+    # 处理文本块，分离思维推理内容和正式小说内容，返回 (正式内容, 思维内容)
+    def split_chunk(self, text_chunk):
+        story_chunk, think_chunk = self.think_parser.feed(text_chunk)
+        self.thinking_content += think_chunk
+        return story_chunk, think_chunk
+
+    # 一次流式响应结束，输出解析器中等待判断的文本，并为下一次响应重置解析状态
+    def finish_stream(self):
+        story_chunk, think_chunk = self.think_parser.flush()
+        self.thinking_content += think_chunk
+        self.think_parser.reset()
+        return story_chunk, think_chunk
+
+
+class NovelEngine:
+    """小说生成流程。所有回调都在调用线程中执行，由调用方决定如何显示。"""
+
+    def __init__(self, config=None, client=None):
+        self.config = dict(DEFAULT_CONFIG)
+        self.config.update(config or {})
+        self.client = client or self._create_client()
+        self.metrics = MetricsRecorder(self.config["metrics_file"])
+        self.residency = ModelResidencyManager(
+            self.client,
+            [self.config["writing_model_name"], self.config["evaluation_model_name"]],
+            keep_alive=self.config["keep_alive"],
+            ping_interval=self.config["keep_alive_ping_seconds"],
+            cold_load_threshold=self.config["cold_load_threshold_seconds"]
+        )
+        self.metrics.listeners.append(self.residency.observe)
+        self.cache = None
+        if self.config["response_cache_dir"]:
+            self.cache = ResponseCache(self.config["response_cache_dir"], self.config["response_cache_memory_entries"],
+                                       self.config["response_cache_max_mb"] * 1024 * 1024)
+        self.requirement_pool = None
+        self.deduplicator = None
+        if self.config["requirement_dedup"]:
+            path = self.config["requirement_history_file"]
+            self.deduplicator = RequirementDeduplicator.shared(
+                path, lambda: RequirementDeduplicator(path, self.config["requirement_similarity_threshold"]))
+        self.library = NovelLibrary(self.config["library_db"]) if self.config["library_db"] else None
+        self.archive = None
+        if self.config["storage_backend"] == "archive":
+            self.archive = NovelArchive(self.config["archive_dir"], self.config["archive_compression"])
+        elif self.config["storage_backend"] != "files":
+            raise ValueError(f"未知的存储方式：{self.config['storage_backend']}，可选 files、archive")
+        self.stop_event = threading.Event()
+        self.active_jobs = set()
+        self._jobs_lock = threading.Lock()
+
+    def _create_client(self):
+        if self.config["cassette_replay"]:
+            return ReplayClient(self.config["cassette_replay"], self.config["cassette_replay_speed"])
+        recorder = CassetteRecorder.shared(self.config["cassette_record"]) if self.config["cassette_record"] else None
+        return OllamaClient(self.config["ollama_base_urls"], recorder=recorder)
+
+    # 在后台预加载模型（默认为写作和评估模型）并开始保活，立即返回；回放磁带时不需要预加载
+    def warm_up(self, on_done=None, models=None):
+        if not self.config["model_warmup"] or self.config["cassette_replay"]:
+            return False
+        self.residency.warm_up_async(on_done, models)
+        return True
+
+    # 启动写作要求池的后台补充（自动模式开始时调用）；同一个保存文件的池在进程内共用，
+    # 每个引擎注册为池的一个补充来源。paused 返回是否暂停补充（如分批调度时当前批次不是 model_name）
+    def start_requirement_pool(self, paused=None):
+        if self.requirement_pool is None and self.config["requirement_pool_size"] > 0:
+            path = self.config["requirement_pool_file"]
+            self.requirement_pool = RequirementPool.shared(
+                path, lambda: RequirementPool(path, size=self.config["requirement_pool_size"],
+                                              refill_policy=self.config["requirement_pool_refill"]))
+            self.requirement_pool.add_source(self.new_requirement, busy=lambda: bool(self.active_jobs),
+                                             paused=paused)
+            self.requirement_pool.start()
+        return self.requirement_pool
+
+    # 取得下一篇的写作要求：有写作要求池时从池中取出（池为空时当场生成），否则直接生成
+    def next_requirement(self, on_status=None):
+        if self.requirement_pool is None:
+            return self.new_requirement()
+        user_prompt, from_pool = self.requirement_pool.take(self.new_requirement)
+        if from_pool and on_status:
+            on_status(f"已从写作要求池取出写作要求（剩余{len(self.requirement_pool.items)}条）")
+        return user_prompt
+
+    # 停止自动生成，并中断所有正在进行的写作
+    def stop(self):
+        self.stop_event.set()
+        self.residency.stop()
+        if self.requirement_pool:
+            self.requirement_pool.stop()
+        with self._jobs_lock:
+            for job in self.active_jobs:
+                job.stop()
+
+    def new_job(self, user_prompt, target_word_count=None):
+        memory = ContinuationMemory(
+            self.summarize,
+            token_budget=self.config["memory_token_budget"],
+            tail_chars=self.config["memory_tail_chars"]
+        )
+        context_session = ContextSession(max_tokens=self.config["context_reuse_max_tokens"])
+        return NovelJob(user_prompt, target_word_count or self.config["target_word_count"], memory, context_session)
+
+    # 发送非流式请求并记录耗时统计
+    # cache=True 时先查结果缓存；bypass_cache=True 时不查缓存、重新请求并更新缓存；
+    # on_status 收到“命中缓存”/“未命中缓存”等说明，用于显示在状态栏中
+    def generate(self, kind, request_data, timeout, cache=False, bypass_cache=False, on_status=None):
+        key = cache_key(request_data) if cache and self.cache else None
+        name = CACHE_KIND_NAMES.get(kind, kind)
+        if key and not bypass_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                CACHE_REQUESTS.inc(kind=kind, result="hit")
+                saved_seconds = (cached.get("total_duration") or 0) / 1e9
+                logger.info(f"{name}命中缓存（{key[:12]}），节省约{saved_seconds:.0f}秒")
+                if on_status:
+                    on_status(f"{name}命中缓存，节省约{saved_seconds:.0f}秒")
+                return cached
+
+        timer = StreamTimer()
+        result = self.client.generate(self.residency.apply(request_data), timeout=timeout)
+        self.metrics.record_call(kind, request_data["model"], result, timer)
+        if key:
+            self.cache.put(key, {k: v for k, v in result.items() if k != "context"})  # context 很大且不会再用到
+            CACHE_REQUESTS.inc(kind=kind, result="bypass" if bypass_cache else "miss")
+            if on_status:
+                on_status(f"{name}{'已忽略缓存' if bypass_cache else '未命中缓存'}，结果已缓存")
+        return result
+
+    # 生成写作要求；只有设置了 requirement_seed（结果确定）时才使用缓存，attempt 为重新生成的次数（改变种子）
+    def generate_requirement(self, bypass_cache=False, on_status=None, attempt=0):
+        request_data = {
+            "model": self.config["model_name"],
+            "prompt": REQUIREMENT_PROMPT,
+            "temperature": 0.9,  # 使用较高的温度以增加创意性
+            "stream": False
+        }
+        seed = self.config["requirement_seed"]
+        if seed is not None:
+            request_data["options"] = {"seed": seed + attempt}
+        result = self.generate("requirement", request_data, timeout=30, cache=seed is not None,
+                               bypass_cache=bypass_cache, on_status=on_status)
+        return result.get('response', '').strip()
+
+    # 生成一条与用过的写作要求都不相似的写作要求，并记入历史；只有生成的结果重复时才重新请求
+    def new_requirement(self):
+        retries = self.config["requirement_dedup_retries"] if self.deduplicator else 0
+        for attempt in range(retries + 1):
+            user_prompt = self.generate_requirement(attempt=attempt)
+            if self.deduplicator is None:
+                return user_prompt
+            duplicate, similarity = self.deduplicator.check(user_prompt)
+            if not duplicate:
+                break
+            logger.info(f"写作要求与用过的写作要求相似度约{similarity:.0%}，重新生成（第{attempt + 1}次）")
+        else:
+            logger.warning(f"连续{retries + 1}次生成的写作要求都与用过的相似，使用最后一次的结果")
+        self.deduplicator.add(user_prompt)
+        return user_prompt
+
+    # 调用写作模型生成章节摘要，供续写记忆使用
+    def summarize(self, text, max_chars):
+        request_data = {
+            "model": self.config["writing_model_name"],
+            "prompt": build_summary_prompt(text, max_chars),
+            "temperature": 0.3,
+            "stream": False
+        }
+        with PROFILER.span("summary"):
+            summary = self.generate("summary", request_data, timeout=120).get('response', '')
+        # 去掉模型可能输出的思维推理内容
+        return strip_thinking(summary)
+
+    # 处理一次流式响应，返回 (正式内容, 最后一条消息)；中途停止时最后一条消息为None
+    # 正式内容到达时立即计入 counter；timer 在发送请求前创建，记录首token延迟和处理耗时
+    # 指定 detector 时检测循环：发现后中止响应，只保留重复开始之前的内容，已显示的重复部分通过 on_retract 撤回
+    # 指定 trimmer 时正式内容先经过它，去掉开头复述上文的部分后再显示
+    def _consume_stream(self, job, stream, timer, counter, on_story=None, on_thinking=None,
+                        detector=None, on_retract=None, trimmer=None):
+        story_parts = []
+        done_data = None
+        counter_start = counter.snapshot()
+
+        def emit(story_chunk, think_chunk):
+            if story_chunk:
+                story_parts.append(story_chunk)
+                count_start = time.perf_counter()
+                counter.feed(story_chunk)
+                PROFILER.add("word_count", time.perf_counter() - count_start)
+            callback_start = time.perf_counter()
+            if think_chunk and on_thinking:
+                on_thinking(think_chunk)
+            if story_chunk and on_story:
+                on_story(story_chunk)
+            PROFILER.add("callbacks", time.perf_counter() - callback_start)
+
+        job.think_parser.reset()
+        job.stream_timer = timer
+        wait_start = time.perf_counter()
+        for data in stream:
+            received = time.perf_counter()
+            PROFILER.add("stream_wait", received - wait_start)
+            # 如果已停止生成，则跳出响应处理循环
+            if job.stopped:
+                break
+            timer.mark()
+
+            # 处理文本块，分离思维推理和正式内容
+            story_chunk, think_chunk = job.split_chunk(data.get('response', ''))
+            if trimmer:
+                story_chunk = trimmer.feed(story_chunk)
+            PROFILER.add("tag_parse", time.perf_counter() - received)
+            if detector and story_chunk and detector.feed(story_chunk) is not None:
+                shown = "".join(story_parts)
+                emitted = len(shown)
+                keep = detector.settle(shown + story_chunk)
+                emit(story_chunk[:max(0, keep - emitted)], think_chunk)
+                if keep < emitted:
+                    kept = shown[:keep]
+                    story_parts[:] = [kept]
+                    counter.restore(counter_start)
+                    counter.feed(kept)
+                    if on_retract:
+                        on_retract(emitted - keep)
+                timer.handler_seconds += time.perf_counter() - received
+                break
+            emit(story_chunk, think_chunk)
+            timer.handler_seconds += time.perf_counter() - received
+
+            # 检查是否完成（当 done 为 true 时）
+            if data.get('done', False):
+                done_data = data
+                break
+            wait_start = time.perf_counter()
+        stream.close()  # 提前退出时也及时归还连接
+        if detector and detector.triggered:
+            job.think_parser.reset()  # 丢弃循环中尚未判断的标签片段
+        else:
+            story_chunk, think_chunk = job.finish_stream()
+            if trimmer:
+                story_chunk = trimmer.feed(story_chunk) + trimmer.flush()
+            emit(story_chunk, think_chunk)
+        timer.finish()
+        return "".join(story_parts), done_data
+
+    # 分轮续写（或按大纲并行生成各章），直到达到目标字数或被停止；返回是否完成
+    # resume=True 时在 job 已有内容的基础上继续写（用于从断点日志恢复）
+    # on_retract(字符数) 在删除已显示的正文末尾（模型陷入循环时的重复内容）时调用
+    def write_novel(self, job, on_story=None, on_thinking=None, on_status=None, on_round=None, resume=False,
+                    on_retract=None):
+        job.stopped = False  # 同一个 job 被停止后可以再次写作或修改
+        if not resume:
+            job.generated_content = ""
+            job.thinking_content = ""
+            job.word_counter.reset()
+            job.memory.reset()
+        job.context_session.reset()
+
+        # 流式文本同时写入断点日志，小说保存后才删除
+        if job.journal is None and self.config["checkpoint_dir"]:
+            job.journal = CheckpointJournal.create(self.config["checkpoint_dir"], job.user_prompt,
+                                                   job.target_word_count, self.config["checkpoint_flush_interval"])
+        if job.journal:
+            on_story = job.journal.tee(STORY, on_story)
+            on_thinking = job.journal.tee(THINKING, on_thinking)
+            on_retract = job.journal.tee(RETRACT, on_retract)
+
+        with self._jobs_lock:
+            self.active_jobs.add(job)
+        ACTIVE_JOBS.inc()
+        try:
+            if self.config["generation_mode"] == "outline" and not resume:
+                return OutlineWriter(self).write(job, on_story, on_thinking, on_status)
+            return self._write_rounds(job, on_story, on_thinking, on_status, on_round, on_retract)
+        finally:
+            with self._jobs_lock:
+                self.active_jobs.discard(job)
+            ACTIVE_JOBS.dec()
+            if job.journal:
+                # 被停止或出错而丢弃的一轮已经写入了日志，与实际保留的内容对齐
+                job.journal.truncate(len(job.generated_content))
+                job.journal.close()
+            self.metrics.record_novel(job)
+
+    # 根据断点日志中的会话重建小说状态；会话已被其他实例接管或无法接管时返回None
+    def resume_job(self, session):
+        job = self.new_job(session["user_prompt"], session["target_word_count"])
+        try:
+            job.journal = CheckpointJournal.resume(session, self.config["checkpoint_flush_interval"])
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"接管断点日志失败，跳过 {os.path.basename(session['path'])}: {str(e)}")
+            return None
+        job.set_content(session["content"])
+        job.thinking_content = session["thinking"]
+        job.memory.append(job.generated_content)
+        logger.info(f"从断点日志恢复小说：已有{job.word_counter.total}字，目标{job.target_word_count}字")
+        return job
+
+    # 继续写一篇从断点日志恢复的小说并保存；返回保存的文件路径
+    def run_resumed(self, session, on_status=None):
+        job = self.resume_job(session)
+        if job is None:
+            return None
+        self.write_novel(job, on_status=on_status, resume=True)
+        filepath = self.save_job(job)
+        NOVELS_COMPLETED.inc()
+        logger.info(f"内容已保存至：{filepath}")
+        return filepath
+
+    # 新建一轮的循环检测器，未开启时返回 None
+    def _repetition_detector(self):
+        if not self.config["repetition_detection"]:
+            return None
+        return RepetitionDetector(self.config["repetition_ngram_chars"], self.config["repetition_min_chars"],
+                                  self.config["repetition_window_chars"])
+
+    # 上一轮陷入循环时，本轮提高温度和重复惩罚
+    def _apply_repetition_level(self, job, request_data):
+        if not job.repetition_level:
+            return
+        options = request_data.setdefault("options", {})
+        options["temperature"] = min(1.2, request_data.get("temperature", 0.7) + 0.15 * job.repetition_level)
+        options["repeat_penalty"] = 1.1 + 0.1 * job.repetition_level
+        options["repeat_last_n"] = 256 * job.repetition_level
+
+    # 本轮因循环被中止：统计删除的字符数和估计节省的token数（按本篇正常轮次的平均生成量），提高下一轮的参数；
+    # 返回写入本轮统计记录的字段
+    def _record_repetition(self, job, detector, timer):
+        trimmed = detector.trimmed_chars
+        normal_rounds = [r["eval_tokens"] for r in job.round_metrics
+                         if r["kind"] == "write" and r["completed"] and not r.get("repetition_aborted")]
+        expected = sum(normal_rounds) / len(normal_rounds) if normal_rounds else 0
+        saved = max(0, round(expected) - timer.messages)
+        job.repetition_level = min(job.repetition_level + 1, self.config["repetition_max_retries"])
+        REPETITION_ABORTS.inc()
+        REPETITION_TRIMMED_CHARS.inc(trimmed)
+        REPETITION_TOKENS_SAVED.inc(saved)
+        logger.warning(f"检测到模型陷入循环（重复周期{detector.period}字），已中止本轮并删除{trimmed}个重复字符，"
+                       f"估计节省{saved} tokens；下一轮提高温度和重复惩罚（第{job.repetition_level}级）")
+        return {"repetition_aborted": True, "repetition_period": detector.period,
+                "trimmed_chars": trimmed, "tokens_saved": saved}
+
+    def _write_rounds(self, job, on_story, on_thinking, on_status, on_round, on_retract=None):
+        writing_model_name = self.config["writing_model_name"]
+
+        # 循环生成文本，直到达到目标字数
+        while job.word_counter.total < job.target_word_count and not job.stopped:
+            # 构造提示词：优先复用上一轮的模型上下文，只发送续写指令；
+            # 否则较早的内容使用摘要，最近的内容保留原文
+            prompt_start = time.perf_counter()
+            reuse_context = self.config["context_reuse_enabled"] and job.generated_content and \
+                job.context_session.can_continue(writing_model_name, job.generated_content)
+            # covers_full_text：本轮之后的 context 是否仍包含全文（使用摘要续写时不包含，不能用于修改全文）
+            if reuse_context:
+                full_prompt = CONTINUE_INSTRUCTION
+                covers_full_text = job.context_session.covers_full_text
+            elif job.generated_content:
+                full_prompt = build_continuation_prompt(job.user_prompt, job.memory)
+                covers_full_text = False
+            else:
+                full_prompt = build_first_prompt(job.user_prompt)
+                covers_full_text = True
+            PROFILER.add("prompt_build", time.perf_counter() - prompt_start)
+
+            # 记录本轮提示词大小，观察其是否保持平稳
+            _, prompt_tokens = job.memory.record_prompt(full_prompt)
+            if on_status:
+                on_status(f"正在生成中...第{len(job.memory.prompt_sizes)}轮，提示词约{prompt_tokens} tokens")
+
+            # 准备请求参数
+            request_data = {
+                "model": writing_model_name,
+                "prompt": full_prompt,
+                "max_tokens": 1000000,
+                "temperature": 0.7,
+                "stream": True
+            }
+            self._apply_repetition_level(job, request_data)
+            sent_context_tokens = job.context_session.attach(request_data) if reuse_context else 0
+            self.residency.apply(request_data)
+
+            # 发送请求并获取流式响应
+            timer = StreamTimer()
+            try:
+                stream = self.client.stream_generate(request_data, timeout=30)
+            except requests.exceptions.RequestException as e:
+                if not reuse_context:
+                    raise
+                # 上下文可能已失效（如服务重启），回退到完整提示词重试本轮
+                job.context_session.invalidate(f"复用上下文的请求失败: {str(e)}")
+                continue
+
+            counter_state = job.word_counter.snapshot()
+            words_before = job.word_counter.total
+            detector = self._repetition_detector()
+            trimmer = None
+            if self.config["overlap_trimming"] and job.generated_content:
+                trimmer = OverlapTrimmer(job.generated_content[-self.config["overlap_tail_chars"]:],
+                                         self.config["overlap_min_chars"])
+            new_content, done_data = self._consume_stream(job, stream, timer, job.word_counter, on_story, on_thinking,
+                                                          detector, on_retract, trimmer)
+            extra = {}
+            if detector and detector.triggered:
+                extra = self._record_repetition(job, detector, timer)
+            elif done_data:
+                job.repetition_level = 0
+            if trimmer and trimmer.removed_chars:
+                extra["overlap_trimmed_chars"] = trimmer.removed_chars
+                OVERLAP_TRIMMED_CHARS.inc(trimmer.removed_chars)
+                logger.info(f"本轮开头复述了上文，已删除{trimmer.removed_chars}个重复字符")
+            self.metrics.record_round(job, "write", writing_model_name, timer, done_data,
+                                      prompt_chars=len(full_prompt), context_reused=bool(reuse_context), **extra)
+
+            # 如果已停止生成，则退出主循环（被中断的这一轮内容不计入）
+            if job.stopped:
+                job.word_counter.restore(counter_state)
+                job.context_session.invalidate("生成被中断")
+                break
+
+            # 更新已生成的内容
+            WORDS_GENERATED.inc(job.word_counter.total - words_before)
+            job.generated_content += new_content
+            job.memory.append(new_content)
+            if done_data:
+                job.context_session.update(writing_model_name, done_data, job.generated_content,
+                                           sent_context_tokens, full_prompt, covers_full_text)
+            else:
+                job.context_session.invalidate("流式响应未正常结束")
+
+            if on_round:
+                on_round(job)
+
+            # 模拟文本处理的延迟，避免过快请求
+            time.sleep(self.config["round_interval_seconds"])
+
+        return job.word_counter.total >= job.target_word_count
+
+    # 根据修改建议重写小说，完成后替换 job 中的内容并返回修改后的内容；
+    # 修改过程中被停止时保留原来的内容并返回 None
+    def revise_novel(self, job, suggestions, on_story=None, on_thinking=None):
+        writing_model_name = self.config["writing_model_name"]
+        job.stopped = False
+        while True:
+            # 若模型上下文包含当前内容的全文（刚生成或刚修改过），则只发送修改建议
+            reuse_context = self.config["context_reuse_enabled"] and \
+                job.context_session.can_revise(writing_model_name, job.generated_content)
+            if reuse_context:
+                revision_prompt = build_context_revision_prompt(suggestions)
+            else:
+                revision_prompt = build_revision_prompt(job.user_prompt, job.generated_content, suggestions)
+
+            # 准备请求参数
+            request_data = {
+                "model": writing_model_name,
+                "prompt": revision_prompt,
+                "temperature": 0.5,
+                "stream": True
+            }
+            sent_context_tokens = job.context_session.attach(request_data) if reuse_context else 0
+            self.residency.apply(request_data)
+
+            # 发送请求并获取流式响应
+            timer = StreamTimer()
+            try:
+                stream = self.client.stream_generate(request_data, timeout=120)
+                break
+            except requests.exceptions.RequestException as e:
+                if not reuse_context:
+                    raise
+                # 上下文可能已失效，回退到包含完整原文的提示词
+                job.context_session.invalidate(f"复用上下文的请求失败: {str(e)}")
+
+        job.thinking_content = ""
+        counter = WordCounter()
+        revised_content, done_data = self._consume_stream(job, stream, timer, counter, on_story, on_thinking)
+        self.metrics.record_round(job, "revise", writing_model_name, timer, done_data,
+                                  prompt_chars=len(revision_prompt), context_reused=bool(reuse_context))
+        if job.stopped:
+            job.context_session.invalidate("修改被中断")
+            logger.info("修改已停止，保留修改前的内容")
+            return None
+
+        # 更新生成的内容
+        job.generated_content = revised_content
+        job.word_counter = counter
+        if done_data:
+            job.context_session.update(writing_model_name, done_data, job.generated_content,
+                                       sent_context_tokens, revision_prompt)
+        else:
+            job.context_session.invalidate("流式响应未正常结束")
+        return revised_content
+
+    # 获取Ollama上可用的模型名称列表
+    def list_models(self):
+        models = self.client.tags(timeout=5).get("models", [])
+        return [model.get("name") for model in models]
+
+    # 一次请求评估整篇小说（超过 evaluation_chunk_chars 的部分截断）
+    def _evaluate_whole(self, user_prompt, content, bypass_cache=False, on_status=None):
+        evaluation_prompt = build_evaluation_prompt(user_prompt, content, self.config["evaluation_chunk_chars"])
+        logger.info(f"评估提示词长度: {len(evaluation_prompt)} 字符")
+
+        # 准备请求参数
+        request_data = {
+            "model": self.config["evaluation_model_name"],
+            "prompt": evaluation_prompt,
+            "temperature": 0.3,  # 使用较低的温度以获得更客观的评估
+            "stream": False,
+            "options": {
+                "num_ctx": self.config["evaluation_num_ctx"]
+            }
+        }
+        result = self.generate("evaluation", request_data, timeout=600, cache=True,
+                               bypass_cache=bypass_cache, on_status=on_status)
+        return result.get('response', '').strip()
+
+    # 评估小说质量，返回评估报告文本；内容和提示词不变时返回缓存的结果（bypass_cache=True 时重新评估）
+    # 开启 evaluation_chunked 时长篇小说分段并行评估，覆盖全文
+    def evaluate_novel(self, user_prompt, content, bypass_cache=False, on_status=None):
+        logger.info(f"使用评估模型: {self.config['evaluation_model_name']}")
+        logger.info("发送评估请求...")
+
+        # 记录请求开始时间
+        start_time = time.time()
+
+        try:
+            with PROFILER.span("evaluation"):
+                if self.config["evaluation_chunked"] and len(content) > self.config["evaluation_chunk_chars"]:
+                    evaluation_result = ChunkedEvaluator(self).evaluate(user_prompt, content, bypass_cache, on_status)
+                else:
+                    evaluation_result = self._evaluate_whole(user_prompt, content, bypass_cache, on_status)
+        except Exception as e:
+            ERRORS.inc(stage="evaluation", type=type(e).__name__)
+            raise
+
+        # 记录请求结束时间和耗时
+        elapsed_time = time.time() - start_time
+        logger.info(f"评估请求完成，耗时: {elapsed_time:.2f} 秒")
+
+        score = parse_overall_score(evaluation_result)
+        if score is not None:
+            EVALUATION_SCORE.observe(score)
+        if self.library:
+            try:
+                self.library.record_evaluation(content, score, evaluation_result)
+            except sqlite3.Error as e:
+                logger.warning(f"小说库记录评分失败: {str(e)}")
+        return evaluation_result
+
+    # 根据评估报告生成修改建议（同样使用结果缓存）
+    def revision_suggestions(self, user_prompt, content, evaluation_result, bypass_cache=False, on_status=None):
+        request_data = {
+            "model": self.config["evaluation_model_name"],
+            "prompt": build_suggestions_prompt(user_prompt, content, evaluation_result),
+            "temperature": 0.4,
+            "stream": False
+        }
+        result = self.generate("suggestions", request_data, timeout=600, cache=True,
+                               bypass_cache=bypass_cache, on_status=on_status)
+        return result.get('response', '').strip()
+
+    # 按 storage_backend 保存一篇小说，返回文件路径或归档位置（包文件#偏移）
+    def store_novel(self, content, word_count=None, thinking="", user_prompt=None):
+        if self.archive is None:
+            return save_novel(content, self.config["output_dir"], word_count)
+        if word_count is None:
+            word_count = count_words(content)
+        with PROFILER.span("file_save"):
+            locator = self.archive.store(content, thinking, {"word_count": word_count, "user_prompt": user_prompt})
+        return locator
+
+    # 读取保存的小说（文件或归档），返回 {"content", "thinking"}
+    def read_novel(self, path):
+        if is_archive_locator(path):
+            record = read_archived(path)
+            return {"content": record["content"], "thinking": record.get("thinking", "")}
+        with open(path, 'r', encoding='utf-8') as f:
+            return {"content": f.read(), "thinking": ""}
+
+    # 保存一篇小说并删除其断点日志，返回文件路径或归档位置
+    def save_job(self, job):
+        filepath = self.store_novel(job.generated_content, job.word_counter.total, job.thinking_content, job.user_prompt)
+        job.discard_checkpoint()
+        self.index_novel(filepath, job.generated_content, job)
+        return filepath
+
+    # 把保存的小说加入小说库；job 为生成这篇小说的任务（提供写作要求、模型、轮数和耗时），
+    # 内容不是由任务生成的（如界面中手动编辑过）时只记录 user_prompt
+    def index_novel(self, filepath, content, job=None, user_prompt=None):
+        if self.library is None:
+            return
+        metadata = {"word_count": count_words(content), "user_prompt": user_prompt}
+        if job is not None:
+            rounds = job.round_metrics
+            metadata.update({
+                "word_count": job.word_counter.total,
+                "user_prompt": job.user_prompt,
+                "writing_model": self.config["writing_model_name"],
+                "params": {
+                    "generation_mode": self.config["generation_mode"],
+                    "target_word_count": job.target_word_count,
+                    "evaluation_model": self.config["evaluation_model_name"],
+                },
+                "rounds": len(rounds),
+                "eval_tokens": sum(r["eval_tokens"] for r in rounds),
+                "generation_seconds": round(sum(r["wall_seconds"] for r in rounds), 2),
+            })
+        try:
+            self.library.add(filepath, content, metadata)
+        except sqlite3.Error as e:
+            logger.warning(f"写入小说库失败: {str(e)}")
+
+    # 自动生成一篇小说：生成写作要求（未指定时）→ 分轮写作 → 保存；返回保存的文件路径
+    def run_one(self, user_prompt=None, target_word_count=None, on_status=None):
+        if not user_prompt:
+            user_prompt = self.next_requirement()
+            logger.info(f"新的写作要求: {user_prompt}")
+        job = self.new_job(user_prompt, target_word_count)
+        with RunProfile(self.config["cprofile_enabled"]) as profile:
+            self.write_novel(job, on_status=on_status)
+        if not job.generated_content.strip():
+            job.discard_checkpoint()
+            return None
+        filepath = self.save_job(job)
+        NOVELS_COMPLETED.inc()
+        logger.info(f"内容已保存至：{filepath}")
+        profile.dump_next_to(filepath)
+        return filepath
+
+    # 连续自动生成，直到达到篇数或调用了 stop()；返回完成的篇数
+    # 开始前先继续写上次崩溃时未完成的小说（这些小说不计入篇数）
+    def run_auto(self, count=None, on_status=None):
+        self.start_requirement_pool()
+        for session in find_unfinished_sessions(self.config["checkpoint_dir"]):
+            if self.stop_event.is_set():
+                break
+            try:
+                self.run_resumed(session, on_status=on_status)
+            except Exception as e:
+                logger.exception(f"恢复未完成的小说出错: {str(e)}")
+
+        completed = 0
+        while (count is None or completed < count) and not self.stop_event.is_set():
+            try:
+                if self.run_one(on_status=on_status):
+                    completed += 1
+            except Exception as e:
+                logger.exception(f"自动生成出错: {str(e)}")
+                NOVELS_FAILED.inc()
+                ERRORS.inc(stage="generation", type=type(e).__name__)
+            self.stop_event.wait(self.config["auto_interval_seconds"])
+        return completed
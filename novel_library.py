@@ -0,0 +1,198 @@
+"""小说库索引：SQLite 保存每篇小说的元数据（写作要求、模型、参数、耗时、评分），FTS5 全文索引正文。
+
+每次保存小说时在一个事务中写入元数据和全文索引；评估完成后按正文的哈希更新评分。
+全文索引使用 trigram 分词（中文没有空格，按词分词无法检索），不保存正文副本（正文仍在小说文件中），
+因此至少需要3个字的关键词；更短的关键词只匹配写作要求。
+按评分、字数、日期的筛选都有索引，十万篇时列表和检索仍是毫秒级。
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger("NovelApp")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS novels (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    created_at REAL NOT NULL,
+    word_count INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    user_prompt TEXT,
+    writing_model TEXT,
+    params TEXT,
+    rounds INTEGER,
+    eval_tokens INTEGER,
+    generation_seconds REAL,
+    score REAL,
+    evaluation TEXT,
+    evaluated_at REAL
+);
+CREATE INDEX IF NOT EXISTS novels_created_at ON novels(created_at);
+CREATE INDEX IF NOT EXISTS novels_word_count ON novels(word_count);
+CREATE INDEX IF NOT EXISTS novels_score ON novels(score);
+CREATE INDEX IF NOT EXISTS novels_content_hash ON novels(content_hash);
+"""
+
+ORDER_COLUMNS = ("created_at", "word_count", "score")
+IMPORT_BATCH = 500  # 导入时每个事务写入的篇数
+MIN_MATCH_CHARS = 3  # trigram 分词能检索的最短关键词
+# save_novel 生成的文件名：字数字_时间戳[_序号].txt
+FILENAME_PATTERN = re.compile(r'^(\d+)字_(\d{8}_\d{6})(?:_\d+)?\.txt$')
+
+
+def content_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class NovelLibrary:
+    """小说库。所有方法都可以在任意线程中调用（共用一个连接，加锁访问）。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)  # 多个进程可以共用同一个小说库
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self.tokenizer = self._create_fts()
+
+    def _create_fts(self):
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS novels_fts "
+                                   f"USING fts5(user_prompt, body, content='', tokenize='{tokenizer}')")
+                if tokenizer != "trigram":
+                    logger.warning("SQLite 不支持 trigram 分词（需要3.34以上），中文全文检索的效果会很差")
+                return tokenizer
+            except sqlite3.OperationalError:
+                continue
+        raise RuntimeError("当前的 SQLite 不支持 FTS5 全文索引")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _insert(self, path, content, metadata, created_at):
+        row = (
+            os.path.abspath(path), created_at or time.time(), metadata.get("word_count", 0), content_hash(content),
+            metadata.get("user_prompt"), metadata.get("writing_model"),
+            json.dumps(metadata.get("params") or {}, ensure_ascii=False),
+            metadata.get("rounds"), metadata.get("eval_tokens"), metadata.get("generation_seconds"),
+        )
+        cursor = self._conn.execute(
+            "INSERT OR IGNORE INTO novels (path, created_at, word_count, content_hash, user_prompt, writing_model, "
+            "params, rounds, eval_tokens, generation_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        if not cursor.rowcount:
+            return False
+        self._conn.execute("INSERT INTO novels_fts (rowid, user_prompt, body) VALUES (?, ?, ?)",
+                           (cursor.lastrowid, metadata.get("user_prompt") or "", content))
+        return True
+
+    # 在一个事务中写入一篇小说的元数据和全文索引；同一路径已存在时不重复写入，返回是否新增
+    def add(self, path, content, metadata=None, created_at=None):
+        with self._lock, self._conn:
+            return self._insert(path, content, metadata or {}, created_at)
+
+    # 在一个事务中写入多篇小说，entries 为 (路径, 正文, 元数据, 创建时间) 的序列；返回新增的篇数
+    def add_many(self, entries):
+        with self._lock, self._conn:
+            return sum(self._insert(path, content, metadata or {}, created_at)
+                       for path, content, metadata, created_at in entries)
+
+    # 记录评估结果：正文与评估内容相同的小说（包括同一篇的多个副本）都更新评分
+    def record_evaluation(self, content, score, evaluation):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE novels SET score = ?, evaluation = ?, evaluated_at = ? WHERE content_hash = ?",
+                (score, evaluation, time.time(), content_hash(content)))
+        return cursor.rowcount
+
+    # 把 save_novel 生成的、尚未索引的小说文件加入小说库（例如启用小说库之前保存的小说）
+    def import_directory(self, directory):
+        if not os.path.isdir(directory):
+            return 0
+        with self._lock:
+            known = {row[0] for row in self._conn.execute("SELECT path FROM novels")}
+        imported = 0
+        batch = []
+        for name in sorted(os.listdir(directory)):
+            match = FILENAME_PATTERN.match(name)
+            path = os.path.abspath(os.path.join(directory, name))
+            if not match or path in known:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                logger.warning(f"导入小说失败 {name}: {str(e)}")
+                continue
+            created_at = datetime.strptime(match.group(2), '%Y%m%d_%H%M%S').timestamp()
+            batch.append((path, content, {"word_count": int(match.group(1))}, created_at))
+            if len(batch) >= IMPORT_BATCH:
+                imported += self.add_many(batch)
+                batch = []
+        imported += self.add_many(batch)
+        if imported:
+            logger.info(f"已把{imported}篇小说导入小说库")
+        return imported
+
+    def _where(self, text, min_score, max_score, min_words, max_words, since, until):
+        clauses, params, join = [], [], ""
+        if text:
+            if len(text) >= MIN_MATCH_CHARS:
+                join = "JOIN novels_fts ON novels_fts.rowid = novels.id"
+                clauses.append("novels_fts MATCH ?")
+                params.append('"' + text.replace('"', '""') + '"')  # 作为短语检索，不解析FTS语法
+            else:
+                clauses.append("novels.user_prompt LIKE ?")
+                params.append(f"%{text}%")
+        for clause, value in (("novels.score >= ?", min_score), ("novels.score <= ?", max_score),
+                              ("novels.word_count >= ?", min_words), ("novels.word_count <= ?", max_words),
+                              ("novels.created_at >= ?", since), ("novels.created_at < ?", until)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return join, (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    # 按条件检索小说：text 在写作要求和正文中全文检索；since/until 为时间戳；返回字典列表
+    def search(self, text=None, min_score=None, max_score=None, min_words=None, max_words=None,
+               since=None, until=None, order_by="created_at", descending=True, limit=100, offset=0):
+        if order_by not in ORDER_COLUMNS:
+            raise ValueError(f"不支持的排序字段：{order_by}，可选 {', '.join(ORDER_COLUMNS)}")
+        join, where, params = self._where(text, min_score, max_score, min_words, max_words, since, until)
+        sql = (f"SELECT novels.* FROM novels {join}{where} "
+               f"ORDER BY novels.{order_by} {'DESC' if descending else 'ASC'} LIMIT ? OFFSET ?")
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit, offset]).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, text=None, min_score=None, max_score=None, min_words=None, max_words=None,
+              since=None, until=None):
+        join, where, params = self._where(text, min_score, max_score, min_words, max_words, since, until)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM novels {join}{where}", params).fetchone()[0]
+
+    def get(self, path):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM novels WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return dict(row) if row else None
+
+    def stats(self):
+        with self._lock:
+            total, evaluated, avg_score, words = self._conn.execute(
+                "SELECT COUNT(*), COUNT(score), AVG(score), SUM(word_count) FROM novels").fetchone()
+        return {
+            "novels": total,
+            "evaluated": evaluated,
+            "avg_score": round(avg_score, 2) if avg_score is not None else None,
+            "words": words or 0,
+        }
@@ -0,0 +1,157 @@
+"""多篇小说并发生成的调度器。
+
+每个Ollama服务地址按配置的并发数启动若干工作线程，工作线程从共享队列中领取任务；
+每篇小说的状态保存在各自的 NovelJob 中，互不干扰。
+"""
+import time
+import queue
+import logging
+import threading
+
+from novel_engine import NovelEngine, DEFAULT_CONFIG
+from checkpoint_journal import find_unfinished_sessions
+from metrics_exporter import NOVELS_FAILED, ERRORS, QUEUE_DEPTH
+from ollama_client import default_base_urls, normalize_base_url
+
+logger = logging.getLogger("NovelApp")
+
+
+class NovelScheduler:
+    """保持 K 篇小说同时进行，K 为所有服务地址的并发数之和。"""
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_CONFIG)
+        self.config.update(config or {})
+
+        # 每个服务地址一个引擎（各自的连接池），并发数可以按地址单独配置
+        limits = self.config["concurrency_per_endpoint"]
+        if isinstance(limits, dict):
+            limits = {normalize_base_url(url): limit for url, limit in limits.items()}
+        self.endpoints = []
+        for url in [normalize_base_url(url) for url in (self.config["ollama_base_urls"] or default_base_urls())]:
+            limit = limits.get(url, 1) if isinstance(limits, dict) else int(limits)
+            if limit <= 0:
+                continue
+            engine = NovelEngine(dict(self.config, ollama_base_urls=[url]))
+            self.endpoints.append((url, engine, limit))
+        if not self.endpoints:
+            raise ValueError("没有可用的Ollama服务地址或并发数均为0")
+
+        self.queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.workers = []
+        self._lock = threading.Lock()
+        self.active_jobs = 0
+        self.active_by_endpoint = {url: 0 for url, _, _ in self.endpoints}
+        self.completed = 0
+        self.failed = 0
+        self.started_at = None
+
+    @property
+    def total_slots(self):
+        return sum(limit for _, _, limit in self.endpoints)
+
+    # 提交一篇小说任务；未指定写作要求时由模型自动生成
+    def submit(self, user_prompt=None, target_word_count=None):
+        self.queue.put((user_prompt, target_word_count, None))
+
+    # 提交一篇从断点日志恢复的小说
+    def submit_resumed(self, session):
+        self.queue.put((None, None, session))
+
+    def start(self):
+        if self.workers:
+            return
+        self.started_at = time.time()
+        QUEUE_DEPTH.set_function(self.queue.qsize)
+        for _, engine, _ in self.endpoints:
+            engine.warm_up()
+            engine.start_requirement_pool()  # 所有引擎共用一个池，后台补充时使用空闲的引擎
+        for url, engine, limit in self.endpoints:
+            for index in range(limit):
+                worker = threading.Thread(target=self._worker, args=(url, engine),
+                                          name=f"novel-worker-{url}-{index}", daemon=True)
+                worker.start()
+                self.workers.append(worker)
+        logger.info(f"调度器已启动：{len(self.endpoints)}个服务地址，共{self.total_slots}个并发槽位")
+
+    # 停止领取新任务，并中断正在进行的写作（已生成的内容仍会保存）
+    def stop(self):
+        self.stop_event.set()
+        for _, engine, _ in self.endpoints:
+            engine.stop()
+
+    # 等待工作线程结束；timeout 为所有线程共用的总等待时间
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def _worker(self, url, engine):
+        while not self.stop_event.is_set():
+            try:
+                user_prompt, target_word_count, session = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self.active_jobs += 1
+                self.active_by_endpoint[url] += 1
+            try:
+                if session:
+                    filepath = engine.run_resumed(session)
+                else:
+                    filepath = engine.run_one(user_prompt, target_word_count)
+                if filepath:
+                    with self._lock:
+                        self.completed += 1
+            except Exception as e:
+                logger.exception(f"[{url}] 小说生成出错: {str(e)}")
+                NOVELS_FAILED.inc()
+                ERRORS.inc(stage="generation", type=type(e).__name__)
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self.active_jobs -= 1
+                    self.active_by_endpoint[url] -= 1
+                self.queue.task_done()
+
+    # 当前队列和吞吐统计
+    def stats(self):
+        with self._lock:
+            elapsed_hours = (time.time() - self.started_at) / 3600 if self.started_at else 0
+            return {
+                "queue_depth": self.queue.qsize(),
+                "active_jobs": self.active_jobs,
+                "active_by_endpoint": dict(self.active_by_endpoint),
+                "total_slots": self.total_slots,
+                "completed": self.completed,
+                "failed": self.failed,
+                "novels_per_hour": self.completed / elapsed_hours if elapsed_hours else 0.0,
+            }
+
+    # 连续自动生成：始终保持所有槽位有任务，直到完成指定篇数或调用了 stop()；返回完成的篇数
+    def run_auto(self, count=None, report_interval=60):
+        self.start()
+        # 先继续写上次崩溃时未完成的小说（这些小说不计入篇数）
+        for session in find_unfinished_sessions(self.config["checkpoint_dir"]):
+            self.submit_resumed(session)
+        submitted = 0
+        last_report = time.time()
+        while not self.stop_event.is_set():
+            if count is not None and submitted >= count:
+                if self.queue.unfinished_tasks == 0:
+                    break
+            elif self.queue.unfinished_tasks < self.total_slots:  # 排队中 + 进行中
+                self.submit()
+                submitted += 1
+                continue
+            if time.time() - last_report >= report_interval:
+                logger.info(f"调度器状态: {self.stats()}")
+                last_report = time.time()
+            self.stop_event.wait(0.2)
+        self.stop()
+        # 等待正在进行的小说写完并保存（停止后每篇只剩当前这一轮和保存），不设超时
+        self.join()
+        logger.info(f"调度器已结束: {self.stats()}")
+        return self.completed
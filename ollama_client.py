@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics_exporter import REQUEST_ERRORS, REQUEST_RETRIES
+from stage_profiler import PROFILER
+
+logger = logging.getLogger("NovelApp")
+
+DEFAULT_BASE_URL = 'http://localhost:11434'
+
+
+# 规范化服务地址，补全协议并去掉结尾的斜杠
+def normalize_base_url(host):
+    host = host.strip().rstrip('/')
+    if not host.startswith('http'):
+        host = 'http://' + host
+    return host
+
+
+# 从环境变量读取Ollama服务地址，多个地址用逗号分隔
+def default_base_urls():
+    hosts = os.environ.get('OLLAMA_HOSTS') or os.environ.get('OLLAMA_HOST') or DEFAULT_BASE_URL
+    return [normalize_base_url(host) for host in hosts.split(',') if host.strip()] or [DEFAULT_BASE_URL]
+
+
+class OllamaClient:
+    """所有Ollama调用共用的客户端：连接池复用keep-alive连接，支持多个服务地址、单次调用超时、
+    带随机抖动的指数退避重试，以及NDJSON流式响应的解析。
+
+    请求失败时抛出 requests 的异常（Timeout、ConnectionError、HTTPError），与直接使用 requests 时一致。
+    """
+
+    def __init__(self, base_urls=None, pool_size=16, max_retries=3, backoff=0.5,
+                 backoff_max=8.0, connect_timeout=5, recorder=None):
+        self.base_urls = [normalize_base_url(url) for url in (base_urls or default_base_urls())]
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self._url_index = 0
+        self._lock = threading.Lock()
+        self.recorder = recorder  # CassetteRecorder，录制每次响应的原始内容
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.base_urls), pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # 简单的调用统计
+        self.request_count = 0
+        self.retry_count = 0
+        self.error_count = 0
+
+    @property
+    def base_url(self):
+        return self.base_urls[self._url_index]
+
+    # 当前地址连接失败时切换到下一个地址
+    def _rotate_url(self):
+        with self._lock:
+            if len(self.base_urls) > 1:
+                self._url_index = (self._url_index + 1) % len(self.base_urls)
+                logger.warning(f"切换Ollama服务地址为: {self.base_url}")
+
+    def _sleep_before_retry(self, attempt):
+        delay = min(self.backoff_max, self.backoff * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))  # 全抖动，避免多个线程同时重试
+
+    # 发送请求，连接错误、超时和5xx错误会按退避策略重试；
+    # 非流式POST的读取超时不重试：已经等满了整个超时时间（如评估的600秒），重试只会让调用方再等几轮
+    def request(self, method, path, timeout=30, stream=False, **kwargs):
+        if not isinstance(timeout, tuple):
+            timeout = (min(self.connect_timeout, timeout), timeout)
+
+        attempt = 0
+        while True:
+            url = self.base_url + path
+            with self._lock:
+                self.request_count += 1
+            try:
+                response = self.session.request(method, url, timeout=timeout, stream=stream, **kwargs)
+                if response.status_code >= 500 and attempt < self.max_retries:
+                    response.close()
+                    raise requests.exceptions.HTTPError(f"{response.status_code} 服务器错误: {url}", response=response)
+                response.raise_for_status()
+                return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.HTTPError) as e:
+                retryable = not isinstance(e, requests.exceptions.HTTPError) or \
+                    (e.response is not None and e.response.status_code >= 500)
+                if isinstance(e, requests.exceptions.ReadTimeout) and method == 'POST' and not stream:
+                    retryable = False
+                if not retryable or attempt >= self.max_retries:
+                    with self._lock:
+                        self.error_count += 1
+                    REQUEST_ERRORS.inc(type=type(e).__name__)
+                    raise
+                logger.warning(f"Ollama请求失败（第{attempt + 1}次），准备重试: {str(e)}")
+                with self._lock:
+                    self.retry_count += 1
+                REQUEST_RETRIES.inc()
+                if isinstance(e, requests.exceptions.ConnectionError):
+                    self._rotate_url()
+                self._sleep_before_retry(attempt)
+                attempt += 1
+
+    # 逐行解析NDJSON流式响应，结束或中途退出时归还连接
+    def _iter_json_lines(self, response, record_id=None):
+        try:
+            for line in response.iter_lines():
+                if line:
+                    text = line.decode('utf-8')
+                    if record_id is not None:
+                        self.recorder.line(record_id, text)
+                    decode_start = time.perf_counter()
+                    data = json.loads(text)
+                    PROFILER.add("json_decode", time.perf_counter() - decode_start)
+                    yield data
+        finally:
+            response.close()
+            if record_id is not None:
+                self.recorder.end(record_id)
+
+    # 发送请求；流式请求返回逐条消息的迭代器，否则返回完整的JSON结果。开启录制时同时写入磁带
+    def _call(self, method, path, request_data=None, timeout=30, stream=False):
+        record_id = self.recorder.begin(method, path, request_data) if self.recorder else None
+        try:
+            with PROFILER.span("request_send"):
+                response = self.request(method, path, json=request_data, timeout=timeout, stream=stream)
+        except requests.exceptions.RequestException as e:
+            if record_id is not None:
+                self.recorder.end(record_id, error=f"{type(e).__name__}: {str(e)}")
+            raise
+        if stream:
+            return self._iter_json_lines(response, record_id)
+        if record_id is not None:
+            self.recorder.line(record_id, response.text)
+            self.recorder.end(record_id)
+        return response.json()
+
+    # 非流式生成，返回完整的JSON结果
+    def generate(self, request_data, timeout=30):
+        return self._call('POST', '/api/generate', dict(request_data, stream=False), timeout)
+
+    # 流式生成：立即发送请求（连接错误在此处抛出），返回逐条消息的迭代器
+    def stream_generate(self, request_data, timeout=30):
+        return self._call('POST', '/api/generate', dict(request_data, stream=True), timeout, stream=True)
+
+    # 非流式对话
+    def chat(self, request_data, timeout=30):
+        return self._call('POST', '/api/chat', dict(request_data, stream=False), timeout)
+
+    # 流式对话
+    def stream_chat(self, request_data, timeout=30):
+        return self._call('POST', '/api/chat', dict(request_data, stream=True), timeout, stream=True)
+
+    # 获取可用模型列表
+    def tags(self, timeout=5):
+        return self._call('GET', '/api/tags', timeout=timeout)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,208 @@
+"""大纲优先的并行章节生成：先让写作模型生成章节大纲，再并发生成各章，最后按顺序拼接。
+
+每一章的提示词包含全书大纲以及前后相邻章节的梗概，因此各章可以独立生成；
+整体耗时大致随后端可并行处理的请求数成比例下降。
+一章生成失败时重试一次，仍失败则停止其后的章节（之前的章节继续完成），已按顺序输出的章节保留在小说内容和断点日志中。
+"""
+import re
+import math
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from text_stream import ThinkTagParser
+from generation_metrics import StreamTimer
+from metrics_exporter import WORDS_GENERATED, ERRORS
+
+logger = logging.getLogger("NovelApp")
+
+# 大纲中的章节行，例如“第3章 重逢：两人在雨夜的站台再次相遇……”
+OUTLINE_LINE_PATTERN = re.compile(r'^\s*[#*\-\s]*(第[0-9零一二三四五六七八九十百]+章[^\n]*)$', re.MULTILINE)
+CHAPTER_RETRIES = 1  # 一章生成失败时的重试次数
+
+
+# 生成章节大纲的提示词
+def build_outline_prompt(user_prompt, chapter_count, chapter_words):
+    return f'''你是一个小说作家，擅长写言情类小说。请根据以下用户写作要求，设计一个共{chapter_count}章的小说大纲。
+
+## 用户的写作要求：
+{user_prompt}
+
+## 格式要求：
+1. 每章一行，格式为“第X章 章节标题：本章梗概”，梗概50-100字，写清本章的主要情节和人物关系变化
+2. 每章约{chapter_words}字的篇幅，情节安排要前后连贯，有起承转合
+3. 只输出大纲本身，不要包含任何其他说明
+'''
+
+
+# 生成单个章节的提示词
+def build_chapter_prompt(user_prompt, outline, chapters, index, chapter_words):
+    previous_synopsis = chapters[index - 1] if index > 0 else "（本章为第一章）"
+    next_synopsis = chapters[index + 1] if index + 1 < len(chapters) else "（本章为最后一章，需要给故事一个完整的结局）"
+    return f'''你是一个小说作家，擅长写言情类小说。请根据用户的写作要求和全书大纲，创作其中的一章。
+
+## 用户的写作要求：
+{user_prompt}
+
+## 全书大纲：
+{outline}
+
+## 上一章梗概：
+{previous_synopsis}
+
+## 本章：
+{chapters[index]}
+
+## 下一章梗概：
+{next_synopsis}
+
+## 注意事项：
+1. 只写本章的正文，不要写其他章节的内容，也不要重复输出章节标题
+2. 本章约{chapter_words}字，开头与上一章的结尾自然衔接，结尾为下一章做好铺垫
+3. 保持人物性格和故事设定与大纲一致
+4. 请使用中文写作
+5. 你可以使用<think></think>标签来表示你的思考过程，这部分内容不会出现在最终故事中。
+'''
+
+
+# 从模型输出中解析章节行；解析不到时退回到按非空行拆分
+def parse_outline(text, chapter_count):
+    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
+    chapters = [line.strip().rstrip('*#').strip() for line in OUTLINE_LINE_PATTERN.findall(text)]
+    if not chapters:
+        chapters = [line.strip() for line in text.splitlines() if line.strip()]
+    return chapters[:chapter_count]
+
+
+# 章节标题：“第X章 标题：梗概”中冒号之前的部分
+def chapter_heading(chapter_line, index):
+    heading = re.split(r'[：:]', chapter_line, maxsplit=1)[0].strip()
+    if not heading.startswith("第") or len(heading) > 30:
+        heading = f"第{index + 1}章"
+    return heading
+
+
+class OutlineWriter:
+    """按大纲并行生成章节。engine 提供 client、config 和 active_jobs 登记。"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    # 生成一章：流式接收，返回 (正文, 思维推理内容)；停止生成或 aborted() 为真时返回 (None, None)
+    def _write_chapter(self, job, prompt, aborted):
+        request_data = {
+            "model": self.engine.config["writing_model_name"],
+            "prompt": prompt,
+            "temperature": 0.7,
+            "stream": True
+        }
+        parser = ThinkTagParser()
+        story_parts = []
+        think_parts = []
+        done_data = None
+        timer = StreamTimer()
+        stream = self.engine.client.stream_generate(self.engine.residency.apply(request_data), timeout=30)
+        job.stream_timer = timer
+        try:
+            for data in stream:
+                if job.stopped or aborted():
+                    return None, None
+                timer.mark()
+                story, think = parser.feed(data.get('response', ''))
+                story_parts.append(story)
+                think_parts.append(think)
+                if data.get('done', False):
+                    done_data = data
+                    break
+        finally:
+            stream.close()
+        story, think = parser.flush()
+        self.engine.metrics.record_round(job, "chapter", request_data["model"], timer, done_data,
+                                         prompt_chars=len(prompt))
+        return "".join(story_parts) + story, "".join(think_parts) + think
+
+    # 生成整篇小说；返回是否所有章节都已完成
+    def write(self, job, on_story=None, on_thinking=None, on_status=None):
+        config = self.engine.config
+        chapter_words = config["outline_chapter_words"]
+        chapter_count = max(1, math.ceil(job.target_word_count / chapter_words))
+        slots = max(1, config["outline_parallel_slots"])
+
+        if on_status:
+            on_status(f"正在生成章节大纲（共{chapter_count}章）...")
+        outline_result = self.engine.generate("outline", {
+            "model": config["writing_model_name"],
+            "prompt": build_outline_prompt(job.user_prompt, chapter_count, chapter_words),
+            "temperature": 0.7,
+            "stream": False
+        }, timeout=120)
+        chapters = parse_outline(outline_result.get('response', ''), chapter_count)
+        if not chapters:
+            raise ValueError("未能从模型输出中解析出章节大纲")
+        outline = "\n".join(chapters)
+        logger.info(f"章节大纲（{len(chapters)}章）:\n{outline}")
+        if on_thinking:
+            on_thinking(f"【章节大纲】\n{outline}\n")
+
+        # 各章并发生成，完成后按章节顺序依次输出
+        results = [None] * len(chapters)
+        emitted = [0]
+        lock = threading.Lock()
+        failed_at = [len(chapters)]  # 重试后仍失败的最靠前的章节，其后的章节不再生成
+
+        def emit_ready():
+            while emitted[0] < len(chapters) and results[emitted[0]] is not None:
+                index = emitted[0]
+                story, think = results[index]
+                text = f"{chapter_heading(chapters[index], index)}\n\n{story.strip()}\n\n"
+                words_before = job.word_counter.total
+                job.generated_content += text
+                job.word_counter.feed(text)
+                WORDS_GENERATED.inc(job.word_counter.total - words_before)
+                if think:
+                    job.thinking_content += think
+                    if on_thinking:
+                        on_thinking(f"【{chapter_heading(chapters[index], index)}】{think}\n")
+                if on_story:
+                    on_story(text)
+                emitted[0] += 1
+
+        def run_chapter(index):
+            prompt = build_chapter_prompt(job.user_prompt, outline, chapters, index, chapter_words)
+            aborted = lambda: index > failed_at[0]
+            for attempt in range(CHAPTER_RETRIES + 1):
+                if aborted():
+                    return
+                try:
+                    story, think = self._write_chapter(job, prompt, aborted)
+                    break
+                except Exception as e:
+                    ERRORS.inc(stage="chapter", type=type(e).__name__)
+                    if attempt == CHAPTER_RETRIES:
+                        with lock:
+                            failed_at[0] = min(failed_at[0], index)
+                        raise
+                    logger.warning(f"第{index + 1}/{len(chapters)}章生成失败，重试: {str(e)}")
+            if story is None:
+                return
+            with lock:
+                results[index] = (story, think)
+                logger.info(f"第{index + 1}/{len(chapters)}章完成，{len(story)}字符")
+                if on_status:
+                    on_status(f"正在生成中...已完成{sum(r is not None for r in results)}/{len(chapters)}章")
+                emit_ready()
+
+        if on_status:
+            on_status(f"正在并行生成{len(chapters)}章（并发数{slots}）...")
+        with ThreadPoolExecutor(max_workers=slots, thread_name_prefix="chapter") as executor:
+            futures = [executor.submit(run_chapter, index) for index in range(len(chapters))]
+            try:
+                for future in futures:
+                    future.result()  # 按章节顺序等待，失败章节之前的章节都已完成
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                logger.error(f"第{failed_at[0] + 1}章生成失败，已停止其后的章节；已按顺序完成的前{emitted[0]}章已保留")
+                raise
+
+        return emitted[0] == len(chapters)
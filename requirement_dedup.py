@@ -0,0 +1,209 @@
+"""自动生成的写作要求去重：MinHash 签名 + LSH 分桶，拒绝与已用过的写作要求过于相似的新要求。
+
+每条写作要求去掉标点和空白后取3字片段，求长度为 num_perm 的单次排列 MinHash 签名；签名按 bands 段分桶，
+只有至少一段完全相同的历史要求才作为候选，再用签名中相同位置的比例估计相似度（Jaccard）。
+查询只访问候选，不逐条比较全部历史，几十万条历史时仍在亚毫秒级。
+
+保存的小说文件只有正文，不含写作要求，因此历史单独保存在 JSONL 文件中（每行 {"text", "sig"}），
+启动时加载；签名参数变化时按保存的原文重新计算签名。
+"""
+import os
+import re
+import json
+import time
+import zlib
+import base64
+import random
+import logging
+import threading
+from array import array
+
+from metrics_exporter import REQUIREMENT_DUPLICATES
+
+logger = logging.getLogger("NovelApp")
+
+SHINGLE_CHARS = 3
+_PRIME = 4294967311  # 大于 2^32 的素数
+_MASK = 0xFFFFFFFF
+_OFFSET = 0x9E3779B1  # 空桶借用其他桶的值时按距离加上的偏移
+_SEED = 20250214  # 固定的种子，保证每次启动使用相同的哈希函数，保存的签名才能继续使用
+_IGNORED = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+# 去掉标点和空白后的 SHINGLE_CHARS 字片段的哈希值
+def shingle_hashes(text):
+    text = _IGNORED.sub('', text.lower())
+    if len(text) <= SHINGLE_CHARS:
+        return {zlib.crc32(text.encode('utf-8'))} if text else set()
+    return {zlib.crc32(text[i:i + SHINGLE_CHARS].encode('utf-8')) for i in range(len(text) - SHINGLE_CHARS + 1)}
+
+
+class MinHashLSH:
+    def __init__(self, num_perm=64, bands=16):
+        if num_perm % bands:
+            raise ValueError(f"签名长度 {num_perm} 必须是分段数 {bands} 的整数倍")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(_SEED)
+        self._a = rng.randrange(1, _PRIME)
+        self._b = rng.randrange(0, _PRIME)
+        self._buckets = [{} for _ in range(bands)]  # 每段：段哈希 -> 条目编号（一个时为int，多个时为list）
+        self._signatures = []
+
+    def __len__(self):
+        return len(self._signatures)
+
+    # 单次排列的 MinHash：每个片段只哈希一次，按哈希值分到 num_perm 个桶中各取最小值；
+    # 空桶借用右侧最近的非空桶的值（加上距离偏移），使两条文本的空桶也能对应比较
+    def signature(self, text):
+        k = self.num_perm
+        a, b = self._a, self._b
+        bins = [_MASK] * k
+        for x in shingle_hashes(text):
+            value, slot = divmod((a * x + b) % _PRIME, k)
+            if value < bins[slot]:
+                bins[slot] = value
+        if _MASK in bins and any(v != _MASK for v in bins):
+            filled = list(bins)
+            for i in range(k):
+                if bins[i] != _MASK:
+                    continue
+                for distance in range(1, k):
+                    value = bins[(i + distance) % k]
+                    if value != _MASK:
+                        filled[i] = (value + distance * _OFFSET) & _MASK
+                        break
+            bins = filled
+        return array('I', bins)
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [hash(signature[i * rows:(i + 1) * rows].tobytes()) for i in range(self.bands)]
+
+    def add(self, signature):
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            existing = bucket.get(key)
+            if existing is None:
+                bucket[key] = index  # 绝大多数桶只有一条，不为它创建列表以节省内存
+            elif isinstance(existing, list):
+                existing.append(index)
+            else:
+                bucket[key] = [existing, index]
+        return index
+
+    # 返回 (最相似的条目编号, 估计的相似度)；没有候选时返回 (None, 0.0)
+    def query(self, signature):
+        candidates = set()
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            found = bucket.get(key)
+            if found is None:
+                continue
+            if isinstance(found, list):
+                candidates.update(found)
+            else:
+                candidates.add(found)
+        best, best_similarity = None, 0.0
+        for index in candidates:
+            other = self._signatures[index]
+            similarity = sum(1 for x, y in zip(signature, other) if x == y) / self.num_perm
+            if similarity > best_similarity:
+                best, best_similarity = index, similarity
+        return best, best_similarity
+
+
+class RequirementDeduplicator:
+    """已用过的写作要求的索引。check() 和 add() 可在任意线程中调用。"""
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path, threshold=0.6, num_perm=64, bands=16):
+        self.path = path
+        self.threshold = threshold
+        self.index = MinHashLSH(num_perm, bands)
+        self.checked = 0
+        self.rejected = 0
+        self.query_seconds = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    # 同一进程中的多个引擎共用同一个历史文件的索引
+    @classmethod
+    def shared(cls, path, factory):
+        with cls._shared_lock:
+            dedup = cls._shared.get(path)
+            if dedup is None:
+                dedup = cls._shared[path] = factory()
+            return dedup
+
+    def _encode(self, signature):
+        return base64.b64encode(signature.tobytes()).decode('ascii')
+
+    def _decode(self, value):
+        signature = array('I')
+        signature.frombytes(base64.b64decode(value))
+        return signature
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        start = time.perf_counter()
+        recomputed = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 崩溃时最后一行可能只写了一半
+                signature = self._decode(record["sig"]) if record.get("sig") else None
+                if signature is None or len(signature) != self.index.num_perm:
+                    signature = self.index.signature(record.get("text", ""))
+                    recomputed += 1
+                self.index.add(signature)
+        logger.info(f"已加载写作要求历史：{len(self.index)}条，耗时{time.perf_counter() - start:.2f}s"
+                    + (f"（重新计算了{recomputed}条签名）" if recomputed else ""))
+
+    # 返回 (是否与历史重复, 估计的最高相似度)
+    def check(self, text):
+        start = time.perf_counter()
+        signature = self.index.signature(text)
+        with self._lock:
+            _, similarity = self.index.query(signature)
+            self.checked += 1
+            self.query_seconds += time.perf_counter() - start
+            duplicate = similarity >= self.threshold
+            if duplicate:
+                self.rejected += 1
+        if duplicate:
+            REQUIREMENT_DUPLICATES.inc()
+        return duplicate, similarity
+
+    # 记录一条新使用的写作要求，并追加到历史文件
+    def add(self, text):
+        signature = self.index.signature(text)
+        with self._lock:
+            self.index.add(signature)
+            if not self.path:
+                return
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({"text": text, "sig": self._encode(signature)}, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.warning(f"保存写作要求历史失败: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "history": len(self.index),
+                "checked": self.checked,
+                "rejected": self.rejected,
+                "avg_check_ms": round(self.query_seconds / self.checked * 1000, 3) if self.checked else 0.0,
+            }
+
+    def report(self):
+        stats = self.stats()
+        return (f"写作要求去重：历史{stats['history']}条，检查{stats['checked']}次，"
+                f"拒绝{stats['rejected']}次重复，平均每次{stats['avg_check_ms']:.2f}ms")
@@ -0,0 +1,186 @@
+"""预先生成的写作要求池：后台线程在模型空闲时补充，自动模式开始下一篇时直接取用，不必等待生成。
+
+池中的写作要求保存在JSON文件中，程序重启后仍可使用。补充策略：
+    idle   —— 只在没有小说正在写作时补充（默认，不与写作争抢模型）
+    always —— 池不满时随时补充（适合 OLLAMA_NUM_PARALLEL 大于1 的服务）
+多个引擎（如调度器中每个服务地址一个）共用一个池时，每个引擎都注册为一个补充来源，
+后台补充时选择当前空闲的引擎生成。来源还可以提供 paused 判断（如分批调度时当前批次使用的不是
+生成写作要求的模型），暂停时任何补充策略都不会使用该来源，避免补充引起模型切换。
+每次从池中取用记为节省了一次生成写作要求的时间（按后台实际生成的平均耗时估计）。
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+from metrics_exporter import REQUIREMENT_POOL_TAKES, REQUIREMENT_POOL_SECONDS_SAVED, REQUIREMENT_POOL_READY
+
+logger = logging.getLogger("NovelApp")
+
+REFILL_POLICIES = ("idle", "always")
+
+
+class RequirementPool:
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path, size=5, refill_policy="idle", poll_interval=2.0):
+        if refill_policy not in REFILL_POLICIES:
+            raise ValueError(f"未知的补充策略：{refill_policy}，可选 {', '.join(REFILL_POLICIES)}")
+        self.path = path
+        self.size = size
+        self.refill_policy = refill_policy
+        self.poll_interval = poll_interval
+        self.sources = []  # 补充来源：(生成一条写作要求的函数, 是否有小说正在写作, 是否暂停补充)
+        self.items = deque()
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.generate_seconds = 0.0  # 后台生成的累计耗时，用于估计每次取用节省的时间
+        self.saved_seconds = 0.0
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._load()
+
+    # 同一进程中的多个引擎（如调度器中每个服务地址一个）共用同一个池，各自通过 add_source 注册
+    @classmethod
+    def shared(cls, path, factory):
+        with cls._shared_lock:
+            pool = cls._shared.get(path)
+            if pool is None:
+                pool = cls._shared[path] = factory()
+            return pool
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取写作要求池失败: {str(e)}")
+            return
+        self.items.extend(item["text"] for item in data.get("requirements", []) if item.get("text"))
+        stats = data.get("stats", {})
+        self.generated = stats.get("generated", 0)
+        self.generate_seconds = stats.get("generate_seconds", 0.0)
+        logger.info(f"已加载写作要求池：{len(self.items)}条")
+
+    # 保存到文件（调用时已持有锁）；先写临时文件再替换，避免崩溃时损坏
+    def _save(self):
+        if not self.path:
+            return
+        data = {
+            "requirements": [{"text": text} for text in self.items],
+            "stats": {"generated": self.generated, "generate_seconds": round(self.generate_seconds, 3)},
+        }
+        try:
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            logger.warning(f"保存写作要求池失败: {str(e)}")
+
+    @property
+    def average_generate_seconds(self):
+        return self.generate_seconds / self.generated if self.generated else 0.0
+
+    def _record_generation(self, seconds):
+        self.generated += 1
+        self.generate_seconds += seconds
+
+    # 注册一个补充来源；busy 返回是否有小说正在写作（"idle" 策略下忙时不补充），
+    # paused 返回是否暂停补充（任何策略下都生效）
+    def add_source(self, generate, busy=None, paused=None):
+        with self._cond:
+            self.sources.append((generate, busy or (lambda: False), paused or (lambda: False)))
+            self._cond.notify_all()
+
+    # 池不满时返回当前可以用来补充的生成函数，否则返回 None
+    def _refill_source(self):
+        if len(self.items) >= self.size:
+            return None
+        for generate, busy, paused in self.sources:
+            if not paused() and (self.refill_policy == "always" or not busy()):
+                return generate
+        return None
+
+    def start(self):
+        if self._thread is None and self.size > 0:
+            REQUIREMENT_POOL_READY.set_function(lambda: len(self.items))
+            self._thread = threading.Thread(target=self._run, name="requirement-pool", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    # 后台补充：池不满且有符合补充策略的来源时生成一条；“空闲”状态没有通知，按 poll_interval 检查
+    def _run(self):
+        while not self._stop_event.is_set():
+            with self._cond:
+                generate = None
+                while not self._stop_event.is_set():
+                    generate = self._refill_source()
+                    if generate:
+                        break
+                    self._cond.wait(self.poll_interval)
+            if self._stop_event.is_set():
+                break
+            start = time.perf_counter()
+            try:
+                text = generate()
+            except Exception as e:
+                logger.warning(f"后台生成写作要求失败: {str(e)}")
+                self._stop_event.wait(30)
+                continue
+            if not text:
+                continue
+            with self._cond:
+                self._record_generation(time.perf_counter() - start)
+                self.items.append(text)
+                self._save()
+            logger.debug(f"写作要求池已补充：{len(self.items)}/{self.size}")
+
+    # 取出一条写作要求，返回 (写作要求, 是否来自池)；池为空时用调用方的 generate 当场生成
+    def take(self, generate):
+        with self._cond:
+            if self.items:
+                text = self.items.popleft()
+                self.hits += 1
+                self.saved_seconds += self.average_generate_seconds
+                REQUIREMENT_POOL_TAKES.inc(result="hit")
+                REQUIREMENT_POOL_SECONDS_SAVED.inc(self.average_generate_seconds)
+                self._save()
+                self._cond.notify_all()
+                logger.info(f"从写作要求池取出一条（剩余{len(self.items)}条），节省约{self.average_generate_seconds:.1f}秒")
+                return text, True
+            self.misses += 1
+        REQUIREMENT_POOL_TAKES.inc(result="miss")
+        start = time.perf_counter()
+        text = generate()
+        with self._cond:
+            self._record_generation(time.perf_counter() - start)
+        return text, False
+
+    def stats(self):
+        with self._cond:
+            return {
+                "ready": len(self.items),
+                "size": self.size,
+                "refill_policy": self.refill_policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "avg_generate_seconds": round(self.average_generate_seconds, 2),
+                "saved_seconds": round(self.saved_seconds, 1),
+            }
+
+    def report(self):
+        stats = self.stats()
+        return (f"写作要求池：取用{stats['hits']}次、当场生成{stats['misses']}次，"
+                f"剩余{stats['ready']}/{stats['size']}条，节省约{stats['saved_seconds']:.0f}秒"
+                f"（每条平均生成{stats['avg_generate_seconds']:.1f}秒）")
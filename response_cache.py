@@ -0,0 +1,139 @@
+"""非流式模型调用的结果缓存：以 (模型, 提示词, 参数) 的哈希为键，内存LRU + 磁盘存储。
+
+对没有变化的小说重新评估或重新生成修改建议时直接返回上次的结果，不再发送整篇小说、等待数分钟。
+磁盘上每个结果一个 gzip 压缩的JSON文件，总大小超过上限时删除最久未使用的文件（按修改时间，命中时更新）。
+"""
+import os
+import gzip
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("NovelApp")
+
+CACHE_SUFFIX = ".json.gz"
+
+# 不影响生成结果的请求参数，不参与计算缓存键
+IGNORED_KEYS = ("stream", "keep_alive")
+
+
+# 请求的缓存键：除 IGNORED_KEYS 外的全部参数（模型、提示词、温度、options 等）的哈希
+def cache_key(request_data):
+    payload = {k: v for k, v in request_data.items() if k not in IGNORED_KEYS}
+    text = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, directory, memory_entries=64, max_disk_bytes=200 * 1024 * 1024):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._disk_sizes = {}  # 缓存键 -> 文件大小
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            for name in os.listdir(directory):
+                if name.endswith(CACHE_SUFFIX):
+                    try:
+                        self._disk_sizes[name[:-len(CACHE_SUFFIX)]] = os.path.getsize(os.path.join(directory, name))
+                    except OSError:
+                        pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    # 返回缓存的结果（未命中时返回 None）
+    def get(self, key):
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return result
+        if self.directory and key in self._disk_sizes:
+            path = self._path(key)
+            try:
+                with gzip.open(path, 'rt', encoding='utf-8') as f:
+                    result = json.load(f)
+                os.utime(path)  # 更新最近使用时间，淘汰时按修改时间排序
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取缓存失败 {key[:12]}: {str(e)}")
+                result = None
+            if result is not None:
+                with self._lock:
+                    self._remember(key, result)
+                    self.hits += 1
+                return result
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        with self._lock:
+            self._remember(key, result)
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            with gzip.open(path + ".tmp", 'wt', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"写入缓存失败 {key[:12]}: {str(e)}")
+            return
+        with self._lock:
+            self._disk_sizes[key] = size
+            over = sum(self._disk_sizes.values()) - self.max_disk_bytes
+        if over > 0:
+            self._evict(over)
+
+    # 删除最久未使用的文件，直到释放 bytes_to_free 字节
+    def _evict(self, bytes_to_free):
+        with self._lock:
+            keys = list(self._disk_sizes)
+        entries = []
+        for key in keys:
+            try:
+                entries.append((os.path.getmtime(self._path(key)), key))
+            except OSError:
+                entries.append((0, key))
+        entries.sort()
+        freed = 0
+        removed = 0
+        for _, key in entries:
+            if freed >= bytes_to_free:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"删除缓存失败 {key[:12]}: {str(e)}")
+                continue
+            with self._lock:
+                freed += self._disk_sizes.pop(key, 0)
+            removed += 1
+        logger.info(f"磁盘缓存超过上限，已删除最久未使用的{removed}个结果（{freed / 1024:.1f}KB）")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk_sizes),
+                "disk_bytes": sum(self._disk_sizes.values()),
+            }
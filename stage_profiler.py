@@ -0,0 +1,172 @@
+"""生成流程各阶段的耗时统计，以及可选的 cProfile 性能分析。
+
+在提示词构造、等待网络、JSON解码、标签解析、字数统计、界面插入、保存、评估等阶段记录耗时，
+汇总为每个阶段的次数、总耗时和 p50/p95/最大值。每次记录只是两次 perf_counter 和一次列表追加，
+逐条消息的阶段也可以一直开启；百分位数基于每个阶段最近的 RESERVOIR_SIZE 个样本。
+"""
+import os
+import time
+import cProfile
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from novel_archive import is_archive_locator, LOCATOR_SEPARATOR, PACK_SUFFIX
+
+logger = logging.getLogger("NovelApp")
+
+RESERVOIR_SIZE = 10000
+
+# 报告中各阶段的显示名称和顺序
+STAGE_NAMES = {
+    "prompt_build": "构造提示词",
+    "request_send": "发送请求",
+    "stream_wait": "等待流式消息（含JSON解码）",
+    "json_decode": "JSON解码",
+    "tag_parse": "标签解析",
+    "word_count": "字数统计",
+    "callbacks": "显示回调",
+    "ui_insert": "界面插入",
+    "summary": "生成摘要",
+    "file_save": "保存文件",
+    "evaluation": "质量评估",
+}
+
+
+class _StageStats:
+    __slots__ = ("count", "total", "max", "recent")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class StageProfiler:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self.started = time.time()
+
+    # 记录一次耗时（秒）；逐条消息的热点路径直接调用这个方法
+    def add(self, stage, seconds):
+        if not self.enabled:
+            return
+        stats = self._stats.get(stage)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(stage, _StageStats())
+        stats.count += 1
+        stats.total += seconds
+        if seconds > stats.max:
+            stats.max = seconds
+        stats.recent.append(seconds)
+
+    @contextmanager
+    def span(self, stage):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    # 返回 {阶段: {count, total, p50, p95, max}}，时间单位为秒
+    def summary(self):
+        with self._lock:
+            items = list(self._stats.items())
+        result = {}
+        for stage, stats in items:
+            recent = sorted(stats.recent)
+            result[stage] = {
+                "count": stats.count,
+                "total": stats.total,
+                "p50": _percentile(recent, 0.5),
+                "p95": _percentile(recent, 0.95),
+                "max": stats.max,
+            }
+        return result
+
+    def report(self):
+        summary = self.summary()
+        if not summary:
+            return "阶段耗时统计：暂无数据"
+        order = list(STAGE_NAMES) + sorted(set(summary) - set(STAGE_NAMES))
+        elapsed = time.time() - self.started
+        lines = [f"阶段耗时统计（最近{elapsed / 60:.1f}分钟）：",
+                 f"{'阶段':<16}{'次数':>10}{'总耗时':>12}{'p50':>12}{'p95':>12}{'最大':>12}"]
+        for stage in order:
+            if stage not in summary:
+                continue
+            s = summary[stage]
+            lines.append(f"{STAGE_NAMES.get(stage, stage):<16}{s['count']:>10}{s['total']:>11.3f}s"
+                         f"{s['p50'] * 1000:>10.3f}ms{s['p95'] * 1000:>10.3f}ms{s['max'] * 1000:>10.3f}ms")
+        return "\n".join(lines)
+
+
+# 进程内共用的阶段统计
+PROFILER = StageProfiler()
+
+
+# Python 3.12 起同一进程中同时只能启用一个 cProfile，并发写作时同一时间只分析一篇
+_PROFILE_LOCK = threading.Lock()
+
+
+class RunProfile:
+    """用 cProfile 分析一次写作（只分析调用线程），结束后把结果写到保存的小说旁边。
+    已有另一篇正在分析时跳过本篇（调度器中多个工作线程同时写作时）。"""
+
+    def __init__(self, enabled):
+        self.profile = cProfile.Profile() if enabled else None
+
+    def __enter__(self):
+        if not self.profile:
+            return self
+        if not _PROFILE_LOCK.acquire(blocking=False):
+            logger.info("另一篇小说正在进行性能分析，本篇跳过")
+            self.profile = None
+            return self
+        try:
+            self.profile.enable()
+        except ValueError as e:  # 进程中已有其他分析器
+            _PROFILE_LOCK.release()
+            logger.warning(f"无法启动性能分析，本篇跳过: {str(e)}")
+            self.profile = None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profile:
+            self.profile.disable()
+            _PROFILE_LOCK.release()
+        return False
+
+    # 写入 <小说文件名>.prof，可用 python -m pstats 或 snakeviz 查看；返回写入的路径
+    def dump_next_to(self, novel_path):
+        if not self.profile or not novel_path:
+            return None
+        if is_archive_locator(novel_path):
+            # 归档的小说（包文件#偏移）：保存为包文件旁边的 <日期>_<偏移>.prof，同一天的各篇互不覆盖
+            pack_path, _, offset = novel_path.rpartition(LOCATOR_SEPARATOR)
+            path = f"{pack_path[:-len(PACK_SUFFIX)]}_{offset}.prof"
+        else:
+            path = os.path.splitext(novel_path)[0] + ".prof"
+        self.profile.dump_stats(path)
+        logger.info(f"性能分析结果已保存至：{path}")
+        return path
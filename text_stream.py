@@ -0,0 +1,338 @@
+"""流式文本处理工具：这些对象按流式到达的文本块增量更新，每个文本块只做 O(块长度) 的工作。"""
+import re
+from collections import deque
+
+CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+ENGLISH_WORD_PATTERN = re.compile(r'\b[a-zA-Z]+\b')
+NON_WORD_PATTERN = re.compile(r'\W')
+
+
+def _is_word_char(char):
+    # 与正则中的 \w 一致
+    return char.isalnum() or char == '_'
+
+
+def _is_english_word(text):
+    return text.isascii() and text.isalpha()
+
+
+class WordCounter:
+    """增量字数统计，结果与 count_words 完全一致：中文字符数 + 英文单词数（\\b[a-zA-Z]+\\b）。
+
+    英文单词可能被拆在两个文本块之间（如 "hel" + "lo"），因此记录末尾尚未结束的 \\w 串的状态，
+    而不是保存文本本身；查询总字数是 O(1) 的。
+    """
+
+    def __init__(self, text=""):
+        self.reset()
+        if text:
+            self.feed(text)
+
+    def reset(self):
+        self.chinese_chars = 0
+        self.english_words = 0  # 已经结束的英文单词数
+        self.in_run = False  # 文本末尾是否处于一个 \w 串中
+        self.run_is_english = False  # 末尾的 \w 串是否全部由英文字母组成
+
+    @property
+    def total(self):
+        # 文本结尾本身就是单词边界，末尾未结束的英文串也计为一个单词
+        return self.chinese_chars + self.english_words + (1 if self.in_run and self.run_is_english else 0)
+
+    # 保存/恢复统计状态，用于丢弃被中断的一轮内容
+    def snapshot(self):
+        return (self.chinese_chars, self.english_words, self.in_run, self.run_is_english)
+
+    def restore(self, state):
+        self.chinese_chars, self.english_words, self.in_run, self.run_is_english = state
+
+    def feed(self, chunk):
+        if not chunk:
+            return
+        self.chinese_chars += len(CJK_PATTERN.findall(chunk))
+
+        # 文本块开头的 \w 部分延续上一个文本块末尾的串
+        match = NON_WORD_PATTERN.search(chunk)
+        head_end = match.start() if match else len(chunk)
+        head = chunk[:head_end]
+        if head:
+            if self.in_run:
+                self.run_is_english = self.run_is_english and _is_english_word(head)
+            else:
+                self.in_run = True
+                self.run_is_english = _is_english_word(head)
+        if match is None:
+            return
+
+        # 遇到非单词字符，上一个串结束
+        if self.in_run and self.run_is_english:
+            self.english_words += 1
+
+        # 文本块末尾的 \w 串可能在下一个文本块中继续
+        tail_start = len(chunk)
+        while tail_start > head_end and _is_word_char(chunk[tail_start - 1]):
+            tail_start -= 1
+
+        # 中间部分的单词两端都是真正的边界
+        self.english_words += len(ENGLISH_WORD_PATTERN.findall(chunk, head_end, tail_start))
+
+        tail = chunk[tail_start:]
+        self.in_run = bool(tail)
+        self.run_is_english = bool(tail) and _is_english_word(tail)
+
+
+THINK_OPEN_TAG = "<think>"
+THINK_CLOSE_TAG = "</think>"
+THINK_CLOSE_TAGS = ("</think>", "</thind>")  # 模型偶尔会把结束标签写成</thind>
+
+
+# 文本末尾（从 start 开始）与某个标签前缀相同的最长长度，这部分需要留到下一个文本块再判断
+def _partial_tag_length(text, start, tags):
+    longest = 0
+    available = len(text) - start
+    for tag in tags:
+        for length in range(min(len(tag) - 1, available), longest, -1):
+            if text.endswith(tag[:length]):
+                longest = length
+                break
+    return longest
+
+
+class ThinkTagParser:
+    """增量解析 <think></think> 标签，把流式文本分成正式内容和思维推理内容。
+
+    只保存一个状态标志和不超过一个标签长度的待定文本，标签被拆在两个文本块之间（如 "<thi" + "nk>"）
+    时也能正确识别；每个文本块的处理是 O(块长度) 的。思维推理内容包含标签本身，</thind> 会被修正为 </think>。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.in_think = False
+        self._carry = ""
+
+    # 处理一个文本块，返回 (正式内容, 思维推理内容)
+    def feed(self, chunk):
+        text = self._carry + chunk
+        self._carry = ""
+        story_parts = []
+        think_parts = []
+        pos = 0
+        while True:
+            if not self.in_think:
+                index = text.find(THINK_OPEN_TAG, pos)
+                if index == -1:
+                    keep = _partial_tag_length(text, pos, (THINK_OPEN_TAG,))
+                    story_parts.append(text[pos:len(text) - keep])
+                    break
+                story_parts.append(text[pos:index])
+                think_parts.append(THINK_OPEN_TAG)
+                pos = index + len(THINK_OPEN_TAG)
+                self.in_think = True
+            else:
+                index = -1
+                for tag in THINK_CLOSE_TAGS:
+                    found = text.find(tag, pos)
+                    if found != -1 and (index == -1 or found < index):
+                        index = found
+                if index == -1:
+                    keep = _partial_tag_length(text, pos, THINK_CLOSE_TAGS)
+                    think_parts.append(text[pos:len(text) - keep])
+                    break
+                think_parts.append(text[pos:index])
+                think_parts.append(THINK_CLOSE_TAG)
+                pos = index + len(THINK_CLOSE_TAG)
+                self.in_think = False
+        if keep:
+            self._carry = text[len(text) - keep:]
+        return "".join(story_parts), "".join(think_parts)
+
+    # 流式响应结束时输出仍在等待判断的文本
+    def flush(self):
+        carry, self._carry = self._carry, ""
+        if self.in_think:
+            return "", carry
+        return carry, ""
+
+
+SENTENCE_END_PATTERN = re.compile(r'[。！？!?…]+[」』”’"]*|\n')
+_HASH_BASE = 1000003
+_HASH_MOD = (1 << 61) - 1
+
+
+class RepetitionDetector:
+    """在线检测模型陷入循环（反复输出同一句话或同一段落）。
+
+    对每个位置结尾的 ngram_chars 个字符计算滚动哈希，记录每个哈希最近一次出现的位置（只保留最近
+    window_chars 个字符内的位置）。若连续多个位置上的片段都与前面相隔同样距离（周期）的片段相同，
+    说明正在重复；重复的长度达到一个周期且不少于 min_repeat_chars 时判定为循环。
+    每个字符只做常数次哈希运算和字典操作，内存不超过窗口大小。
+    """
+
+    def __init__(self, ngram_chars=16, min_repeat_chars=80, window_chars=4000):
+        self.ngram_chars = ngram_chars
+        self.min_repeat_chars = min_repeat_chars
+        self.window_chars = window_chars
+        self._drop_factor = pow(_HASH_BASE, ngram_chars - 1, _HASH_MOD)
+        self.reset()
+
+    def reset(self):
+        self.length = 0  # 已输入的字符数
+        self.triggered = False
+        self.keep_length = None  # 判定为循环时应保留的前缀长度（去掉第一份之后的重复内容）
+        self.trimmed_chars = 0
+        self.period = None
+        self._hash = 0
+        self._recent = deque(maxlen=self.ngram_chars)
+        self._last_seen = {}  # 哈希 -> 最近出现的结束位置
+        self._positions = deque()  # (结束位置, 哈希)，用于淘汰窗口外的记录
+        self._run_period = None
+        self._run_start = 0  # 当前连续匹配的第一个结束位置
+        self._run_end = -1
+
+    # 输入一段文本；判定为循环时返回应保留的前缀长度（之后的输入都返回同一个值），否则返回 None
+    def feed(self, chunk):
+        if self.triggered:
+            return self.keep_length
+        n = self.ngram_chars
+        recent = self._recent
+        last_seen = self._last_seen
+        positions = self._positions
+        for char in chunk:
+            if len(recent) == n:
+                self._hash = (self._hash - ord(recent[0]) * self._drop_factor) % _HASH_MOD
+            recent.append(char)
+            self._hash = (self._hash * _HASH_BASE + ord(char)) % _HASH_MOD
+            self.length += 1
+            end = self.length
+            if end < n:
+                continue
+
+            previous = last_seen.get(self._hash)
+            if previous is not None:
+                period = end - previous
+                if period != self._run_period or self._run_end != end - 1:
+                    self._run_period = period
+                    self._run_start = end
+                self._run_end = end
+                repeated = end - self._run_start + n  # 与前一个周期相同的字符数
+                if repeated >= max(self.min_repeat_chars, period):
+                    self.triggered = True
+                    self.period = period
+                    self.keep_length = self._run_start - n
+                    return self.keep_length
+
+            last_seen[self._hash] = end
+            positions.append((end, self._hash))
+            while positions[0][0] < end - self.window_chars:
+                old_end, old_hash = positions.popleft()
+                if last_seen.get(old_hash) == old_end:
+                    del last_seen[old_hash]
+        return None
+
+    # 判定为循环后，根据本轮已收到的全部文本确定保留的长度：重复的起点不一定在句子边界上，
+    # 向后延伸到下一个句末标点，使保留的内容以完整的句子结束；返回保留的长度
+    def settle(self, text):
+        match = SENTENCE_END_PATTERN.search(text, self.keep_length, self.keep_length + self.period)
+        if match:
+            self.keep_length = match.end()
+        self.trimmed_chars = len(text) - self.keep_length
+        return self.keep_length
+
+
+class _SuffixAutomaton:
+    """后缀自动机：逐字符推进判断一个字符串是否为 text 的子串，每个字符 O(1)；构建为 O(len(text))。"""
+
+    def __init__(self, text):
+        self.transitions = [{}]
+        self.links = [-1]
+        self.lengths = [0]
+        last = 0
+        for char in text:
+            last = self._extend(last, char)
+        # 从最后一个状态沿后缀链接经过的状态对应 text 的后缀
+        self.suffix_states = set()
+        while last != -1:
+            self.suffix_states.add(last)
+            last = self.links[last]
+
+    def _extend(self, last, char):
+        transitions, links, lengths = self.transitions, self.links, self.lengths
+        current = len(lengths)
+        transitions.append({})
+        links.append(0)
+        lengths.append(lengths[last] + 1)
+        state = last
+        while state != -1 and char not in transitions[state]:
+            transitions[state][char] = current
+            state = links[state]
+        if state != -1:
+            target = transitions[state][char]
+            if lengths[state] + 1 == lengths[target]:
+                links[current] = target
+            else:
+                clone = len(lengths)
+                transitions.append(dict(transitions[target]))
+                links.append(links[target])
+                lengths.append(lengths[state] + 1)
+                while state != -1 and transitions[state].get(char) == target:
+                    transitions[state][char] = clone
+                    state = links[state]
+                links[target] = clone
+                links[current] = clone
+        return current
+
+
+class OverlapTrimmer:
+    """去掉新一轮开头重复上文末尾的内容（模型续写时经常先复述上一轮的最后几句）。
+
+    用上文末尾的一段文字构建后缀自动机；新一轮的文本逐字符推进，只要开头部分仍是上文中的一段，
+    就暂存不输出。一旦不再匹配（或响应结束），若暂存的部分不少于 min_overlap_chars 个字符则丢弃：
+    它是上文的结尾时整段丢弃，否则只丢弃到最后一个句末标点，避免删掉新句子的开头。
+    开头的空白字符不参与匹配，原样保留。
+    """
+
+    def __init__(self, tail, min_overlap_chars=10):
+        self.min_overlap_chars = min_overlap_chars
+        self.active = bool(tail)
+        self.removed_chars = 0
+        self._automaton = _SuffixAutomaton(tail) if tail else None
+        self._state = 0
+        self._held = []
+        self._leading = ""
+
+    # 处理一个文本块，返回可以输出的文本
+    def feed(self, chunk):
+        if not self.active:
+            return chunk
+        transitions = self._automaton.transitions
+        for index, char in enumerate(chunk):
+            if not self._held and char.isspace():
+                self._leading += char
+                continue
+            state = transitions[self._state].get(char)
+            if state is None:
+                return self._resolve() + chunk[index:]
+            self._state = state
+            self._held.append(char)
+        return ""
+
+    # 响应结束时输出仍在暂存的文本
+    def flush(self):
+        return self._resolve() if self.active else ""
+
+    def _resolve(self):
+        self.active = False
+        held = "".join(self._held)
+        drop = 0
+        if len(held) >= self.min_overlap_chars:
+            if self._state in self._automaton.suffix_states:
+                drop = len(held)
+            else:
+                for match in SENTENCE_END_PATTERN.finditer(held):
+                    drop = match.end()
+                if drop < self.min_overlap_chars:
+                    drop = 0
+        self.removed_chars = drop
+        return self._leading + held[drop:]
@@ -0,0 +1,111 @@
+"""生成线程与Tk主循环之间的界面更新队列。
+
+生成线程只把文本块放入队列（线程安全）；Tk主循环按固定的帧间隔取出队列中的全部内容，
+每帧对每个文本控件只做一次 insert 和一次 see。本模块不导入 tkinter，控件由调用方注册。
+"""
+import time
+import queue
+import logging
+
+from stage_profiler import PROFILER
+
+logger = logging.getLogger("NovelApp")
+
+
+class UIUpdatePipeline:
+    def __init__(self, root, frame_interval_ms=50):
+        self.root = root
+        self.frame_interval_ms = frame_interval_ms
+        self.queue = queue.SimpleQueue()
+        self.targets = {}  # 名称 -> 返回当前控件的函数（控件可能被替换，例如切换Markdown模式）
+        self._timer = None
+        self.reset_stats()
+
+    # 注册文本控件，例如 register("story", lambda: output_text)
+    def register(self, name, widget_getter):
+        self.targets[name] = widget_getter
+
+    # 以下两个方法可在任意线程中调用
+    def put(self, name, text):
+        if text:
+            self.queue.put((name, text, time.perf_counter()))
+
+    # 在主线程中执行一个函数（如清空控件、更新状态栏），与文本块保持先后顺序
+    def call(self, func):
+        self.queue.put((None, func, time.perf_counter()))
+
+    # 删除控件末尾已显示的 count 个字符（在之前入队的文本插入之后执行）
+    def retract(self, name, count):
+        if count > 0:
+            self.call(lambda: self.targets[name]().delete(f"end-{count + 1}c", "end-1c"))
+
+    def start(self):
+        if self._timer is None:
+            self._last_frame = time.perf_counter()
+            self._timer = self.root.after(self.frame_interval_ms, self._drain)
+
+    def stop(self):
+        if self._timer is not None:
+            self.root.after_cancel(self._timer)
+            self._timer = None
+
+    def reset_stats(self):
+        self.frames = 0
+        self.chunks = 0
+        self.latency_total = 0.0  # 文本块从入队到显示的累计延迟（秒）
+        self.latency_max = 0.0
+        self.lag_total = 0.0  # 实际帧间隔超出设定值的累计时间（秒），反映主循环是否被阻塞
+        self.lag_max = 0.0
+
+    def _flush(self, pending):
+        for name, parts in pending.items():
+            with PROFILER.span("ui_insert"):
+                widget = self.targets[name]()
+                widget.insert("end", "".join(parts))
+                widget.see("end")
+        pending.clear()
+
+    # 主循环定时调用：取出队列中已有的全部内容，合并后一次性插入
+    def _drain(self):
+        now = time.perf_counter()
+        lag = max(0.0, now - self._last_frame - self.frame_interval_ms / 1000)
+        self._last_frame = now
+
+        pending = {}
+        enqueued_times = []
+        try:
+            while True:
+                name, payload, enqueued_at = self.queue.get_nowait()
+                if name is None:
+                    self._flush(pending)
+                    payload()
+                else:
+                    pending.setdefault(name, []).append(payload)
+                    enqueued_times.append(enqueued_at)
+        except queue.Empty:
+            pass
+        except Exception as e:
+            logger.error(f"界面更新出错: {str(e)}")
+        try:
+            self._flush(pending)
+        except Exception as e:
+            logger.error(f"界面更新出错: {str(e)}")
+
+        if enqueued_times:
+            shown_at = time.perf_counter()
+            self.frames += 1
+            self.chunks += len(enqueued_times)
+            self.latency_total += sum(shown_at - t for t in enqueued_times)
+            self.latency_max = max(self.latency_max, shown_at - enqueued_times[0])
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+
+        self._timer = self.root.after(self.frame_interval_ms, self._drain)
+
+    # 界面刷新统计：文本块上屏延迟和主循环帧延迟
+    def format_stats(self):
+        if not self.chunks:
+            return "界面刷新统计：无文本更新"
+        return (f"界面刷新统计：{self.chunks}个文本块合并为{self.frames}帧，"
+                f"上屏延迟平均{self.latency_total / self.chunks * 1000:.1f}ms/最大{self.latency_max * 1000:.1f}ms，"
+                f"帧延迟平均{self.lag_total / self.frames * 1000:.1f}ms/最大{self.lag_max * 1000:.1f}ms")
@@ -1,18 +1,24 @@
 import tkinter as tk
 from tkinter import scrolledtext, messagebox, ttk, filedialog
 import requests
-import json
 import threading
 import re
-import time
 import os
+import time
+import sqlite3
 import logging
-from datetime import datetime
 import pyperclip  # 用于复制到剪贴板
 import markdown  # 用于转换Markdown为HTML
 from tkhtmlview import HTMLScrolledText  # 用于显示HTML
 import docx  # 用于创建Word文档
 from docx.shared import Pt
+from ollama_client import default_base_urls
+from novel_engine import NovelEngine, count_words
+from checkpoint_journal import find_unfinished_sessions
+from ui_pipeline import UIUpdatePipeline
+from metrics_exporter import start_metrics_server, ERRORS, NOVELS_COMPLETED
+from cassette import CassetteRecorder
+from stage_profiler import PROFILER, RunProfile
 
 # 设置日志记录
 logging.basicConfig(
@@ -31,6 +37,7 @@ thinking_content = ""  # 用于存储思维推理内容
 is_generating = False  # 控制生成过程的标志
 update_timer = None  # 用于存储更新计时器的ID
 model_name = 'huihui_ai/qwen2.5-1m-abliterated:14b'  # 模型名称 
+ollama_base_urls = default_base_urls()  # Ollama服务地址，可通过环境变量OLLAMA_HOSTS配置多个（逗号分隔）
 #writing_model_name = 'glm4:latest'
 writing_model_name = 'huihui_ai/qwen2.5-1m-abliterated:14b'
 #evaluation_model_name = 'qwq:latest'  # 用于评估的模型
@@ -38,315 +45,254 @@ evaluation_model_name = 'huihui_ai/qwen2.5-1m-abliterated:14b'  # 用于评估
 is_auto_generating = False  # 控制自动生成的标志
 is_evaluating = False  # 控制评估过程的标志
 is_markdown_mode = False  # 控制是否显示为Markdown格式
+memory_token_budget = 6000  # 续写提示词中“前文摘要+最近内容”的token预算
+memory_tail_chars = 1500  # 续写时原文保留的最近字符数
+context_reuse_enabled = True  # 续写和修改时复用Ollama返回的context，避免重复预填充
+context_reuse_max_tokens = 16000  # 复用的context超过该长度后回退到摘要提示词
+ui_frame_interval_ms = 50  # 流式文本合并刷新到界面的帧间隔（毫秒）
+outline_chapter_words = 2000  # 大纲并行模式下每章的目标字数
+outline_parallel_slots = 2  # 大纲并行模式下同时生成的章节数，建议与OLLAMA_NUM_PARALLEL一致
+checkpoint_dir = "checkpoints"  # 断点日志目录，程序意外退出后可从中恢复未完成的小说
+metrics_port = None  # 设置端口后启动Prometheus指标服务（http://127.0.0.1:端口/metrics）
+cassette_record_path = None  # 设置文件路径（如"ollama_cassette.jsonl.gz"）后录制Ollama的原始响应
+cassette_replay_path = None  # 设置磁带文件路径后回放录制的响应，不连接Ollama
+cassette_replay_speed = 1.0  # 回放速度倍数，0 表示不等待
+cprofile_enabled = False  # 用cProfile分析每次写作，结果保存为小说旁边的.prof文件
+keep_alive = "30m"  # 每次请求后模型在Ollama中保留的时间，-1 表示一直保留
+keep_alive_ping_seconds = 0  # 模型空闲超过该秒数时发送保活请求，0 表示不保活
+response_cache_dir = "response_cache"  # 评估和修改建议结果的缓存目录，None 表示不缓存
+requirement_pool_size = 3  # 后台预先生成的写作要求条数（保存在requirement_pool.json中），0 表示不使用
+library_db = "novel_library.db"  # 小说库索引（写作要求、评分和全文检索），None 表示不建立索引
+storage_backend = "files"  # "files" 每篇保存为txt文件；"archive" 按天写入压缩包文件（同时保存思维推理内容）
+auto_interval_ms = 2000  # 自动模式下保存后开始下一篇前的等待（毫秒）；写作要求池中有现成的写作要求时不等待
 
-# 判断写作目标是否完成的方法
-def is_writing_complete(content, target_word_count):
-    # 计算中文字符数（每个中文字符算一个字）
-    chinese_chars = re.findall(r'[\u4e00-\u9fff]', content)
-    # 计算英文单词数（假设英文单词由空格分隔）
-    english_words = re.findall(r'\b[a-zA-Z]+\b', content)
-    
-    # 总字数 = 中文字符数 + 英文单词数
-    total_words = len(chinese_chars) + len(english_words)
-    
-    # 判断是否达到目标字数
-    return total_words >= target_word_count
+# 无界面的生成引擎，GUI和命令行共用同一套流程
+novel_engine = NovelEngine({
+    "ollama_base_urls": ollama_base_urls,
+    "model_name": model_name,
+    "writing_model_name": writing_model_name,
+    "evaluation_model_name": evaluation_model_name,
+    "memory_token_budget": memory_token_budget,
+    "memory_tail_chars": memory_tail_chars,
+    "context_reuse_enabled": context_reuse_enabled,
+    "context_reuse_max_tokens": context_reuse_max_tokens,
+    "outline_chapter_words": outline_chapter_words,
+    "outline_parallel_slots": outline_parallel_slots,
+    "checkpoint_dir": checkpoint_dir,
+    "cassette_record": cassette_record_path,
+    "cassette_replay": cassette_replay_path,
+    "cassette_replay_speed": cassette_replay_speed,
+    "keep_alive": keep_alive,
+    "keep_alive_ping_seconds": keep_alive_ping_seconds,
+    "response_cache_dir": response_cache_dir,
+    "requirement_pool_size": requirement_pool_size,
+    "library_db": library_db,
+    "storage_backend": storage_backend
+})
+current_job = None  # 当前正在生成（或最近一次生成）的小说状态
 
-# 生成写作提示的方法
-def generate_user_prompt():
-    try:
-        api_url = 'http://localhost:11434/api/generate'
-        prompt = '''你是一个创意写作专家，请生成一个有趣的小说写作要求。要求：
-        1. 包含具体的故事背景、人物设定和情节方向
-        2. 要有创意，不要太过俗套
-        3. 字数在100-200之间
-        4. 只输出写作要求本身，不要包含任何其他说明
-        5. 每次生成的内容都要不一样，保持新颖性
-        6. 小说风格以言情类为主。
-        '''
-        
-        request_data = {
-            "model": model_name,
-            "prompt": prompt,
-            "temperature": 0.9,  # 使用较高的温度以增加创意性
-            "stream": False
-        }
-        
-        response = requests.post(api_url, json=request_data, timeout=30)
-        response.raise_for_status()
-        
-        # 获取生成的提示词
-        result = response.json()
-        new_prompt = result.get('response', '').strip()
-        
-        # 清空并更新提示词输入框
-        prompt_entry.delete("1.0", tk.END)
-        prompt_entry.insert("1.0", new_prompt)
-        
-        return True
-    except Exception as e:
-        update_status(f"生成写作要求时出错：{str(e)}")
-        return False
+# 取得下一篇的写作要求并开始生成：写作要求池为空时要调用模型（去重时可能重试多次），
+# 因此在后台线程中取得，再回到主循环填入输入框并开始生成
+def generate_prompt_and_write():
+    def run():
+        try:
+            new_prompt = novel_engine.next_requirement(on_status=post_status)
+        except Exception as e:
+            post_status(f"生成写作要求时出错：{str(e)}")
+            return
+        ui_pipeline.call(lambda: start_with_prompt(new_prompt))
+
+    update_status("正在准备写作要求...")
+    threading.Thread(target=run, daemon=True).start()
+
+# 在主循环中填入写作要求并开始生成；等待期间停止了自动生成或已开始其他生成时不再开始
+def start_with_prompt(new_prompt):
+    if not is_auto_generating or is_generating:
+        return
+    # 清空并更新提示词输入框
+    prompt_entry.delete("1.0", tk.END)
+    prompt_entry.insert("1.0", new_prompt)
+    generate_text()
 
-# 保存生成的内容到文件
-def save_content_to_file():
+# 保存生成的内容到文件（在工作线程中调用，界面更新都交给主循环）
+def save_content_to_file(user_prompt):
     if not generated_content.strip():
         return
-        
-    # 确保输出目录存在
-    output_dir = "generated_novels"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # 计算当前内容的字数
-    chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', generated_content))
-    english_words = len(re.findall(r'\b[a-zA-Z]+\b', generated_content))
-    total_words = chinese_chars + english_words
-    
-    # 生成文件名：字数_时间戳.txt
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"{total_words}字_{timestamp}.txt"
-    filepath = os.path.join(output_dir, filename)
     
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(generated_content)
-        update_status(f"内容已保存至：{filename}")
+        # 内容就是当前小说的内容时直接使用增量统计的字数
+        word_count = None
+        if current_job and current_job.generated_content == generated_content:
+            word_count = current_job.word_counter.total
+        filepath = novel_engine.store_novel(generated_content, word_count,
+                                            thinking_content if word_count is not None else "",
+                                            user_prompt=user_prompt)
+        if word_count is not None:
+            current_job.discard_checkpoint()
+        novel_engine.index_novel(filepath, generated_content, current_job if word_count is not None else None,
+                                 user_prompt=user_prompt)
+        post_status(f"内容已保存至：{os.path.basename(filepath)}")
         
         # 如果是自动生成模式，则继续生成下一个故事
         if is_auto_generating:
-            root.after(2000, lambda: continue_auto_generate())
+            pool = novel_engine.requirement_pool
+            delay = 0 if pool and pool.items else auto_interval_ms
+            ui_pipeline.call(lambda: root.after(delay, continue_auto_generate))
+        return filepath
             
     except Exception as e:
-        update_status(f"保存文件时出错：{str(e)}")
+        post_status(f"保存文件时出错：{str(e)}")
 
 # 继续自动生成的方法
 def continue_auto_generate():
     if is_auto_generating and not is_generating:
-        if generate_user_prompt():
-            generate_text()
+        generate_prompt_and_write()
+
+# 显示正式小说内容（在生成线程中调用，由界面更新队列合并后在主循环中插入）
+def show_story_chunk(story_chunk):
+    ui_pipeline.put("story", story_chunk)
 
-# 处理本次生成的内容
-def process_text_chunk(text_chunk):
-    """处理文本块，分离思维推理内容和正式小说内容"""
+# 删除已显示的正文末尾（模型陷入循环时撤回重复的内容）
+def retract_story_chunk(count):
+    ui_pipeline.retract("story", count)
+
+# 显示思维推理内容
+def show_thinking_chunk(think_chunk):
     global thinking_content
-    
-    # 修正可能错误的</thind>标签为正确的</think>
-    text_chunk = text_chunk.replace("</thind>", "</think>")
-    
-    # 存储原始文本块，用于比较处理前后的变化
-    original_chunk = text_chunk
-    story_content = ""
-    
-    # 循环处理可能存在的多个思维标签
-    while "<think>" in text_chunk:
-        # 找到<think>的位置
-        think_start = text_chunk.find("<think>")
-        
-        # 将<think>前的内容添加到故事内容
-        story_content += text_chunk[:think_start]
-        
-        # 截取剩余部分
-        text_chunk = text_chunk[think_start:]
-        
-        # 找到</think>的位置
-        think_end = text_chunk.find("</think>")
-        
-        if think_end != -1:
-            # 完整的思维内容
-            think_end += 8  # 加上"</think>"的长度(8个字符)
-            think_content = text_chunk[:think_end]
-            
-            # 更新思维内容显示区域
-            thinking_text.insert(tk.END, think_content)
-            thinking_text.see(tk.END)
-            
-            # 将思维内容添加到思维记录中
-            thinking_content += think_content
-            
-            # 处理剩余文本
-            text_chunk = text_chunk[think_end:]
-        else:
-            # <think>标签没有配对的</think>，将整段视为思维内容
-            thinking_text.insert(tk.END, text_chunk)
-            thinking_text.see(tk.END)
-            thinking_content += text_chunk
-            text_chunk = ""
-            break
-    
-    # 添加最后一部分文本到故事内容
-    story_content += text_chunk
-    
-    # 检查是否正在一个未闭合的思维内容中
-    if ("<think>" in thinking_content and "</think>" not in thinking_content) or \
-       (thinking_content.rfind("<think>") > thinking_content.rfind("</think>")):
-        # 可能是思维内容的中间部分，无标签
-        if original_chunk != story_content:  # 已经处理过标签的不重复处理
-            return story_content
-        # 假设这是思维内容的一部分
-        thinking_text.insert(tk.END, original_chunk)
-        thinking_text.see(tk.END)
-        thinking_content += original_chunk
-        return ""
-    
-    return story_content
+    thinking_content += think_chunk
+    ui_pipeline.put("thinking", think_chunk)
+
+# 从生成线程更新状态栏
+def post_status(message):
+    ui_pipeline.call(lambda: update_status(message))
+
+# 从工作线程弹出错误提示（在主循环中显示）；message 需在调用前格式化好，
+# except 块结束后异常变量即被删除，不能在延迟执行的函数中引用
+def post_error(title, message):
+    ui_pipeline.call(lambda: messagebox.showerror(title, message))
+
+# 清空小说内容和思维推理显示区域
+def clear_output_areas():
+    output_text.delete(1.0, tk.END)
+    thinking_text.delete(1.0, tk.END)
+
+# 在界面更新队列处理完已有内容后记录刷新统计
+def log_ui_stats():
+    ui_pipeline.call(lambda: logger.info(ui_pipeline.format_stats()))
+
+# 每轮结束后同步已生成的内容
+def sync_generated_content(job):
+    global generated_content
+    generated_content = job.generated_content
 
-# 生成文本的线程函数
-def generate_text_thread():
-    global generated_content, thinking_content, is_generating, update_timer
+# 生成文本的线程函数；resume_session 不为空时继续写断点日志中未完成的小说
+# 写作要求和目标字数由 generate_text 在主线程中读取，本线程不访问Tk控件
+def generate_text_thread(resume_session=None, user_prompt="", target_word_count=None):
+    global generated_content, thinking_content, is_generating, update_timer, current_job
     
     try:
-        # 获取用户输入的提示和目标字数
-        user_prompt = prompt_entry.get("1.0", tk.END).strip()
-        try:
-            target_word_count = int(word_count_entry.get())
-        except ValueError:
-            messagebox.showerror("错误", "请输入有效的目标字数")
-            is_generating = False
-            return
-        
         # 清空显示区域
-        output_text.delete(1.0, tk.END)
-        thinking_text.delete(1.0, tk.END)
+        ui_pipeline.call(clear_output_areas)
+        ui_pipeline.call(ui_pipeline.reset_stats)
         generated_content = ""
         thinking_content = ""
+
+        if resume_session:
+            current_job = novel_engine.resume_job(resume_session)
+            if current_job is None:
+                post_status("该小说已被其他程序恢复或正在使用，无法继续")
+                is_generating = False
+                return
+            generated_content = current_job.generated_content
+            thinking_content = current_job.thinking_content
+            ui_pipeline.put("story", generated_content)
+            ui_pipeline.put("thinking", thinking_content)
+        else:
+            current_job = novel_engine.new_job(user_prompt, target_word_count)
         
         # 循环生成文本，直到达到目标字数
-        while not is_writing_complete(generated_content, target_word_count) and is_generating:
-            # 构造提示词（包括已生成的内容）
-            if generated_content:
-                full_prompt = f'''
-                你是一个小说作家，擅长写言情类小说，请根据以下用户写作要求和已经写作的内容，开始或者继续创作：
-                ## 用户的写作要求：
-                 {user_prompt}
-
-                ## 已经写作的内容：
-                {generated_content}
-
-                ## 注意事项：
-                1. 请根据用户写作要求和已经写作的内容，继续创作。
-                2. 请保持故事的连贯性和逻辑性。
-                3. 请保持故事的节奏感，不要出现过于冗长或重复的描述。
-                4. 请保持故事的紧凑性，不要出现过于拖沓的情节。
-                5. 请保持故事的新鲜感，不要出现过于俗套的情节。
-                6. 请保持故事的合理性，不要出现过于夸张的情节。
-                7. 请保使用中文写作；
-                8. 你可以使用<think></think>标签来表示你的思考过程，这部分内容不会出现在最终故事中。
-                '''
-            else:
-                full_prompt = f'''{user_prompt}
-
-你可以使用<think></think>标签来表示你的思考过程，这部分内容不会出现在最终故事中。例如：
-<think>我需要先确定故事的主角和背景，然后设计一个合理的情节发展。</think>
-正式的故事内容...'''
-            
-            # 准备请求参数
-            api_url = 'http://localhost:11434/api/generate'
-            request_data = {
-                "model": writing_model_name,
-                "prompt": full_prompt,
-                "max_tokens": 1000000,
-                "temperature": 0.7,
-                "stream": True
-            }
-            
-            # 发送请求并获取流式响应
-            response = requests.post(api_url, json=request_data, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            # 处理本次生成的内容
-            new_content = ""
-            
-            # 处理流式响应
-            for line in response.iter_lines():
-                # 如果已停止生成，则跳出响应处理循环
-                if not is_generating:
-                    break
-                    
-                if line:
-                    # 解析 JSON 数据
-                    data = json.loads(line.decode('utf-8'))
-                    # 提取 response 字段
-                    text_chunk = data.get('response', '')
-                    
-                    # 处理文本块，分离思维推理和正式内容
-                    story_chunk = process_text_chunk(text_chunk)
-                    
-                    # 更新显示区域（仅显示正式内容）
-                    if story_chunk:
-                        output_text.insert(tk.END, story_chunk)
-                        output_text.see(tk.END)  # 自动滚动到最新内容
-                        # 累积新内容
-                        new_content += story_chunk
-                    
-                    root.update_idletasks()  # 更新UI
-                    
-                    # 检查是否完成（当 done 为 true 时）
-                    if data.get('done', False):
-                        break
-            
-            # 如果已停止生成，则退出主循环
-            if not is_generating:
-                update_status("生成已停止")
-                break
-                
-            # 更新已生成的内容
-            generated_content += new_content
-            
-            # 检查是否应该继续生成
-            if not is_generating:
-                update_status("生成已停止")
-                break
-                
-            # 模拟文本处理的延迟，避免过快请求
-            root.after(1000)
-        
-        if is_generating and is_writing_complete(generated_content, target_word_count):
-            update_status(f"写作完成！共生成{len(generated_content)}字")
-            save_content_to_file()  # 自动保存内容
+        with RunProfile(cprofile_enabled) as profile:
+            completed = novel_engine.write_novel(
+                current_job,
+                on_story=show_story_chunk,
+                on_thinking=show_thinking_chunk,
+                on_status=post_status,
+                on_round=sync_generated_content,
+                resume=bool(resume_session),
+                on_retract=retract_story_chunk
+            )
+        generated_content = current_job.generated_content
+        log_ui_stats()
+        
+        if is_generating and completed:
+            post_status(f"写作完成！共生成{len(generated_content)}字")
+            filepath = save_content_to_file(current_job.user_prompt)  # 自动保存内容
+            if filepath:
+                NOVELS_COMPLETED.inc()  # 之后应用修改再保存时不重复计数
+            profile.dump_next_to(filepath)
             
         elif not is_generating:
-            update_status(f"用户已停止生成。当前已生成{len(generated_content)}字")
-            save_content_to_file()  # 自动保存内容
+            post_status(f"用户已停止生成。当前已生成{len(generated_content)}字")
+            profile.dump_next_to(save_content_to_file(current_job.user_prompt))  # 自动保存内容
         
     except requests.exceptions.RequestException as e:
-        output_text.insert(tk.END, f"Error: {str(e)}\n")
-        update_status("生成过程出错")
+        ERRORS.inc(stage="generation", type=type(e).__name__)
+        ui_pipeline.put("story", f"Error: {str(e)}\n")
+        post_status("生成过程出错")
     except Exception as e:
-        output_text.insert(tk.END, f"Error: {str(e)}\n")
-        update_status("生成过程出错")
+        ERRORS.inc(stage="generation", type=type(e).__name__)
+        ui_pipeline.put("story", f"Error: {str(e)}\n")
+        post_status("生成过程出错")
     finally:
         is_generating = False
 
+
 # 定期更新状态的函数
 def periodic_status_update():
     global update_timer
     if is_generating:
-        word_count = len(re.findall(r'[\u4e00-\u9fff]', generated_content)) + len(re.findall(r'\b[a-zA-Z]+\b', generated_content))
+        # 增量统计的字数，包含本轮正在流式生成的内容，查询为O(1)
+        word_count = current_job.word_counter.total if current_job else 0
         update_status(f"正在生成中...当前已生成约{word_count}字")
+        # 实时生成速度（最近几秒内每秒收到的token数）
+        timer = current_job.stream_timer if current_job else None
+        speed = timer.tokens_per_second if timer else 0.0
+        speed_label.config(text=f"{speed:.1f} tokens/s" if speed else "-- tokens/s")
         # 每500毫秒更新一次状态
         update_timer = root.after(500, periodic_status_update)
     else:
+        speed_label.config(text="-- tokens/s")
         # 如果不再生成，则停止定期更新
         if update_timer:
             root.after_cancel(update_timer)
             update_timer = None
 
 # 调用模型并更新显示区域的函数
-def generate_text():
+def generate_text(resume_session=None):
     global generated_content, is_generating, update_timer
     
     if is_generating:
         messagebox.showinfo("提示", "正在生成中，请稍候...")
         return
     
+    # 在主线程中读取输入框，生成线程不访问Tk控件
+    user_prompt = prompt_entry.get("1.0", tk.END).strip()
+    target_word_count = None
+    if resume_session is None:
+        try:
+            target_word_count = int(word_count_entry.get())
+        except ValueError:
+            messagebox.showerror("错误", "请输入有效的目标字数")
+            return
+    novel_engine.config["generation_mode"] = "outline" if outline_mode_var.get() else "serial"
+    
     is_generating = True
     
     # 开始定期更新状态
     periodic_status_update()
     
     # 创建一个新线程来执行生成过程
-    thread = threading.Thread(target=generate_text_thread)
+    thread = threading.Thread(target=generate_text_thread, args=(resume_session, user_prompt, target_word_count))
     thread.daemon = True
     thread.start()
 
@@ -354,8 +300,150 @@ def generate_text():
 def stop_generation():
     global is_generating
     is_generating = False
+    if current_job:
+        current_job.stop()
     update_status("用户已停止生成")
 
+# 启动时检查上次意外退出时未完成的小说，询问是否继续写作
+def recover_unfinished_novels():
+    sessions = find_unfinished_sessions(checkpoint_dir)
+    if not sessions:
+        return
+    session = sessions[-1]
+    recovered_words = count_words(session["content"])
+    if not messagebox.askyesno(
+            "恢复未完成的小说",
+            f"发现{len(sessions)}篇上次未完成的小说。\n"
+            f"最近一篇已写{recovered_words}字，目标{session['target_word_count']}字，是否继续写作？"):
+        return
+    prompt_entry.delete("1.0", tk.END)
+    prompt_entry.insert("1.0", session["user_prompt"])
+    word_count_entry.delete(0, tk.END)
+    word_count_entry.insert(0, str(session["target_word_count"]))
+    generate_text(resume_session=session)
+
+# 显示各阶段的耗时统计，同时写入日志
+def show_stage_report():
+    report = PROFILER.report() + "\n\n" + novel_engine.residency.report()
+    if novel_engine.requirement_pool:
+        report += "\n" + novel_engine.requirement_pool.report()
+    if novel_engine.deduplicator:
+        report += "\n" + novel_engine.deduplicator.report()
+    logger.info(report)
+    report_window = tk.Toplevel(root)
+    report_window.title("阶段耗时统计")
+    report_text = scrolledtext.ScrolledText(report_window, width=90, height=18, font=('Consolas', 10))
+    report_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+    report_text.insert(tk.END, report)
+    report_text.config(state=tk.DISABLED)
+
+# 小说库检索面板：按关键词（写作要求和正文全文检索）、评分、字数和日期筛选，双击打开小说
+def show_library_panel():
+    library = novel_engine.library
+    if library is None:
+        messagebox.showinfo("提示", "未启用小说库（library_db 为 None）")
+        return
+    window = tk.Toplevel(root)
+    window.title("小说库")
+    window.geometry("900x600")
+
+    filter_frame = tk.Frame(window)
+    filter_frame.pack(fill=tk.X, padx=10, pady=5)
+    fields = {}
+    for label, name, width in (("关键词", "text", 24), ("最低评分", "min_score", 5), ("最少字数", "min_words", 7)):
+        tk.Label(filter_frame, text=label).pack(side=tk.LEFT)
+        fields[name] = tk.Entry(filter_frame, width=width)
+        fields[name].pack(side=tk.LEFT, padx=(2, 10))
+    days_var = tk.StringVar(value="全部")
+    tk.Label(filter_frame, text="日期").pack(side=tk.LEFT)
+    ttk.Combobox(filter_frame, textvariable=days_var, width=8, state="readonly",
+                 values=("全部", "今天", "最近7天", "最近30天")).pack(side=tk.LEFT, padx=(2, 10))
+    order_var = tk.StringVar(value="时间")
+    tk.Label(filter_frame, text="排序").pack(side=tk.LEFT)
+    ttk.Combobox(filter_frame, textvariable=order_var, width=5, state="readonly",
+                 values=("时间", "字数", "评分")).pack(side=tk.LEFT, padx=(2, 10))
+
+    columns = ("created_at", "word_count", "score", "user_prompt")
+    tree = ttk.Treeview(window, columns=columns, show="headings")
+    for column, heading, width in zip(columns, ("时间", "字数", "评分", "写作要求"), (140, 70, 60, 600)):
+        tree.heading(column, text=heading)
+        tree.column(column, width=width, anchor=tk.W if column == "user_prompt" else tk.CENTER)
+    tree.pack(fill=tk.BOTH, expand=True, padx=10)
+    summary_label = tk.Label(window, anchor=tk.W)
+    summary_label.pack(fill=tk.X, padx=10, pady=5)
+    paths = {}
+
+    def number(name, cast):
+        value = fields[name].get().strip()
+        return cast(value) if value else None
+
+    def search():
+        try:
+            filters = {"text": fields["text"].get().strip() or None,
+                       "min_score": number("min_score", float), "min_words": number("min_words", int)}
+        except ValueError:
+            messagebox.showerror("错误", "评分和字数必须是数字", parent=window)
+            return
+        days = {"今天": 1, "最近7天": 7, "最近30天": 30}.get(days_var.get())
+        if days:
+            filters["since"] = time.time() - days * 86400
+        order_by = {"时间": "created_at", "字数": "word_count", "评分": "score"}[order_var.get()]
+        try:
+            rows = library.search(order_by=order_by, limit=500, **filters)
+            total = library.count(**filters)
+        except sqlite3.Error as e:
+            messagebox.showerror("错误", f"检索小说库出错：{str(e)}", parent=window)
+            return
+        tree.delete(*tree.get_children())
+        paths.clear()
+        for row in rows:
+            item = tree.insert("", tk.END, values=(
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(row["created_at"])), row["word_count"],
+                "" if row["score"] is None else f"{row['score']:g}", (row["user_prompt"] or "").replace("\n", " ")))
+            paths[item] = row
+        summary_label.config(text=f"共{total}篇" + (f"，显示前{len(rows)}篇" if total > len(rows) else ""))
+
+    def open_selected(event=None):
+        selection = tree.selection()
+        if not selection:
+            return
+        row = paths[selection[0]]
+        try:
+            novel = novel_engine.read_novel(row["path"])
+        except (OSError, ValueError) as e:
+            messagebox.showerror("错误", f"打开小说失败：{str(e)}", parent=window)
+            return
+        viewer = tk.Toplevel(window)
+        viewer.title(os.path.basename(row["path"]))
+        text = scrolledtext.ScrolledText(viewer, width=90, height=30, font=('Microsoft YaHei UI', 11), wrap=tk.WORD)
+        text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        if row["user_prompt"]:
+            text.insert(tk.END, f"写作要求：{row['user_prompt']}\n\n")
+        text.insert(tk.END, novel["content"])
+        if novel["thinking"]:
+            text.insert(tk.END, f"\n\n====== 思维推理内容 ======\n{novel['thinking']}")
+        if row["evaluation"]:
+            text.insert(tk.END, f"\n\n====== 质量评估 ======\n{row['evaluation']}")
+        text.config(state=tk.DISABLED)
+
+    # 导入启用小说库之前保存的小说（在后台线程中读取文件）
+    def import_existing():
+        def run():
+            try:
+                imported = novel_engine.library.import_directory("generated_novels")
+                ui_pipeline.call(lambda: (update_status(f"已导入{imported}篇小说"), search()))
+            except (OSError, sqlite3.Error) as e:
+                post_status(f"导入小说出错：{str(e)}")
+        update_status("正在导入已有的小说...")
+        threading.Thread(target=run, daemon=True).start()
+
+    tk.Button(filter_frame, text="检索", command=search).pack(side=tk.LEFT, padx=5)
+    tk.Button(filter_frame, text="导入已有小说", command=import_existing).pack(side=tk.LEFT, padx=5)
+    for entry in fields.values():
+        entry.bind("<Return>", lambda event: search())
+    tree.bind("<Double-1>", open_selected)
+    search()
+
 # 自动生成的处理函数
 def auto_generate():
     global is_auto_generating
@@ -366,10 +454,10 @@ def auto_generate():
     
     is_auto_generating = True
     auto_generate_button.config(text="停止自动生成")
+    novel_engine.start_requirement_pool()  # 空闲时在后台补充写作要求池
     
     # 开始第一轮生成
-    if generate_user_prompt():
-        generate_text()
+    generate_prompt_and_write()
 
 # 停止自动生成
 def stop_auto_generate():
@@ -408,12 +496,9 @@ def evaluate_novel_quality():
     # 检查Ollama服务可用性
     try:
         logger.info("检查Ollama服务可用性...")
-        response = requests.get('http://localhost:11434/api/tags', timeout=5)
-        response.raise_for_status()
+        model_names = novel_engine.list_models()
         
         # 检查评估模型是否可用
-        models = response.json().get("models", [])
-        model_names = [model.get("name") for model in models]
         
         if evaluation_model_name not in model_names:
             logger.warning(f"评估模型 {evaluation_model_name} 不在可用模型列表中")
@@ -427,107 +512,48 @@ def evaluate_novel_quality():
             update_status("评估已取消")
             return
     
-    # 创建一个新线程来执行评估过程
-    thread = threading.Thread(target=evaluate_novel_thread)
+    # 创建一个新线程来执行评估过程（输入框和选项在主线程中读取）
+    thread = threading.Thread(target=evaluate_novel_thread,
+                              args=(prompt_entry.get("1.0", tk.END).strip(), generated_content, bypass_cache_var.get()))
     thread.daemon = True
     thread.start()
     logger.info("评估线程已启动")
 
-# 评估小说质量的线程函数
-def evaluate_novel_thread():
+# 评估小说质量的线程函数；参数由 evaluate_novel_quality 在主线程中读取，本线程不访问Tk控件
+def evaluate_novel_thread(user_prompt, content, bypass_cache):
     global is_evaluating
     
     try:
         logger.info("开始小说质量评估过程")
-        user_prompt = prompt_entry.get("1.0", tk.END).strip()
-        
-        # 构造评估提示词
-        evaluation_prompt = f'''
-        请对以下小说内容进行专业的质量评估，基于以下几个方面:
-        1. 情节连贯性和合理性
-        2. 人物刻画和发展
-        3. 写作风格和语言表达
-        4. 创意性和独特性
-        5. 与用户写作要求的符合度
-        
-        ## 用户的写作要求:
-        {user_prompt}
-        
-        ## 小说内容:
-        {generated_content[:2000]}...（内容较长，此处截断）
-        
-        请给出详细评价，并提出具体的改进建议。评分标准为1-10分，请在每个方面打分，并给出总体评分。
-        格式要求:
-        - 总体评分: X/10
-        - 情节评分: X/10
-        - 人物评分: X/10
-        - 语言评分: X/10
-        - 创意评分: X/10
-        - 需求符合度: X/10
-        
-        ## 详细点评:
-        [详细说明优点和不足]
-        
-        ## 具体改进建议:
-        [列出3-5条具体的改进建议]
-        '''
         
-        logger.info(f"评估提示词长度: {len(evaluation_prompt)} 字符")
-        
-        # 准备请求参数
-        api_url = 'http://localhost:11434/api/generate'
-        request_data = {
-            "model": evaluation_model_name,
-            "prompt": evaluation_prompt,
-            "temperature": 0.3,  # 使用较低的温度以获得更客观的评估
-            "stream": False,
-            "options": {
-                "num_ctx": 4096  # 增加上下文窗口大小
-            }
-        }
-        
-        logger.info(f"使用评估模型: {evaluation_model_name}")
-        logger.info("发送评估请求...")
-        
-        # 记录请求开始时间
-        start_time = time.time()
-        
-        # 发送请求并增加超时时间
-        response = requests.post(api_url, json=request_data, timeout=600)
-        
-        # 记录请求结束时间和耗时
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        logger.info(f"评估请求完成，耗时: {elapsed_time:.2f} 秒")
-        
-        response.raise_for_status()
-        
-        # 获取评估结果
-        result = response.json()
-        evaluation_result = result.get('response', '').strip()
+        # 发送评估请求（评估提示词的构造和耗时记录在引擎中完成）；内容未变时使用缓存的结果
+        cache_notes = []
+        evaluation_result = novel_engine.evaluate_novel(user_prompt, content,
+                                                        bypass_cache=bypass_cache,
+                                                        on_status=cache_notes.append)
         
         logger.info(f"成功获取评估结果，长度: {len(evaluation_result)} 字符")
         
         # 显示评估结果
-        root.after(0, lambda: show_evaluation_result(evaluation_result))
+        ui_pipeline.call(lambda: show_evaluation_result(evaluation_result))
         
-        update_status("小说质量评估完成")
+        post_status("小说质量评估完成" + (f"（{cache_notes[-1]}）" if cache_notes else ""))
     except requests.exceptions.Timeout as e:
         error_message = f"评估请求超时: {str(e)}"
         logger.error(error_message)
-        root.after(0, lambda: messagebox.showerror("超时错误", f"评估过程超时: {str(e)}\n\n请检查以下可能的原因:\n1. 模型 '{evaluation_model_name}' 是否已加载\n2. Ollama服务器是否正常运行\n3. 是否有其他进程占用了大量资源"))
-        root.after(0, lambda: update_status("评估过程超时"))
+        post_error("超时错误", f"评估过程超时: {str(e)}\n\n请检查以下可能的原因:\n1. 模型 '{evaluation_model_name}' 是否已加载\n2. Ollama服务器是否正常运行\n3. 是否有其他进程占用了大量资源")
+        post_status("评估过程超时")
     except requests.exceptions.ConnectionError as e:
         error_message = f"评估请求连接错误: {str(e)}"
         logger.error(error_message)
-        root.after(0, lambda: messagebox.showerror("连接错误", f"无法连接到Ollama服务: {str(e)}\n\n请检查Ollama服务是否正在运行"))
-        root.after(0, lambda: update_status("评估连接失败"))
+        post_error("连接错误", f"无法连接到Ollama服务: {str(e)}\n\n请检查Ollama服务是否正在运行")
+        post_status("评估连接失败")
     except Exception as e:
         error_message = f"评估过程出错: {str(e)}"
         logger.error(error_message)
         logger.exception("评估过程详细错误")
-        root.after(0, lambda: messagebox.showerror("错误", f"评估过程出错: {str(e)}"))
-        root.after(0, lambda: update_status("评估过程出错"))
+        post_error("错误", f"评估过程出错: {str(e)}")
+        post_status("评估过程出错")
     finally:
         is_evaluating = False
         logger.info("评估过程结束")
@@ -637,63 +663,30 @@ def generate_revision_suggestions(evaluation_result):
     
     update_status("正在生成修改建议...")
     
-    # 创建一个新线程来执行修改建议生成
-    thread = threading.Thread(target=lambda: revision_suggestions_thread(evaluation_result))
+    # 创建一个新线程来执行修改建议生成（输入框和选项在主线程中读取）
+    user_prompt = prompt_entry.get("1.0", tk.END).strip()
+    bypass_cache = bypass_cache_var.get()
+    thread = threading.Thread(target=lambda: revision_suggestions_thread(evaluation_result, user_prompt,
+                                                                         generated_content, bypass_cache))
     thread.daemon = True
     thread.start()
 
-# 生成修改建议的线程函数
-def revision_suggestions_thread(evaluation_result):
+# 生成修改建议的线程函数（不访问Tk控件，显示交给主循环）
+def revision_suggestions_thread(evaluation_result, user_prompt, content, bypass_cache):
     try:
-        user_prompt = prompt_entry.get("1.0", tk.END).strip()
-        
-        # 构造修改建议提示词
-        revision_prompt = f'''
-        你是一个专业的小说编辑，请基于以下评估报告，对小说内容提供具体的修改建议。
-        
-        ## 小说评估报告：
-        {evaluation_result}
-        
-        ## 原始写作要求：
-        {user_prompt}
-        
-        ## 小说内容：
-        {generated_content}
-        
-        请针对评估报告中指出的问题，提供以下内容：
-        1. 对小说结构的修改建议
-        2. 对情节发展的改进方案
-        3. 对人物刻画的增强建议
-        4. 对语言表达的优化方案
-        5. 提供3个具体的修改示例，包括原文和修改后的对比
-        
-        请确保你的建议是具体且可操作的，而不是笼统的指导。
-        '''
-        
-        # 准备请求参数
-        api_url = 'http://localhost:11434/api/generate'
-        request_data = {
-            "model": evaluation_model_name,
-            "prompt": revision_prompt,
-            "temperature": 0.4,
-            "stream": False
-        }
-        
-        # 发送请求
-        response = requests.post(api_url, json=request_data, timeout=600)
-        response.raise_for_status()
-        
         # 获取修改建议
-        result = response.json()
-        revision_suggestions = result.get('response', '').strip()
+        cache_notes = []
+        revision_suggestions = novel_engine.revision_suggestions(user_prompt, content, evaluation_result,
+                                                                 bypass_cache=bypass_cache,
+                                                                 on_status=cache_notes.append)
         
         # 显示修改建议
-        show_revision_suggestions(revision_suggestions)
+        ui_pipeline.call(lambda: show_revision_suggestions(revision_suggestions))
         
-        update_status("修改建议生成完成")
+        post_status("修改建议生成完成" + (f"（{cache_notes[-1]}）" if cache_notes else ""))
     except Exception as e:
-        messagebox.showerror("错误", f"生成修改建议时出错: {str(e)}")
-        update_status("生成修改建议时出错")
+        post_error("错误", f"生成修改建议时出错: {str(e)}")
+        post_status("生成修改建议时出错")
 
 # 显示修改建议的函数
 def show_revision_suggestions(suggestions):
@@ -779,93 +772,51 @@ def apply_revisions(suggestions):
     
     update_status("正在应用修改...")
     
-    # 创建一个新线程来执行应用修改
-    thread = threading.Thread(target=lambda: apply_revisions_thread(suggestions))
+    # 创建一个新线程来执行应用修改（写作要求在主线程中读取）
+    user_prompt = prompt_entry.get("1.0", tk.END).strip()
+    thread = threading.Thread(target=lambda: apply_revisions_thread(suggestions, user_prompt))
     thread.daemon = True
     thread.start()
 
-# 应用修改的线程函数
-def apply_revisions_thread(suggestions):
-    global generated_content, thinking_content
+# 应用修改的线程函数（不访问Tk控件，显示交给主循环）
+def apply_revisions_thread(suggestions, user_prompt):
+    global generated_content, thinking_content, current_job
     
     try:
-        user_prompt = prompt_entry.get("1.0", tk.END).strip()
-        
-        # 构造修改提示词
-        revision_prompt = f'''
-        你是一个专业的小说编辑和作家，请基于以下修改建议，重写小说内容。
-        
-        ## 原始写作要求：
-        {user_prompt}
-        
-        ## 原始小说内容：
-        {generated_content}
-        
-        ## 修改建议：
-        {suggestions}
-        
-        请根据以上修改建议，重写整个小说。保留原有的故事框架和主要情节，但根据修改建议进行优化和改进。
-        注意：
-        1. 请直接输出修改后的完整小说内容，不要包含任何解释或说明
-        2. 优化情节、人物和语言表达，但保持故事的连贯性和原意
-        3. 保持适当的篇幅，不要过度缩减或扩展内容
-        4. 使用流畅的中文写作
-        5. 你可以使用<think></think>标签来表示你的思考过程，这部分内容不会出现在最终故事中。
-        '''
-        
-        # 准备请求参数
-        api_url = 'http://localhost:11434/api/generate'
-        request_data = {
-            "model": writing_model_name,
-            "prompt": revision_prompt,
-            "temperature": 0.5,
-            "stream": True
-        }
+        # 修改的是当前显示的内容；若它不是最近一次生成的结果，则为其新建生成状态
+        if current_job is None or current_job.generated_content != generated_content:
+            current_job = novel_engine.new_job(user_prompt)
+            current_job.set_content(generated_content)
+        current_job.user_prompt = user_prompt
         
         # 清空显示区域
-        output_text.delete(1.0, tk.END)
-        thinking_text.delete(1.0, tk.END)
-        revised_content = ""
+        ui_pipeline.call(clear_output_areas)
+        ui_pipeline.call(ui_pipeline.reset_stats)
         thinking_content = ""
         
-        # 发送请求并获取流式响应
-        response = requests.post(api_url, json=request_data, stream=True, timeout=120)
-        response.raise_for_status()
-        
-        # 处理流式响应
-        for line in response.iter_lines():
-            if line:
-                # 解析 JSON 数据
-                data = json.loads(line.decode('utf-8'))
-                # 提取 response 字段
-                text_chunk = data.get('response', '')
-                
-                # 处理文本块，分离思维推理和正式内容
-                story_chunk = process_text_chunk(text_chunk)
-                
-                # 更新显示区域（仅显示正式内容）
-                if story_chunk:
-                    output_text.insert(tk.END, story_chunk)
-                    output_text.see(tk.END)  # 自动滚动到最新内容
-                    # 累积新内容
-                    revised_content += story_chunk
-                
-                root.update_idletasks()  # 更新UI
-                
-                # 检查是否完成
-                if data.get('done', False):
-                    break
-        
-        # 更新生成的内容
+        # 流式重写小说（若模型上下文仍对应当前内容，引擎只发送修改建议）
+        revised_content = novel_engine.revise_novel(
+            current_job,
+            suggestions,
+            on_story=show_story_chunk,
+            on_thinking=show_thinking_chunk
+        )
+        log_ui_stats()
+        if revised_content is None:
+            # 修改被停止：恢复显示修改前的内容，不保存
+            ui_pipeline.call(clear_output_areas)
+            ui_pipeline.put("story", generated_content)
+            post_status("已停止修改，保留修改前的内容")
+            return
         generated_content = revised_content
         
         # 保存修改后的内容
-        save_content_to_file()
+        save_content_to_file(user_prompt)
         
-        update_status("小说内容已修改并保存")
+        post_status("小说内容已修改并保存")
     except Exception as e:
-        messagebox.showerror("错误", f"应用修改时出错: {str(e)}")
-        update_status("应用修改时出错")
+        post_error("错误", f"应用修改时出错: {str(e)}")
+        post_status("应用修改时出错")
 
 # 修改update_status函数以支持更多状态样式
 def update_status(message):
@@ -1107,6 +1058,32 @@ word_count_entry = tk.Entry(
 word_count_entry.pack(side=tk.TOP, anchor='w', pady=(0, 8))
 word_count_entry.insert(0, "3000")
 
+# 大纲并行模式：先生成章节大纲，再同时生成多个章节
+outline_mode_var = tk.BooleanVar(value=False)
+outline_mode_check = tk.Checkbutton(
+    settings_frame,
+    text="大纲并行",
+    variable=outline_mode_var,
+    font=('Microsoft YaHei UI', 10),
+    bg='#ffffff',
+    fg='#333333',
+    activebackground='#ffffff'
+)
+outline_mode_check.pack(side=tk.TOP, anchor='w', pady=(0, 8))
+
+# 勾选后质量评估和修改建议不使用缓存的结果，重新请求模型
+bypass_cache_var = tk.BooleanVar(value=False)
+bypass_cache_check = tk.Checkbutton(
+    settings_frame,
+    text="评估忽略缓存",
+    variable=bypass_cache_var,
+    font=('Microsoft YaHei UI', 10),
+    bg='#ffffff',
+    fg='#333333',
+    activebackground='#ffffff'
+)
+bypass_cache_check.pack(side=tk.TOP, anchor='w', pady=(0, 8))
+
 # 创建控制按钮区域，使用卡片式设计
 button_card = tk.Frame(main_container, bg='#ffffff', relief=tk.RAISED, bd=1)
 button_card.pack(fill=tk.X, padx=5, pady=5)
@@ -1226,6 +1203,38 @@ evaluation_button = tk.Button(
 )
 evaluation_button.pack(side=tk.LEFT, padx=5)
 
+# 添加阶段耗时按钮
+stage_report_button = tk.Button(
+    button_frame,
+    text="阶段耗时",
+    command=show_stage_report,
+    font=('Microsoft YaHei UI', 10, 'bold'),
+    bg='#607d8b',
+    fg='white',
+    relief=tk.RAISED,
+    bd=0,
+    padx=5,
+    pady=5,
+    cursor="hand2"
+)
+stage_report_button.pack(side=tk.LEFT, padx=5)
+
+# 添加小说库按钮
+library_button = tk.Button(
+    button_frame,
+    text="小说库",
+    command=show_library_panel,
+    font=('Microsoft YaHei UI', 10, 'bold'),
+    bg='#795548',
+    fg='white',
+    relief=tk.RAISED,
+    bd=0,
+    padx=5,
+    pady=5,
+    cursor="hand2"
+)
+library_button.pack(side=tk.LEFT, padx=5)
+
 # 添加退出按钮
 exit_button = tk.Button(
     button_frame,
@@ -1242,6 +1251,20 @@ exit_button = tk.Button(
 )
 exit_button.pack(side=tk.RIGHT, padx=5)
 
+# 实时生成速度标签
+speed_label = tk.Label(
+    button_frame,
+    text="-- tokens/s",
+    font=('Microsoft YaHei UI', 10),
+    bg='#e8e8e8',
+    fg='#333333',
+    relief=tk.GROOVE,
+    width=14,
+    padx=5,
+    pady=5
+)
+speed_label.pack(side=tk.RIGHT, padx=5)
+
 # 添加状态标签（放在按钮右边）
 status_label = tk.Label(
     button_frame,
@@ -1326,5 +1349,18 @@ scrollbar2 = ttk.Scrollbar(thinking_text)
 thinking_text.config(yscrollcommand=scrollbar2.set)
 scrollbar2.config(command=thinking_text.yview)
 
+# 流式文本的界面更新队列：生成线程只负责入队，主循环按帧合并插入
+ui_pipeline = UIUpdatePipeline(root, ui_frame_interval_ms)
+ui_pipeline.register("story", lambda: output_text)
+ui_pipeline.register("thinking", lambda: thinking_text)
+ui_pipeline.start()
+if metrics_port:
+    start_metrics_server(metrics_port)
+root.after(500, recover_unfinished_novels)
+# 在后台预加载写作和评估模型，不阻塞界面
+if novel_engine.warm_up(on_done=lambda: post_status("模型预加载完成")):
+    update_status("正在后台预加载模型...")
+
 # 启动主循环
-root.mainloop() 
\ No newline at end of file
+root.mainloop()
+CassetteRecorder.close_all()  # 写完磁带中剩余的内容 
\ No newline at end of file